@@ -0,0 +1,80 @@
+from __future__ import annotations
+
+import argparse
+import random
+import shutil
+import sys
+import tempfile
+import time
+import zipfile
+from pathlib import Path
+
+_REPO_ROOT = Path(__file__).resolve().parents[1]
+if str(_REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(_REPO_ROOT))
+
+from data_ingestion.common import extract_zip  # noqa: E402
+from data_ingestion.extraction import extract_zip_parallel  # noqa: E402
+
+
+def make_zip(path: Path, *, n_members: int, member_bytes: int, seed: int = 0) -> None:
+    """Synthetic stand-in for mini_speech_commands: many ~32 KB members in label dirs."""
+    rng = random.Random(seed)
+    labels = ["down", "go", "left", "no", "right", "stop", "up", "yes"]
+    # Little-endian int16 noise within about +-512: random low bytes, high bytes mostly 0x00/0xff (sign).
+    # Like recorded speech PCM it deflates only modestly, so inflating costs real CPU time.
+    high_bytes = bytes([0x00, 0xff] * 96 + [0x01, 0xfe] * 32)
+    samples = member_bytes // 2
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zf:
+        for i in range(n_members):
+            label = labels[i % len(labels)]
+            payload = bytearray(2 * samples)
+            payload[0::2] = rng.randbytes(samples)
+            payload[1::2] = rng.randbytes(samples).translate(high_bytes)
+            zf.writestr(f"mini_speech_commands/{label}/{i:06d}_nohash_0.wav", payload)
+
+
+def time_extract(archive: Path, work: Path, *, workers: int, executor: str, repeats: int) -> float:
+    best = float("inf")
+    for _ in range(repeats):
+        dst = work / f"out_{workers}_{executor}"
+        shutil.rmtree(dst, ignore_errors=True)
+        t0 = time.perf_counter()
+        if workers > 1:
+            extract_zip_parallel(archive_path=archive, dst_dir=dst, workers=workers, executor=executor)  # type: ignore[arg-type]
+        else:
+            extract_zip(archive_path=archive, dst_dir=dst)
+        best = min(best, time.perf_counter() - t0)
+        shutil.rmtree(dst, ignore_errors=True)
+    return best
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Compare ZipFile.extractall with the parallel extract_zip mode on a synthetic archive."
+    )
+    parser.add_argument("--members", type=int, default=8000)
+    parser.add_argument("--member-bytes", type=int, default=32 * 1024)
+    parser.add_argument("--workers", type=int, nargs="+", default=[2, 4, 8])
+    parser.add_argument("--executor", choices=["process", "thread"], nargs="+", default=["process", "thread"])
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="bench_extract_zip_") as tmp:
+        work = Path(tmp)
+        archive = work / "synthetic.zip"
+        make_zip(archive, n_members=args.members, member_bytes=args.member_bytes)
+        print(f"archive: {args.members} members, {archive.stat().st_size / 1e6:.1f} MB compressed")
+
+        baseline = time_extract(archive, work, workers=1, executor="process", repeats=args.repeats)
+        print(f"{'extractall':<18} {baseline:8.3f} s  {args.members / baseline:10.0f} files/s  1.00x")
+        for executor in args.executor:
+            for workers in args.workers:
+                t = time_extract(archive, work, workers=workers, executor=executor, repeats=args.repeats)
+                label = f"{executor} x{workers}"
+                print(f"{label:<18} {t:8.3f} s  {args.members / t:10.0f} files/s  {baseline / t:.2f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,332 @@
+from __future__ import annotations
+
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from collections.abc import Callable
+from dataclasses import asdict, dataclass, replace
+from pathlib import Path
+
+import numpy as np
+
+_REPO_ROOT = Path(__file__).resolve().parents[1]
+if str(_REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(_REPO_ROOT))
+
+from data_ingestion.timing import peak_rss_bytes, reset_peak_rss  # noqa: E402
+from utils.cpu_inference import MODES, CPUInferenceConfig  # noqa: E402
+
+PIPELINES = ("asr", "sentiment", "clip")
+# Small enough to build in well under a second, large enough that the forward pass dominates.
+TINY_CONFIGS: dict[str, dict] = {
+    "asr": {"hidden_size": 64, "num_hidden_layers": 2, "num_attention_heads": 4, "intermediate_size": 128,
+            "conv_dim": (32, 32, 32), "conv_stride": (5, 4, 4), "conv_kernel": (10, 8, 8),
+            "num_conv_pos_embeddings": 16, "num_conv_pos_embedding_groups": 4, "num_labels": 8},
+    "sentiment": {"vocab_size": 1000, "dim": 64, "hidden_dim": 128, "n_layers": 2, "n_heads": 4, "num_labels": 2},
+    "clip": {"text_config": {"hidden_size": 64, "intermediate_size": 128, "num_hidden_layers": 2,
+                             "num_attention_heads": 4},
+             "vision_config": {"hidden_size": 64, "intermediate_size": 128, "num_hidden_layers": 2,
+                               "num_attention_heads": 4, "image_size": 224, "patch_size": 32},
+             "projection_dim": 32},
+}
+WORDS = ("the movie film plot acting great bad good story characters scene director "
+         "boring brilliant terrible wonderful ending music performance script").split()
+
+
+@dataclass(frozen=True)
+class InferenceResult:
+    pipeline: str
+    cpu_mode: str
+    batch_size: int
+    processes: int
+    threads: int
+    samples: int
+    batches: int
+    wall_s: float
+    samples_per_s: float
+    # samples_per_s / (processes x the single-process rate at the same mode, threads and batch size).
+    scaling_efficiency: float | None
+    # Per-batch latencies (and batches) are only observable in-process: None (0) for sharded runs.
+    p50_batch_ms: float | None
+    p95_batch_ms: float | None
+    p99_batch_ms: float | None
+    peak_rss_bytes: int | None
+    # True when peak_rss_bytes covers only this configuration (resettable high-water mark, Linux).
+    peak_rss_per_run: bool
+    extra: dict
+
+
+class BatchTimer:
+    """Times every forward call of one module (the per-batch model call inside run_inference)."""
+
+    def __init__(self, module) -> None:
+        self.latencies: list[float] = []
+        self._t0 = 0.0
+        self._handles = [
+            module.register_forward_pre_hook(self._start),
+            module.register_forward_hook(self._stop),
+        ]
+
+    def _start(self, *_: object) -> None:
+        self._t0 = time.perf_counter()
+
+    def _stop(self, *_: object) -> None:
+        self.latencies.append(time.perf_counter() - self._t0)
+
+    def remove(self) -> None:
+        for h in self._handles:
+            h.remove()
+
+
+def _percentile_ms(samples: list[float], q: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    k = (len(ordered) - 1) * q
+    lo, hi = int(k), min(int(k) + 1, len(ordered) - 1)
+    return round((ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)) * 1e3, 3)
+
+
+def speech_commands_lengths(rng: np.random.Generator, n: int, full_share: float = 0.9) -> list[int]:
+    """Clip lengths shaped like mini_speech_commands: mostly exactly 1 s at 16 kHz, the rest shorter."""
+    return [16_000 if rng.random() < full_share else int(rng.integers(8_000, 16_000)) for _ in range(n)]
+
+
+def _word_vocab(work: Path) -> Path:
+    """A WordPiece vocab covering WORDS, so tokenizers can be built without the hub."""
+    path = work / "vocab.txt"
+    path.write_text("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]", *WORDS]) + "\n", encoding="utf-8")
+    return path
+
+
+def _clip_tokenizer(work: Path):
+    from transformers import CLIPTokenizer
+
+    vocab = {"<|startoftext|>": 0, "<|endoftext|>": 1}
+    for ch in "abcdefghijklmnopqrstuvwxyz":
+        vocab[ch] = len(vocab)
+        vocab[ch + "</w>"] = len(vocab)
+    (work / "clip_vocab.json").write_text(json.dumps(vocab), encoding="utf-8")
+    (work / "clip_merges.txt").write_text("#version: 0.2\n", encoding="utf-8")
+    return CLIPTokenizer(str(work / "clip_vocab.json"), str(work / "clip_merges.txt"))
+
+
+# Each builder returns (model, run, timed): run(batch_size, cpu_mode, processes, threads) calls the helper's
+# run_inference (run_inference_sharded for processes > 1) once over the synthetic inputs and returns extra fields
+# for the report; the submodule named `timed` runs once per batch.
+
+
+def build_asr(work: Path, samples: int, seed: int):
+    from transformers import Wav2Vec2Config, Wav2Vec2FeatureExtractor, Wav2Vec2ForSequenceClassification
+
+    from notebooks.asr_commands import helpers
+
+    model = Wav2Vec2ForSequenceClassification(Wav2Vec2Config(**TINY_CONFIGS["asr"])).eval()
+    # As superb/hubert-base-superb-ks: no attention mask, so run_inference batches clips of equal length.
+    feature_extractor = Wav2Vec2FeatureExtractor(do_normalize=True, return_attention_mask=False)
+    rng = np.random.default_rng(seed)
+    values = [rng.standard_normal(n).astype(np.float32) for n in speech_commands_lengths(rng, samples)]
+    test_ds = {"input_values": values, "label": rng.integers(0, 8, samples).tolist()}
+
+    def run(batch_size: int, cpu_mode: CPUInferenceConfig | None, processes: int, threads: int) -> dict:
+        if processes > 1:
+            *_, report = helpers.run_inference_sharded(model, feature_extractor, test_ds, processes=processes,
+                                                       threads=threads, batch_size=batch_size, cpu_mode=cpu_mode)
+            return {"utilization": report.utilization}
+        helpers.run_inference(model, feature_extractor, "cpu", test_ds, batch_size=batch_size, log_every=10**9,
+                              cpu_mode=cpu_mode)
+        return {}
+
+    return model, run, ""
+
+
+def build_sentiment(work: Path, samples: int, seed: int):
+    import pandas as pd
+    from transformers import BertTokenizerFast, DistilBertConfig, DistilBertForSequenceClassification
+
+    from notebooks.sentiment_embeddings import helpers
+
+    model = DistilBertForSequenceClassification(DistilBertConfig(**TINY_CONFIGS["sentiment"])).eval()
+    tokenizer = BertTokenizerFast(str(_word_vocab(work)))
+    rng = np.random.default_rng(seed)
+    # IMDB reviews run from a few dozen to several hundred words; truncated at 512 tokens.
+    texts = [" ".join(rng.choice(WORDS, int(rng.integers(30, 600)))) for _ in range(samples)]
+    test_df = pd.DataFrame({"text": texts, "sentiment_value": rng.integers(0, 2, samples)})
+
+    def run(batch_size: int, cpu_mode: CPUInferenceConfig | None, processes: int, threads: int) -> dict:
+        if processes > 1:
+            *_, report = helpers.run_inference_sharded(model, tokenizer, test_df, processes=processes,
+                                                       threads=threads, batch_size=batch_size, max_tokens=None,
+                                                       max_length=512, cpu_mode=cpu_mode)
+            return {"utilization": report.utilization}
+        helpers.run_inference(model, tokenizer, "cpu", test_df, batch_size=batch_size, max_tokens=None,
+                              max_length=512, log_every=10**9, cpu_mode=cpu_mode)
+        return {}
+
+    return model, run, ""
+
+
+def build_clip(work: Path, samples: int, seed: int):
+    from transformers import CLIPConfig, CLIPImageProcessor, CLIPModel, CLIPProcessor
+
+    from notebooks.clip_multimodal import helpers
+
+    model = CLIPModel(CLIPConfig(**TINY_CONFIGS["clip"])).eval()
+    processor = CLIPProcessor(image_processor=CLIPImageProcessor(), tokenizer=_clip_tokenizer(work))
+    rng = np.random.default_rng(seed)
+    images = rng.integers(0, 256, (samples, 32, 32, 3), dtype=np.uint8)
+    text_features = helpers.encode_texts(model, processor, "cpu", [f"a photo of a {c}" for c in "abcdefghij"])
+
+    def run(batch_size: int, cpu_mode: CPUInferenceConfig | None, processes: int, threads: int) -> dict:
+        if processes > 1:
+            _, report = helpers.run_inference_sharded(model, processor, images, text_features, processes=processes,
+                                                      threads=threads, batch_size=batch_size, cpu_mode=cpu_mode)
+            return {"utilization": report.utilization}
+        stats = helpers.PipelineStats(2)
+        helpers.run_inference(model, processor, "cpu", images, text_features, batch_size=batch_size,
+                              log_every=10**9, stats=stats, cpu_mode=cpu_mode)
+        return {"pipeline_stats": stats.as_dict()}
+
+    return model, run, "vision_model"
+
+
+BUILDERS: dict[str, Callable] = {"asr": build_asr, "sentiment": build_sentiment, "clip": build_clip}
+
+
+def bench_pipeline(
+    pipeline: str,
+    work: Path,
+    *,
+    samples: int,
+    batch_sizes: list[int],
+    threads: list[int],
+    repeats: int,
+    seed: int,
+    cpu_modes: list[str],
+    processes: list[int],
+) -> list[InferenceResult]:
+    import torch
+
+    from utils.cpu_inference import prepare_model
+
+    model, run, timed = BUILDERS[pipeline](work, samples, seed)
+    results = []
+    single: dict[tuple, float] = {}  # single-process samples/s per (mode, threads, batch size)
+    # Single-process runs go first so sharded rows can be compared against them.
+    for n_procs, cpu_mode, n_threads, batch_size in itertools.product(sorted(processes), cpu_modes, threads,
+                                                                      batch_sizes):
+        # The thread count under test overrides the mode's default_threads().
+        mode = None if cpu_mode == "fp32" else replace(MODES[cpu_mode], threads=n_threads)
+        # The helpers prepare the model the same way, so this is the very module they will call.
+        prepared = prepare_model(model, mode, compile_modules=(timed,) if timed else ())
+        timed_module = prepared.get_submodule(timed)
+        torch.set_num_threads(n_threads)
+        per_run_rss = reset_peak_rss()
+        with contextlib.redirect_stdout(io.StringIO()):
+            run(batch_size, mode, n_procs, n_threads)  # warm-up (allocator, kernels, tokenizer caches, compilation)
+        walls, latencies, extra = [], [], {}
+        for _ in range(repeats):
+            timer = BatchTimer(timed_module)
+            try:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    t0 = time.perf_counter()
+                    extra = run(batch_size, mode, n_procs, n_threads)
+                    walls.append(time.perf_counter() - t0)
+            finally:
+                timer.remove()
+            latencies.extend(timer.latencies)
+        wall = statistics.median(walls)
+        rate = samples / wall if wall > 0 else float("inf")
+        if n_procs == 1:
+            single[cpu_mode, n_threads, batch_size] = rate
+        base = single.get((cpu_mode, n_threads, batch_size))
+        sharded = n_procs > 1
+        result = InferenceResult(
+            pipeline=pipeline,
+            cpu_mode=cpu_mode,
+            batch_size=batch_size,
+            processes=n_procs,
+            threads=n_threads,
+            samples=samples,
+            batches=len(latencies) // repeats,
+            wall_s=round(wall, 4),
+            samples_per_s=round(rate, 2),
+            scaling_efficiency=round(rate / (n_procs * base), 3) if base else None,
+            p50_batch_ms=None if sharded else _percentile_ms(latencies, 0.50),
+            p95_batch_ms=None if sharded else _percentile_ms(latencies, 0.95),
+            p99_batch_ms=None if sharded else _percentile_ms(latencies, 0.99),
+            peak_rss_bytes=peak_rss_bytes(),
+            peak_rss_per_run=per_run_rss,
+            extra=extra,
+        )
+        results.append(result)
+        rss = f"{result.peak_rss_bytes / 2**20:7.0f} MiB" if result.peak_rss_bytes else "    n/a"
+        if sharded:
+            eff = f"{result.scaling_efficiency:.0%}" if result.scaling_efficiency is not None else "n/a"
+            detail = f"efficiency {eff:>5}  utilization {extra.get('utilization', 0):.0%}"
+        else:
+            detail = (f"p50 {result.p50_batch_ms:8.2f} ms  p95 {result.p95_batch_ms:8.2f} ms  "
+                      f"p99 {result.p99_batch_ms:8.2f} ms")
+        print(f"{pipeline:<10} {cpu_mode:<13} bs={batch_size:<4} procs={n_procs:<3} threads={n_threads:<3} "
+              f"{result.samples_per_s:10.1f} samples/s  {detail}  rss {rss}", flush=True)
+    return results
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Offline throughput benchmark for the notebooks' run_inference helpers on tiny random models."
+    )
+    parser.add_argument("--pipelines", nargs="+", choices=PIPELINES, default=list(PIPELINES))
+    parser.add_argument("--samples", type=int, default=256)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[8, 32, 64])
+    parser.add_argument("--threads", type=int, nargs="+", default=sorted({1, os.cpu_count() or 1}))
+    parser.add_argument("--cpu-modes", nargs="+", choices=sorted(MODES), default=["fp32"],
+                        help="CPU inference modes from utils/cpu_inference.py to compare.")
+    parser.add_argument("--processes", type=int, nargs="+", default=[1],
+                        help="Worker process counts; > 1 uses run_inference_sharded with --threads threads each.")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=Path, default=None, help="Write results as JSON to this file.")
+    args = parser.parse_args()
+
+    import torch
+
+    results: list[InferenceResult] = []
+    with tempfile.TemporaryDirectory(prefix="bench_inference_") as tmp:
+        for pipeline in args.pipelines:
+            torch.manual_seed(args.seed)
+            results.extend(bench_pipeline(pipeline, Path(tmp), samples=args.samples, batch_sizes=args.batch_sizes,
+                                          threads=args.threads, repeats=args.repeats, seed=args.seed,
+                                          cpu_modes=args.cpu_modes, processes=args.processes))
+
+    if args.output is not None:
+        payload = {
+            "suite": "inference",
+            "configs": TINY_CONFIGS,
+            "samples": args.samples,
+            "repeats": args.repeats,
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            # Peak RSS of this process during each configuration (warm-up included) where the high-water mark
+            # can be reset (Linux, peak_rss_per_run); elsewhere the process-wide peak up to that row.
+            # Sharded workers are not included.
+            "results": [asdict(r) for r in results],
+        }
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        args.output.write_text(json.dumps(payload, indent=2) + "\n", encoding="utf-8")
+        print(f"results written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,336 @@
+from __future__ import annotations
+
+import argparse
+import io
+import json
+import os
+import pickle
+import platform
+import random
+import re
+import shutil
+import statistics
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+from collections.abc import Callable
+from dataclasses import asdict, dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+_REPO_ROOT = Path(__file__).resolve().parents[1]
+if str(_REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(_REPO_ROOT))
+
+from benchmarks.extract_zip import make_zip  # noqa: E402
+from data_ingestion.common import (  # noqa: E402
+    CachedFile,
+    copy_or_hardlink,
+    download_url,
+    extract_tar_gz,
+    extract_zip,
+    md5_file,
+    sha256_file,
+    write_provenance,
+)
+
+SCALES: dict[str, dict[str, int]] = {
+    # Shaped like our datasets: mini_speech_commands (zip of ~8k WAVs), aclImdb (~100k small
+    # text files in a tar.gz) and the CIFAR-10 python batches (a few ~30 MB pickles).
+    "full": {"zip_members": 8000, "zip_member_bytes": 32 * 1024, "tar_members": 100_000,
+             "pickles": 6, "pickle_bytes": 30 * 1024 * 1024, "provenance_files": 1000},
+    "small": {"zip_members": 800, "zip_member_bytes": 32 * 1024, "tar_members": 5000,
+              "pickles": 2, "pickle_bytes": 4 * 1024 * 1024, "provenance_files": 200},
+}
+WORDS = ("the movie film plot acting great bad good story characters scene director "
+         "boring brilliant terrible wonderful ending music performance script").split()
+
+
+@dataclass(frozen=True)
+class BenchResult:
+    name: str
+    repeats: int
+    unit: str  # what "items" counts: bytes, files or calls
+    items: int  # per repeat
+    min_s: float
+    p50_s: float
+    p90_s: float
+    p99_s: float
+    throughput: float  # items per second at the median
+
+
+def _percentile(samples: list[float], q: float) -> float:
+    ordered = sorted(samples)
+    k = (len(ordered) - 1) * q
+    lo, hi = int(k), min(int(k) + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def summarize(name: str, samples: list[float], *, unit: str, items: int) -> BenchResult:
+    p50 = statistics.median(samples)
+    return BenchResult(
+        name=name,
+        repeats=len(samples),
+        unit=unit,
+        items=items,
+        min_s=round(min(samples), 6),
+        p50_s=round(p50, 6),
+        p90_s=round(_percentile(samples, 0.90), 6),
+        p99_s=round(_percentile(samples, 0.99), 6),
+        throughput=round(items / p50, 3) if p50 > 0 else float("inf"),
+    )
+
+
+def run_case(
+    name: str,
+    fn: Callable[[], None],
+    *,
+    repeats: int,
+    unit: str,
+    items: int,
+    setup: Callable[[], None] | None = None,
+) -> BenchResult:
+    """Time fn() `repeats` times after one untimed warm-up; setup() runs untimed before every call."""
+    samples = []
+    for i in range(repeats + 1):
+        if setup is not None:
+            setup()
+        t0 = time.perf_counter()
+        fn()
+        if i:
+            samples.append(time.perf_counter() - t0)
+    return summarize(name, samples, unit=unit, items=items)
+
+
+# --- synthetic datasets -----------------------------------------------------------------------
+
+
+def make_tar_gz(path: Path, *, n_members: int, seed: int = 0) -> int:
+    """aclImdb-like tar.gz: n_members short reviews split over train/test x pos/neg; returns raw bytes."""
+    rng = random.Random(seed)
+    total = 0
+    with tarfile.open(path, "w:gz", compresslevel=6) as tf:
+        for i in range(n_members):
+            split = "train" if i % 2 == 0 else "test"
+            label = "pos" if (i // 2) % 2 == 0 else "neg"
+            text = " ".join(rng.choice(WORDS) for _ in range(rng.randint(40, 400))).encode("utf-8")
+            info = tarfile.TarInfo(f"aclImdb/{split}/{label}/{i}_{rng.randint(1, 10)}.txt")
+            info.size = len(text)
+            info.mtime = 1_300_000_000
+            tf.addfile(info, io.BytesIO(text))
+            total += len(text)
+    return total
+
+
+def make_pickles(out_dir: Path, *, count: int, nbytes: int, seed: int = 0) -> list[Path]:
+    """CIFAR-10-batch-like pickles: a dict with one large bytes payload and a label list."""
+    rng = random.Random(seed)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for i in range(count):
+        payload = rng.randbytes(nbytes)
+        path = out_dir / f"data_batch_{i + 1}"
+        with path.open("wb") as f:
+            pickle.dump({b"data": payload, b"labels": [rng.randrange(10) for _ in range(10_000)]}, f)
+        paths.append(path)
+    return paths
+
+
+# --- local HTTP server with Range support (what download_url's multi-connection mode needs) -----
+
+
+def _range_handler(root: Path) -> type[BaseHTTPRequestHandler]:
+    class RangeHandler(BaseHTTPRequestHandler):
+        def log_message(self, format: str, *args: object) -> None:  # noqa: A002 - stdlib signature
+            pass
+
+        def do_GET(self) -> None:  # noqa: N802 - stdlib naming
+            path = root / self.path.lstrip("/")
+            if not path.is_file():
+                self.send_error(404)
+                return
+            size = path.stat().st_size
+            start, end = 0, size - 1
+            match = re.fullmatch(r"bytes=(\d*)-(\d*)", self.headers.get("Range", ""))
+            if match:
+                start = int(match.group(1) or 0)
+                end = min(int(match.group(2)) if match.group(2) else size - 1, size - 1)
+                self.send_response(206)
+                self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+            else:
+                self.send_response(200)
+            self.send_header("Accept-Ranges", "bytes")
+            self.send_header("Content-Length", str(end - start + 1))
+            self.end_headers()
+            with path.open("rb") as f:
+                f.seek(start)
+                remaining = end - start + 1
+                while remaining > 0:
+                    chunk = f.read(min(1024 * 1024, remaining))
+                    if not chunk:
+                        break
+                    self.wfile.write(chunk)
+                    remaining -= len(chunk)
+
+    return RangeHandler
+
+
+class LocalServer:
+    def __init__(self, root: Path) -> None:
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), _range_handler(root))
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def url(self, name: str) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/{name}"
+
+    def __enter__(self) -> LocalServer:
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc: object) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+# --- suite --------------------------------------------------------------------------------------
+
+
+def run_suite(work: Path, *, scale: dict[str, int], repeats: int, workers: int) -> list[BenchResult]:
+    results: list[BenchResult] = []
+
+    def report(r: BenchResult) -> None:
+        results.append(r)
+        rate = f"{r.throughput / 1e6:9.1f} MB/s" if r.unit == "bytes" else f"{r.throughput:9.0f} {r.unit}/s"
+        print(f"{r.name:<28} p50 {r.p50_s * 1e3:9.2f} ms  p90 {r.p90_s * 1e3:9.2f} ms  "
+              f"p99 {r.p99_s * 1e3:9.2f} ms  {rate}", flush=True)
+
+    print("generating synthetic datasets...", flush=True)
+    pickles = make_pickles(work / "pickles", count=scale["pickles"], nbytes=scale["pickle_bytes"])
+    pickle_bytes = sum(p.stat().st_size for p in pickles)
+    zip_path = work / "mini_speech_commands.zip"
+    make_zip(zip_path, n_members=scale["zip_members"], member_bytes=scale["zip_member_bytes"])
+    tar_path = work / "aclImdb_v1.tar.gz"
+    tar_raw = make_tar_gz(tar_path, n_members=scale["tar_members"])
+
+    # Hashing: the memo is off, so every repeat reads the files.
+    report(run_case("sha256_file", lambda: [sha256_file(p) for p in pickles],
+                    repeats=repeats, unit="bytes", items=pickle_bytes))
+    report(run_case("md5_file", lambda: [md5_file(p) for p in pickles],
+                    repeats=repeats, unit="bytes", items=pickle_bytes))
+
+    zip_dst = work / "zip_out"
+    clear_zip = lambda: shutil.rmtree(zip_dst, ignore_errors=True)  # noqa: E731
+    report(run_case("extract_zip", lambda: extract_zip(archive_path=zip_path, dst_dir=zip_dst),
+                    repeats=repeats, unit="files", items=scale["zip_members"], setup=clear_zip))
+    if workers > 1:
+        report(run_case(f"extract_zip[workers={workers}]",
+                        lambda: extract_zip(archive_path=zip_path, dst_dir=zip_dst, workers=workers),
+                        repeats=repeats, unit="files", items=scale["zip_members"], setup=clear_zip))
+    # Re-run over an intact tree: only the manifest check runs.
+    report(run_case("extract_zip[warm]", lambda: extract_zip(archive_path=zip_path, dst_dir=zip_dst),
+                    repeats=repeats, unit="files", items=scale["zip_members"]))
+
+    tar_dst = work / "tar_out"
+    report(run_case("extract_tar_gz", lambda: extract_tar_gz(archive_path=tar_path, dst_dir=tar_dst),
+                    repeats=repeats, unit="bytes", items=tar_raw,
+                    setup=lambda: shutil.rmtree(tar_dst, ignore_errors=True)))
+    report(run_case("extract_tar_gz[warm]", lambda: extract_tar_gz(archive_path=tar_path, dst_dir=tar_dst),
+                    repeats=repeats, unit="files", items=scale["tar_members"]))
+
+    # copy_or_hardlink is called once per file; report per-call latency percentiles.
+    wavs = sorted(zip_dst.rglob("*.wav"))
+    link_dst = work / "links"
+    latencies: list[float] = []
+    for _ in range(repeats):
+        shutil.rmtree(link_dst, ignore_errors=True)
+        for src in wavs:
+            t0 = time.perf_counter()
+            copy_or_hardlink(src, link_dst / src.parent.name / src.name)
+            latencies.append(time.perf_counter() - t0)
+    report(summarize("copy_or_hardlink[per call]", latencies, unit="calls", items=1))
+
+    download_dst = work / "downloads" / "batch.bin"
+    with LocalServer(pickles[0].parent) as server:
+        for connections in sorted({1, max(1, workers)}):
+            def download(connections: int = connections) -> None:
+                download_url(url=server.url(pickles[0].name), dst=download_dst, connections=connections, force=True)
+
+            report(run_case(f"download_url[connections={connections}]", download,
+                            repeats=repeats, unit="bytes", items=pickles[0].stat().st_size))
+
+    files = [
+        CachedFile(src=f"https://example.invalid/{i}", dst=str(work / f"file_{i}"), method="download",
+                   bytes=i, sha256=f"{i:064x}")
+        for i in range(scale["provenance_files"])
+    ]
+    out_path = work / "provenance.json"
+    report(run_case("write_provenance", lambda: write_provenance(pipeline="bench", cache_root=work, files=files,
+                                                                 out_path=out_path),
+                    repeats=max(repeats, 20), unit="calls", items=1))
+    return results
+
+
+def compare(results: list[BenchResult], baseline: dict, *, threshold: float) -> list[str]:
+    """Cases whose median time grew by more than threshold (a fraction) over the baseline."""
+    previous = {r["name"]: r for r in baseline.get("results", [])}
+    regressions = []
+    for r in results:
+        old = previous.get(r.name)
+        if old is None or old["p50_s"] <= 0:
+            continue
+        change = r.p50_s / old["p50_s"] - 1.0
+        marker = "REGRESSION" if change > threshold else ""
+        print(f"{r.name:<28} {old['p50_s'] * 1e3:9.2f} ms -> {r.p50_s * 1e3:9.2f} ms  {change:+7.1%}  {marker}")
+        if change > threshold:
+            regressions.append(r.name)
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Micro-benchmarks for the data_ingestion primitives on deterministic synthetic datasets."
+    )
+    parser.add_argument("--scale", choices=sorted(SCALES), default="full")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=min(8, os.cpu_count() or 1),
+                        help="Parallel extract_zip workers and download_url connections to compare against 1.")
+    parser.add_argument("--workdir", type=Path, default=None, help="Defaults to a temporary directory.")
+    parser.add_argument("--save-baseline", type=Path, default=None, help="Write results to this JSON file.")
+    parser.add_argument("--baseline", type=Path, default=None, help="Compare against a saved baseline.")
+    parser.add_argument("--threshold", type=float, default=0.20,
+                        help="Fail when a case's median time grows by more than this fraction (default 0.20).")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="bench_ingestion_", dir=args.workdir) as tmp:
+        results = run_suite(Path(tmp), scale=SCALES[args.scale], repeats=args.repeats, workers=args.workers)
+
+    payload = {
+        "suite": "data_ingestion",
+        "scale": args.scale,
+        "repeats": args.repeats,
+        "workers": args.workers,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "results": [asdict(r) for r in results],
+    }
+    if args.save_baseline is not None:
+        args.save_baseline.parent.mkdir(parents=True, exist_ok=True)
+        args.save_baseline.write_text(json.dumps(payload, indent=2) + "\n", encoding="utf-8")
+        print(f"baseline written to {args.save_baseline}")
+    if args.baseline is not None:
+        baseline = json.loads(args.baseline.read_text(encoding="utf-8"))
+        if baseline.get("scale") != args.scale:
+            print(f"warning: baseline was recorded at scale={baseline.get('scale')!r}, this run is {args.scale!r}")
+        regressions = compare(results, baseline, threshold=args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regression(s) above {args.threshold:.0%}: {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,129 @@
+from __future__ import annotations
+
+import argparse
+import sys
+import tempfile
+from collections.abc import Callable
+from pathlib import Path
+
+import numpy as np
+
+_REPO_ROOT = Path(__file__).resolve().parents[1]
+if str(_REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(_REPO_ROOT))
+
+from benchmarks.inference import TINY_CONFIGS, speech_commands_lengths  # noqa: E402
+
+
+def check_asr_batching(work: Path, seed: int) -> tuple[bool, str]:
+    """run_inference with batch_size=32 predicts exactly what batch_size=1 does, for both ASR model families."""
+    from transformers import Wav2Vec2Config, Wav2Vec2FeatureExtractor, Wav2Vec2ForSequenceClassification
+
+    from notebooks.asr_commands import helpers
+
+    rng = np.random.default_rng(seed)
+    values = [rng.standard_normal(n).astype(np.float32) for n in speech_commands_lengths(rng, 160)]
+    test_ds = {"input_values": values, "label": rng.integers(0, 8, len(values)).tolist()}
+    details, ok = [], True
+    # hubert-base-superb-ks style (group-norm conv encoder, no attention mask) and wav2vec2-large style
+    # (layer norm, masked padding).
+    for norm, use_mask in (("group", False), ("layer", True)):
+        model = Wav2Vec2ForSequenceClassification(
+            Wav2Vec2Config(**TINY_CONFIGS["asr"], feat_extract_norm=norm, do_stable_layer_norm=norm == "layer")
+        ).eval()
+        feature_extractor = Wav2Vec2FeatureExtractor(do_normalize=True, return_attention_mask=use_mask)
+        agreement, differ = helpers.batching_parity(model, feature_extractor, test_ds, batch_size=32, limit=None)
+        ok &= len(differ) == 0
+        details.append(f"{norm}-norm/mask={use_mask}: agreement {agreement:.4f} ({len(differ)} differ)")
+    return ok, "; ".join(details)
+
+
+def check_clip_preprocess(work: Path, seed: int) -> tuple[bool, str]:
+    """preprocess_images against CLIPProcessor on a fixed CIFAR-like batch, for both image processor backends."""
+    from transformers import CLIPImageProcessor, CLIPImageProcessorPil
+
+    from notebooks.clip_multimodal import helpers
+
+    images = np.random.default_rng(seed).integers(0, 256, (64, 32, 32, 3), dtype=np.uint8)
+    # (processor, max abs diff): one uint8 level is 1 / 255 / std ~= 0.015 after normalization. The PIL
+    # backend (use_fast=False) is what preprocess_images reproduces, bit for bit; the torchvision backend
+    # (use_fast=True, the default in transformers>=5) rounds differently and is allowed two levels.
+    cases = [(CLIPImageProcessorPil(), 1e-5)]
+    try:
+        cases.append((CLIPImageProcessor(), 0.035))
+    except ImportError:  # torchvision not installed: only the PIL backend exists
+        pass
+    details, ok = [], True
+    for processor, atol in cases:
+        report = helpers.preprocess_parity(processor, images, atol=atol)
+        ok &= report["ok"] and report["mean_abs_diff"] <= 1e-3
+        details.append(f"{report['backend']}: max {report['max_abs_diff']:.4f} (atol {atol}), "
+                       f"mean {report['mean_abs_diff']:.2e}")
+    return ok, "; ".join(details)
+
+
+def check_metrics(work: Path, seed: int) -> tuple[bool, str]:
+    """ConfusionMatrix.metrics against the sklearn calls the notebooks' compute_metrics used to make."""
+    from sklearn.metrics import accuracy_score, classification_report, confusion_matrix, f1_score
+
+    from utils.metrics import ConfusionMatrix
+
+    rng = np.random.default_rng(seed)
+    details, ok = [], True
+    # (classes, samples, classes that never occur): absent classes exercise zero_division and the macro F1's
+    # average over present classes only.
+    for k, n, absent in ((2, 1000, ()), (10, 5000, ()), (12, 300, (3, 7))):
+        pool = np.setdiff1d(np.arange(k), absent)
+        y_true = rng.choice(pool, n)
+        y_pred = np.where(rng.random(n) < 0.6, y_true, rng.choice(pool, n))
+        labels = [f"class_{i}" for i in range(k)]
+        expected = {
+            "accuracy": float(accuracy_score(y_true, y_pred)),
+            "f1_macro": float(f1_score(y_true, y_pred, average="macro")),
+            "confusion_matrix": confusion_matrix(y_true, y_pred, labels=range(k)).tolist(),
+            "classification_report": classification_report(y_true, y_pred, labels=range(k), target_names=labels,
+                                                            output_dict=True, zero_division=0),
+        }
+        cm = ConfusionMatrix(k)
+        for chunk in np.array_split(np.arange(n), 7):  # streamed in batches, as run_inference does
+            cm.update(y_true[chunk], y_pred[chunk])
+        got = cm.metrics(labels)
+        differ = [key for key in expected if got[key] != expected[key]]
+        ok &= not differ
+        details.append(f"k={k}: " + (f"{differ} differ" if differ else "identical"))
+    try:
+        ConfusionMatrix(3).update([0, 1, 3], [0, 1, 2])
+    except ValueError:
+        details.append("out-of-range label rejected")
+    else:
+        ok = False
+        details.append("out-of-range label accepted")
+    return ok, "; ".join(details)
+
+
+CHECKS: dict[str, Callable[[Path, int], tuple[bool, str]]] = {
+    "asr-batching": check_asr_batching,
+    "clip-preprocess": check_clip_preprocess,
+    "metrics": check_metrics,
+}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Offline parity checks for the notebooks' optimized helpers against their reference paths."
+    )
+    parser.add_argument("--checks", nargs="+", choices=sorted(CHECKS), default=list(CHECKS))
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    failed = 0
+    with tempfile.TemporaryDirectory(prefix="parity_") as tmp:
+        for name in args.checks:
+            ok, detail = CHECKS[name](Path(tmp), args.seed)
+            failed += not ok
+            print(f"{'ok  ' if ok else 'FAIL'} {name:<18} {detail}", flush=True)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,141 @@
+from __future__ import annotations
+
+import argparse
+import importlib
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from types import ModuleType
+
+_REPO_ROOT = Path(__file__).resolve().parents[1]
+if str(_REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(_REPO_ROOT))
+
+from data_ingestion.common import StageLimits  # noqa: E402
+
+_PACKAGE_DIR = Path(__file__).resolve().parent
+
+
+@dataclass(frozen=True)
+class Pipeline:
+    name: str
+    module: ModuleType
+    config_path: Path
+
+
+@dataclass(frozen=True)
+class PipelineResult:
+    name: str
+    ok: bool
+    seconds: float
+    provenance_path: Path | None = None
+    error: str | None = None
+
+
+def discover_pipelines() -> list[Pipeline]:
+    """Every data_ingestion/<name>/run.py exposing load_config() and ingest()."""
+    pipelines: list[Pipeline] = []
+    for run_py in sorted(_PACKAGE_DIR.glob("*/run.py")):
+        name = run_py.parent.name
+        module = importlib.import_module(f"data_ingestion.{name}.run")
+        if not callable(getattr(module, "load_config", None)) or not callable(getattr(module, "ingest", None)):
+            continue
+        pipelines.append(Pipeline(name=name, module=module,
+                         config_path=run_py.with_name("config.toml")))
+    return pipelines
+
+
+def _log(name: str, message: str) -> None:
+    for line in message.rstrip("\n").splitlines():
+        print(f"[{name}] {line}", flush=True)
+
+
+def run_pipeline(pipeline: Pipeline, *, cache_root: Path | None, force: bool, limits: StageLimits) -> PipelineResult:
+    t0 = time.perf_counter()
+    try:
+        config = pipeline.module.load_config(pipeline.config_path)
+        root = cache_root if cache_root is not None else Path(config["cache_root"])
+        provenance_path = pipeline.module.ingest(
+            config=config, cache_root=root, force=force, limits=limits)
+    except Exception as exc:
+        _log(pipeline.name, traceback.format_exc())
+        return PipelineResult(name=pipeline.name, ok=False, seconds=time.perf_counter() - t0,
+                              error=f"{type(exc).__name__}: {exc}")
+    return PipelineResult(name=pipeline.name, ok=True, seconds=time.perf_counter() - t0,
+                          provenance_path=Path(provenance_path))
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Run every data_ingestion pipeline concurrently (download + extract into .cache/)."
+    )
+    parser.add_argument(
+        "--only",
+        nargs="+",
+        default=None,
+        help="Run only these pipelines (default: all discovered pipelines).",
+    )
+    parser.add_argument(
+        "--cache-root",
+        type=Path,
+        default=None,
+        help="Override cache root directory for all pipelines (otherwise from each config).",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Force re-download even if cached files exist and pass verification.",
+    )
+    parser.add_argument(
+        "--network-jobs",
+        type=int,
+        default=None,
+        help="Max pipelines downloading at once. Default: number of pipelines.",
+    )
+    parser.add_argument(
+        "--cpu-jobs",
+        type=int,
+        default=None,
+        help="Max pipelines extracting at once. Default: CPU count.",
+    )
+    args = parser.parse_args()
+
+    pipelines = discover_pipelines()
+    if args.only:
+        unknown = sorted(set(args.only) - {p.name for p in pipelines})
+        if unknown:
+            parser.error(f"Unknown pipelines: {unknown}")
+        pipelines = [p for p in pipelines if p.name in args.only]
+    if not pipelines:
+        print("No pipelines to run.")
+        return 0
+
+    limits = StageLimits(
+        network=args.network_jobs or len(pipelines),
+        cpu=args.cpu_jobs or os.cpu_count() or 1,
+    )
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(pipelines), thread_name_prefix="ingest") as pool:
+        futures = [
+            pool.submit(run_pipeline, p, cache_root=args.cache_root,
+                        force=args.force, limits=limits)
+            for p in pipelines
+        ]
+        results = [f.result() for f in futures]
+
+    for r in results:
+        if r.ok:
+            _log(r.name, f"ok in {r.seconds:.1f}s; wrote provenance: {r.provenance_path}")
+        else:
+            _log(r.name, f"FAILED after {r.seconds:.1f}s: {r.error}")
+    failed = [r.name for r in results if not r.ok]
+    print(f"Ingested {len(results) - len(failed)}/{len(results)} pipelines in {time.perf_counter() - t0:.1f}s")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -11,19 +11,30 @@ if str(_REPO_ROOT) not in sys.path:
     sys.path.insert(0, str(_REPO_ROOT))
 
 from data_ingestion.common import (  # noqa: E402
+    NO_LIMITS,
     CachedFile,
+    StageLimits,
+    cached_file_record,
+    directory_record,
     download_url,
     extract_zip,
     sha256_file,
     write_json,
     write_provenance,
 )
+from data_ingestion.download import DEFAULT_CONNECTIONS, DEFAULT_RETRIES  # noqa: E402
+from data_ingestion.hashing import HashMemo  # noqa: E402
+from data_ingestion.merkle import DEFAULT_TREE_WORKERS  # noqa: E402
+from data_ingestion.asr_commands.waveforms import build_waveform_store  # noqa: E402
+from data_ingestion.timing import StageRecorder  # noqa: E402
 from data_ingestion.config_utils import (  # noqa: E402
     as_path,
     load_toml,
+    optional_bool,
     optional_int,
     optional_list_of_str,
     optional_str,
+    optional_table,
     require_str,
     require_table,
  )
@@ -39,6 +50,7 @@ def load_config(config_path: Path) -> dict[str, Any]:
     download_tbl = require_table(cfg, "download", path=config_path)
     extract_tbl = require_table(cfg, "extract", path=config_path)
     dataset_tbl = require_table(cfg, "dataset", path=config_path)
+    waveforms_tbl = optional_table(cfg, "waveforms", path=config_path)
 
     pipeline_name = require_str(
         pipeline_tbl, "name", path=config_path, table_name="pipeline")
@@ -55,23 +67,42 @@ def load_config(config_path: Path) -> dict[str, Any]:
         paths_tbl, "labels_filename", path=config_path, table_name="paths")
     provenance_filename = require_str(
         paths_tbl, "provenance_filename", path=config_path, table_name="paths")
+    events_filename = optional_str(paths_tbl, "events_filename")
 
     url = require_str(download_tbl, "url", path=config_path,
                       table_name="download")
     user_agent = require_str(download_tbl, "user_agent",
                              path=config_path, table_name="download")
     timeout_seconds = optional_int(download_tbl, "timeout_seconds")
+    connections = optional_int(download_tbl, "connections")
+    retries = optional_int(download_tbl, "retries")
 
     expected_bytes_min = optional_int(download_tbl, "expected_bytes_min")
     expected_bytes_max = optional_int(download_tbl, "expected_bytes_max")
     expected_sha256 = optional_str(download_tbl, "expected_sha256")
     expected_md5 = optional_str(download_tbl, "expected_md5")
 
-    sentinel_relpath = require_str(
-        extract_tbl, "sentinel_relpath", path=config_path, table_name="extract")
     extracted_root_dirname = require_str(
         extract_tbl, "extracted_root_dirname", path=config_path, table_name="extract"
     )
+    extract_workers = optional_int(extract_tbl, "workers")
+    extract_executor = optional_str(extract_tbl, "executor")
+    hash_workers = optional_int(extract_tbl, "hash_workers")
+    if extract_executor not in (None, "process", "thread"):
+        raise ValueError(
+            f"Invalid [extract].executor: {extract_executor!r} (expected 'process' or 'thread')")
+
+    waveforms_enabled = optional_bool(waveforms_tbl, "enabled")
+    waveforms_dirname = optional_str(waveforms_tbl, "dirname")
+    waveforms_dtype = optional_str(waveforms_tbl, "dtype")
+    waveforms_workers = optional_int(waveforms_tbl, "workers")
+    waveforms_executor = optional_str(waveforms_tbl, "executor")
+    if waveforms_dtype not in (None, "int16", "float32"):
+        raise ValueError(
+            f"Invalid [waveforms].dtype: {waveforms_dtype!r} (expected 'int16' or 'float32')")
+    if waveforms_executor not in (None, "process", "thread"):
+        raise ValueError(
+            f"Invalid [waveforms].executor: {waveforms_executor!r} (expected 'process' or 'thread')")
 
     labels = optional_list_of_str(dataset_tbl, "labels")
     if not labels:
@@ -88,6 +119,7 @@ def load_config(config_path: Path) -> dict[str, Any]:
         "raw_dirname": raw_dirname,
         "labels_filename": labels_filename,
         "provenance_filename": provenance_filename,
+        "events_filename": events_filename,
         "url": url,
         "expected_bytes_min": expected_bytes_min,
         "expected_bytes_max": expected_bytes_max,
@@ -95,16 +127,31 @@ def load_config(config_path: Path) -> dict[str, Any]:
         "expected_md5": expected_md5,
         "user_agent": user_agent,
         "timeout_seconds": timeout_seconds,
-        "sentinel_relpath": sentinel_relpath,
+        "connections": connections,
+        "retries": retries,
         "extracted_root_dirname": extracted_root_dirname,
+        "extract_workers": extract_workers,
+        "extract_executor": extract_executor,
+        "hash_workers": hash_workers,
+        "waveforms_enabled": bool(waveforms_enabled),
+        "waveforms_dirname": waveforms_dirname or "waveforms",
+        "waveforms_dtype": waveforms_dtype or "int16",
+        "waveforms_workers": waveforms_workers,
+        "waveforms_executor": waveforms_executor,
         "labels": labels,
     }
 
 
-def ingest(*, config: dict[str, Any], cache_root: Path, force: bool = False) -> Path:
+def ingest(
+    *, config: dict[str, Any], cache_root: Path, force: bool = False, limits: StageLimits = NO_LIMITS
+) -> Path:
     pipeline: PipelineName = "asr_commands"
     pipeline_cache = cache_root / pipeline
     pipeline_cache.mkdir(parents=True, exist_ok=True)
+    memo = HashMemo.for_cache_root(cache_root)
+    events_filename = config.get("events_filename")
+    recorder = StageRecorder(
+        pipeline=pipeline, event_log=pipeline_cache / str(events_filename) if events_filename else None)
 
     archive_path = pipeline_cache / str(config["archive_filename"])
     raw_dir = pipeline_cache / str(config["raw_dirname"])
@@ -114,63 +161,86 @@ def ingest(*, config: dict[str, Any], cache_root: Path, force: bool = False) ->
     print(f"[asr_commands] Downloading: {url}")
     print(f"[asr_commands] Cache file: {archive_path}")
 
-    download_url(
-        url=url,
-        dst=archive_path,
-        expected_bytes_min=config.get("expected_bytes_min"),
-        expected_bytes_max=config.get("expected_bytes_max"),
-        expected_sha256=config.get("expected_sha256"),
-        expected_md5=config.get("expected_md5"),
-        user_agent=str(config["user_agent"]),
-        timeout_seconds=int(config["timeout_seconds"] or 60),
-        force=force,
-    )
+    with limits.network():
+        archive_digests = download_url(
+            url=url,
+            dst=archive_path,
+            expected_bytes_min=config.get("expected_bytes_min"),
+            expected_bytes_max=config.get("expected_bytes_max"),
+            expected_sha256=config.get("expected_sha256"),
+            expected_md5=config.get("expected_md5"),
+            user_agent=str(config["user_agent"]),
+            timeout_seconds=int(config["timeout_seconds"] or 60),
+            connections=int(config["connections"] or DEFAULT_CONNECTIONS),
+            retries=int(config["retries"] if config["retries"] is not None else DEFAULT_RETRIES),
+            force=force,
+            memo=memo,
+            recorder=recorder,
+        )
 
     print(f"[asr_commands] Extracting into: {raw_dir}")
     # Zip contains a 'mini_speech_commands/' root.
-    extract_zip(
-        archive_path=archive_path,
-        dst_dir=raw_dir,
-        sentinel_relpath=str(config["sentinel_relpath"]),
-    )
+    with limits.cpu(), recorder.stage("extract") as meter:
+        extract_zip(
+            archive_path=archive_path,
+            dst_dir=raw_dir,
+            workers=int(config["extract_workers"] or 1),
+            executor=config["extract_executor"] or "process",
+        )
+        meter.add_bytes(archive_digests.bytes)
 
     base = raw_dir / str(config["extracted_root_dirname"])
     labels = list(config["labels"])
-    missing = [lbl for lbl in labels if not (base / lbl).exists()]
-    if missing:
-        raise RuntimeError(
-            f"mini_speech_commands extraction sanity check failed; missing label directories: {missing}"
-        )
+    with recorder.stage("sanity_check"):
+        missing = [lbl for lbl in labels if not (base / lbl).exists()]
+        if missing:
+            raise RuntimeError(
+                f"mini_speech_commands extraction sanity check failed; missing label directories: {missing}"
+            )
 
     labels_path = pipeline_cache / str(config["labels_filename"])
     write_json(labels_path, {"labels": labels})
 
+    waveform_files: list[Path] = []
+    if config["waveforms_enabled"]:
+        waveforms_dir = pipeline_cache / str(config["waveforms_dirname"])
+        print(f"[asr_commands] Decoding waveforms into: {waveforms_dir}")
+        with limits.cpu(), recorder.stage("decode") as meter:
+            store = build_waveform_store(
+                root=base,
+                labels=labels,
+                out_dir=waveforms_dir,
+                dtype=config["waveforms_dtype"],
+                workers=int(config["waveforms_workers"] or 1),
+                executor=config["waveforms_executor"] or "process",
+                force=force,
+            )
+            meter.add_bytes(store.waveforms_path.stat().st_size)
+        waveform_files = store.files()
+
     provenance_path = pipeline_cache / str(config["provenance_filename"])
-    files: list[CachedFile] = [
-        CachedFile(
-            src=url,
-            dst=str(archive_path),
-            method="download",
-            bytes=archive_path.stat().st_size,
-            sha256=sha256_file(archive_path),
-        ),
-        CachedFile(
-            src=str(archive_path),
-            dst=str(base / "yes"),
-            method="extract",
-            bytes=0,
-            sha256="(directory)",
-        ),
-        CachedFile(
-            src="(generated) labels.json",
-            dst=str(labels_path),
-            method="generated",
-            bytes=labels_path.stat().st_size,
-            sha256=sha256_file(labels_path),
-        ),
-    ]
+    with recorder.stage("hashing") as meter:
+        files: list[CachedFile] = [
+            cached_file_record(
+                src=url, dst=archive_path, method="download", digests=archive_digests),
+            directory_record(
+                src=archive_path, dst=base, method="extract",
+                workers=int(config["hash_workers"] or DEFAULT_TREE_WORKERS), memo=memo),
+            CachedFile(
+                src="(generated) labels.json",
+                dst=str(labels_path),
+                method="generated",
+                bytes=labels_path.stat().st_size,
+                sha256=sha256_file(labels_path, memo=memo),
+            ),
+        ]
+        files.extend(
+            cached_file_record(src="(decoded) waveforms", dst=path, method="generated", memo=memo)
+            for path in waveform_files
+        )
+        meter.add_bytes(sum(f.bytes for f in files[1:]))
     write_provenance(pipeline=pipeline, cache_root=cache_root,
-                     files=files, out_path=provenance_path)
+                     files=files, out_path=provenance_path, timings=recorder.timings)
     return provenance_path
 
 
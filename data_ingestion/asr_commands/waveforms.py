@@ -0,0 +1,206 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import wave
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Literal
+
+import numpy as np
+
+from data_ingestion.extraction import ExecutorKind, balance_by_size, make_executor
+
+WAVEFORM_LAYOUT_VERSION = 1
+WAVEFORM_MANIFEST_FILENAME = "manifest.json"
+TARGET_SAMPLE_RATE = 16_000
+WaveformDType = Literal["int16", "float32"]
+
+
+@dataclass(frozen=True)
+class WaveformStore:
+    """waveforms.npy is every clip concatenated; clip i is waveforms[offsets[i]:offsets[i + 1]]."""
+
+    out_dir: Path
+    count: int
+    total_samples: int
+    dtype: WaveformDType
+    sample_rate: int
+
+    @property
+    def waveforms_path(self) -> Path:
+        return self.out_dir / "waveforms.npy"
+
+    @property
+    def offsets_path(self) -> Path:
+        return self.out_dir / "offsets.npy"
+
+    @property
+    def lengths_path(self) -> Path:
+        return self.out_dir / "lengths.npy"
+
+    @property
+    def labels_path(self) -> Path:
+        return self.out_dir / "labels.npy"
+
+    @property
+    def paths_path(self) -> Path:
+        return self.out_dir / "paths.json"
+
+    def files(self) -> list[Path]:
+        return [self.waveforms_path, self.offsets_path, self.lengths_path, self.labels_path, self.paths_path]
+
+
+def list_clips(root: Path, labels: list[str]) -> list[tuple[str, int]]:
+    """(relpath, label id) for every <root>/<label>/*.wav, in label order then file name."""
+    clips: list[tuple[str, int]] = []
+    for label_id, label in enumerate(labels):
+        names = sorted(p.name for p in (root / label).glob("*.wav"))
+        clips.extend((f"{label}/{name}", label_id) for name in names)
+    return clips
+
+
+def _resampled_length(n_frames: int, rate: int, target_rate: int) -> int:
+    return n_frames if rate == target_rate else int(round(n_frames * target_rate / rate))
+
+
+def wav_length(path: Path, target_rate: int = TARGET_SAMPLE_RATE) -> int:
+    with wave.open(str(path), "rb") as w:
+        return _resampled_length(w.getnframes(), w.getframerate(), target_rate)
+
+
+def decode_wav(path: Path, *, dtype: WaveformDType = "int16", target_rate: int = TARGET_SAMPLE_RATE) -> np.ndarray:
+    """Mono PCM at target_rate; float32 is scaled to [-1, 1) like soundfile/datasets."""
+    with wave.open(str(path), "rb") as w:
+        channels, width, rate, n_frames = w.getnchannels(), w.getsampwidth(), w.getframerate(), w.getnframes()
+        raw = w.readframes(n_frames)
+    if width != 2:
+        raise ValueError(f"{path}: only 16-bit PCM WAV is supported (got {8 * width}-bit)")
+    pcm = np.frombuffer(raw, dtype="<i2").reshape(-1, channels)
+    samples = pcm[:, 0] if channels == 1 else pcm.mean(axis=1)
+    if rate != target_rate:
+        # Linear interpolation; mini_speech_commands is recorded at 16 kHz so this is a fallback only.
+        n_out = _resampled_length(len(samples), rate, target_rate)
+        samples = np.interp(np.arange(n_out) * (rate / target_rate), np.arange(len(samples)), samples)
+    if dtype == "float32":
+        return (np.asarray(samples, dtype=np.float32) / 32768.0).astype(np.float32, copy=False)
+    return np.clip(np.rint(samples), -32768, 32767).astype(np.int16, copy=False)
+
+
+def _decode_chunk(
+    root: str, store: str, items: list[tuple[str, int, int]], dtype: WaveformDType, target_rate: int
+) -> int:
+    # Every worker maps the preallocated store and writes its clips in place; nothing is pickled back.
+    waveforms = np.load(store, mmap_mode="r+")
+    for relpath, start, length in items:
+        samples = decode_wav(Path(root) / relpath, dtype=dtype, target_rate=target_rate)
+        n = min(length, len(samples))
+        waveforms[start:start + n] = samples[:n]
+        if n < length:
+            waveforms[start + n:start + length] = 0
+    waveforms.flush()
+    return len(items)
+
+
+def _source_signature(root: Path, clips: list[tuple[str, int]]) -> str:
+    h = hashlib.sha256()
+    for relpath, label_id in clips:
+        st = (root / relpath).stat()
+        h.update(f"{relpath}\0{label_id}\0{st.st_size}\0{st.st_mtime_ns}\n".encode("utf-8"))
+    return h.hexdigest()
+
+
+def _save_npy(path: Path, arr: np.ndarray) -> None:
+    tmp = path.with_name(path.name + ".tmp")
+    with tmp.open("wb") as f:
+        np.save(f, arr)
+    os.replace(tmp, path)
+
+
+def build_waveform_store(
+    *,
+    root: Path,
+    labels: list[str],
+    out_dir: Path,
+    dtype: WaveformDType = "int16",
+    target_rate: int = TARGET_SAMPLE_RATE,
+    workers: int = 1,
+    executor: ExecutorKind = "process",
+    force: bool = False,
+) -> WaveformStore:
+    """Decode every clip once into a single memory-mappable array at target_rate.
+
+    Clip order matches list_clips() (the order the ASR notebook indexes files
+    in). The store is rebuilt only when a clip is added, removed or modified,
+    or when dtype/sample rate change.
+    """
+    if dtype not in ("int16", "float32"):
+        raise ValueError(f"Unknown waveform dtype: {dtype!r} (expected 'int16' or 'float32')")
+    out_dir.mkdir(parents=True, exist_ok=True)
+    clips = list_clips(root, labels)
+    signature = _source_signature(root, clips)
+    store = WaveformStore(out_dir=out_dir, count=len(clips), total_samples=0, dtype=dtype, sample_rate=target_rate)
+
+    manifest_path = out_dir / WAVEFORM_MANIFEST_FILENAME
+    try:
+        manifest = json.loads(manifest_path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        manifest = {}
+    if (
+        not force
+        and manifest.get("layout") == WAVEFORM_LAYOUT_VERSION
+        and manifest.get("source") == signature
+        and manifest.get("dtype") == dtype
+        and manifest.get("sample_rate") == target_rate
+        and all(p.exists() for p in store.files())
+    ):
+        return WaveformStore(out_dir=out_dir, count=len(clips), total_samples=int(manifest["total_samples"]),
+                             dtype=dtype, sample_rate=target_rate)
+
+    lengths = np.fromiter((wav_length(root / rel, target_rate) for rel, _ in clips), dtype=np.int64, count=len(clips))
+    offsets = np.zeros(len(clips) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    total = int(offsets[-1])
+    if total == 0:
+        raise RuntimeError(f"No audio found under {root} for labels {labels}")
+
+    tmp_store = store.waveforms_path.with_name("waveforms.tmp.npy")
+    np.lib.format.open_memmap(tmp_store, mode="w+", dtype=np.dtype(dtype), shape=(total,)).flush()
+    items = {rel: (rel, int(offsets[i]), int(lengths[i])) for i, (rel, _) in enumerate(clips)}
+    try:
+        if workers > 1 and len(clips) > 1:
+            chunks = balance_by_size({rel: int(n) for rel, n in zip(items, lengths)}, workers)
+            with make_executor(executor, len(chunks)) as pool:
+                futures = [
+                    pool.submit(_decode_chunk, str(root), str(tmp_store), [items[rel] for rel in chunk], dtype, target_rate)
+                    for chunk in chunks
+                ]
+                for f in futures:
+                    f.result()
+        else:
+            _decode_chunk(str(root), str(tmp_store), list(items.values()), dtype, target_rate)
+    except BaseException:
+        tmp_store.unlink(missing_ok=True)
+        raise
+
+    os.replace(tmp_store, store.waveforms_path)
+    _save_npy(store.offsets_path, offsets)
+    _save_npy(store.lengths_path, lengths)
+    _save_npy(store.labels_path, np.fromiter((label_id for _, label_id in clips), dtype=np.int64, count=len(clips)))
+    tmp = store.paths_path.with_name(store.paths_path.name + ".tmp")
+    tmp.write_text(json.dumps({"labels": labels, "paths": [rel for rel, _ in clips]}), encoding="utf-8")
+    tmp.replace(store.paths_path)
+
+    manifest = {
+        "layout": WAVEFORM_LAYOUT_VERSION,
+        "source": signature,
+        "dtype": dtype,
+        "sample_rate": target_rate,
+        "count": len(clips),
+        "total_samples": total,
+    }
+    tmp = manifest_path.with_name(manifest_path.name + ".tmp")
+    tmp.write_text(json.dumps(manifest, indent=2, sort_keys=True) + "\n", encoding="utf-8")
+    tmp.replace(manifest_path)
+    return WaveformStore(out_dir=out_dir, count=len(clips), total_samples=total, dtype=dtype, sample_rate=target_rate)
@@ -0,0 +1,109 @@
+from __future__ import annotations
+
+import json
+import os
+import pickle
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+
+PACK_LAYOUT_VERSION = 1
+PACK_MANIFEST_FILENAME = "manifest.json"
+CIFAR10_SPLITS: dict[str, list[str]] = {
+    "train": [f"data_batch_{i}" for i in range(1, 6)],
+    "test": ["test_batch"],
+}
+
+
+@dataclass(frozen=True)
+class PackedSplit:
+    split: str
+    images_path: Path
+    labels_path: Path
+    count: int
+
+
+def packed_paths(out_dir: Path, split: str) -> tuple[Path, Path]:
+    return out_dir / f"{split}_images.npy", out_dir / f"{split}_labels.npy"
+
+
+def _load_batch(path: Path) -> tuple[np.ndarray, np.ndarray]:
+    with path.open("rb") as f:
+        batch = pickle.load(f, encoding="bytes")
+    images = np.asarray(batch[b"data"], dtype=np.uint8).reshape(-1, 3, 32, 32)
+    labels = np.asarray(batch[b"labels"], dtype=np.int64)
+    return images, labels
+
+
+def _source_stamps(raw_dir: Path, splits: dict[str, list[str]]) -> dict[str, list[int]]:
+    stamps: dict[str, list[int]] = {}
+    for names in splits.values():
+        for name in names:
+            st = (raw_dir / name).stat()
+            stamps[name] = [st.st_size, st.st_mtime_ns]
+    return stamps
+
+
+def _is_current(out_dir: Path, splits: dict[str, list[str]], stamps: dict[str, list[int]]) -> bool:
+    try:
+        manifest = json.loads((out_dir / PACK_MANIFEST_FILENAME).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return False
+    if manifest.get("layout") != PACK_LAYOUT_VERSION or manifest.get("sources") != stamps:
+        return False
+    return all(p.exists() for split in splits for p in packed_paths(out_dir, split))
+
+
+def _pack_split(raw_dir: Path, out_dir: Path, split: str, names: list[str]) -> PackedSplit:
+    batches = [_load_batch(raw_dir / name) for name in names]
+    count = sum(len(labels) for _, labels in batches)
+    images_path, labels_path = packed_paths(out_dir, split)
+
+    images_tmp = images_path.with_name(images_path.name + ".tmp")
+    images = np.lib.format.open_memmap(images_tmp, mode="w+", dtype=np.uint8, shape=(count, 32, 32, 3))
+    start = 0
+    for batch_images, _ in batches:
+        # NCHW planes -> NHWC pixels, written straight into the contiguous output.
+        images[start:start + len(batch_images)] = batch_images.transpose(0, 2, 3, 1)
+        start += len(batch_images)
+    images.flush()
+    del images
+
+    labels_tmp = labels_path.with_name(labels_path.name + ".tmp")
+    with labels_tmp.open("wb") as f:
+        np.save(f, np.concatenate([labels for _, labels in batches]))
+
+    os.replace(images_tmp, images_path)
+    os.replace(labels_tmp, labels_path)
+    return PackedSplit(split=split, images_path=images_path, labels_path=labels_path, count=count)
+
+
+def pack_cifar10(
+    *, raw_dir: Path, out_dir: Path, splits: dict[str, list[str]] = CIFAR10_SPLITS, force: bool = False
+) -> list[PackedSplit]:
+    """Write each split as <split>_images.npy (N, 32, 32, 3) uint8 and <split>_labels.npy (N,) int64.
+
+    The .npy files are C-contiguous so readers can np.load(..., mmap_mode="r")
+    them without copying. A manifest records the size and mtime of the source
+    batches; packing is skipped while they and the outputs are unchanged.
+    """
+    out_dir.mkdir(parents=True, exist_ok=True)
+    stamps = _source_stamps(raw_dir, splits)
+    if not force and _is_current(out_dir, splits, stamps):
+        manifest = json.loads((out_dir / PACK_MANIFEST_FILENAME).read_text(encoding="utf-8"))
+        return [
+            PackedSplit(split, *packed_paths(out_dir, split), count=int(manifest["counts"][split]))
+            for split in splits
+        ]
+
+    packed = [_pack_split(raw_dir, out_dir, split, names) for split, names in splits.items()]
+    manifest = {
+        "layout": PACK_LAYOUT_VERSION,
+        "sources": stamps,
+        "counts": {p.split: p.count for p in packed},
+    }
+    tmp = out_dir / (PACK_MANIFEST_FILENAME + ".tmp")
+    tmp.write_text(json.dumps(manifest, indent=2, sort_keys=True) + "\n", encoding="utf-8")
+    tmp.replace(out_dir / PACK_MANIFEST_FILENAME)
+    return packed
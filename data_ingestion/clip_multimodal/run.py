@@ -10,17 +10,27 @@ _REPO_ROOT = Path(__file__).resolve().parents[2]
 if str(_REPO_ROOT) not in sys.path:
     sys.path.insert(0, str(_REPO_ROOT))
 
+from data_ingestion.clip_multimodal.pack import pack_cifar10  # noqa: E402
 from data_ingestion.common import (  # noqa: E402
+    NO_LIMITS,
     CachedFile,
-    download_url,
-    extract_tar_gz,
+    StageLimits,
+    cached_file_record,
+    directory_record,
+    fetch_tar_gz,
+    read_provenance_record,
     sha256_file,
     write_json,
     write_provenance,
 )
+from data_ingestion.download import DEFAULT_CONNECTIONS, DEFAULT_RETRIES  # noqa: E402
+from data_ingestion.hashing import HashMemo  # noqa: E402
+from data_ingestion.merkle import DEFAULT_TREE_WORKERS  # noqa: E402
+from data_ingestion.timing import StageRecorder  # noqa: E402
 from data_ingestion.config_utils import (  # noqa: E402
     as_path,
     load_toml,
+    optional_bool,
     optional_int,
     optional_list_of_str,
     optional_str,
@@ -56,9 +66,11 @@ def load_config(config_path: Path) -> dict[str, Any]:
     label_texts_filename = require_str(
         paths_tbl, "label_texts_filename", path=config_path, table_name="paths"
     )
+    packed_dirname = optional_str(paths_tbl, "packed_dirname")
     provenance_filename = require_str(
         paths_tbl, "provenance_filename", path=config_path, table_name="paths"
     )
+    events_filename = optional_str(paths_tbl, "events_filename")
 
     url = require_str(download_tbl, "url", path=config_path,
                       table_name="download")
@@ -69,9 +81,11 @@ def load_config(config_path: Path) -> dict[str, Any]:
     user_agent = require_str(download_tbl, "user_agent",
                              path=config_path, table_name="download")
     timeout_seconds = optional_int(download_tbl, "timeout_seconds")
+    connections = optional_int(download_tbl, "connections")
+    retries = optional_int(download_tbl, "retries")
+    stream_extract = optional_bool(download_tbl, "stream_extract")
+    keep_archive = optional_bool(download_tbl, "keep_archive")
 
-    sentinel_relpath = require_str(
-        extract_tbl, "sentinel_relpath", path=config_path, table_name="extract")
     extracted_root_dirname = require_str(
         extract_tbl, "extracted_root_dirname", path=config_path, table_name="extract"
     )
@@ -79,6 +93,7 @@ def load_config(config_path: Path) -> dict[str, Any]:
     if not expected_files:
         raise ValueError(
             "Config must include [extract].expected_files as a non-empty list")
+    hash_workers = optional_int(extract_tbl, "hash_workers")
 
     label_texts = optional_list_of_str(dataset_tbl, "label_texts")
     if not label_texts:
@@ -91,7 +106,9 @@ def load_config(config_path: Path) -> dict[str, Any]:
         "archive_filename": archive_filename,
         "raw_dirname": raw_dirname,
         "label_texts_filename": label_texts_filename,
+        "packed_dirname": packed_dirname or "packed",
         "provenance_filename": provenance_filename,
+        "events_filename": events_filename,
         "url": url,
         "expected_md5": expected_md5,
         "expected_sha256": expected_sha256,
@@ -99,17 +116,27 @@ def load_config(config_path: Path) -> dict[str, Any]:
         "expected_bytes_max": expected_bytes_max,
         "user_agent": user_agent,
         "timeout_seconds": timeout_seconds,
-        "sentinel_relpath": sentinel_relpath,
+        "connections": connections,
+        "retries": retries,
+        "stream_extract": bool(stream_extract),
+        "keep_archive": True if keep_archive is None else keep_archive,
         "extracted_root_dirname": extracted_root_dirname,
         "expected_files": expected_files,
         "label_texts": label_texts,
+        "hash_workers": hash_workers,
     }
 
 
-def ingest(*, config: dict[str, Any], cache_root: Path, force: bool = False) -> Path:
+def ingest(
+    *, config: dict[str, Any], cache_root: Path, force: bool = False, limits: StageLimits = NO_LIMITS
+) -> Path:
     pipeline: PipelineName = "clip_multimodal"
     pipeline_cache = cache_root / pipeline
     pipeline_cache.mkdir(parents=True, exist_ok=True)
+    memo = HashMemo.for_cache_root(cache_root)
+    events_filename = config.get("events_filename")
+    recorder = StageRecorder(
+        pipeline=pipeline, event_log=pipeline_cache / str(events_filename) if events_filename else None)
 
     archive_path = pipeline_cache / str(config["archive_filename"])
     raw_dir = pipeline_cache / str(config["raw_dirname"])
@@ -119,63 +146,74 @@ def ingest(*, config: dict[str, Any], cache_root: Path, force: bool = False) ->
     print(f"[clip_multimodal] Downloading: {url}")
     print(f"[clip_multimodal] Cache file: {archive_path}")
 
-    download_url(
+    provenance_path = pipeline_cache / str(config["provenance_filename"])
+    if config["stream_extract"]:
+        print(f"[clip_multimodal] Streaming extraction into: {raw_dir}")
+    else:
+        print(f"[clip_multimodal] Extracting into: {raw_dir}")
+    archive_record = fetch_tar_gz(
         url=url,
-        dst=archive_path,
+        archive_path=archive_path,
+        dst_dir=raw_dir,
+        stream=bool(config["stream_extract"]),
+        keep_archive=bool(config["keep_archive"]),
+        previous=read_provenance_record(provenance_path, method="download"),
         expected_md5=config.get("expected_md5"),
         expected_sha256=config.get("expected_sha256"),
         expected_bytes_min=config.get("expected_bytes_min"),
         expected_bytes_max=config.get("expected_bytes_max"),
         user_agent=str(config["user_agent"]),
         timeout_seconds=int(config["timeout_seconds"] or 60),
+        connections=int(config["connections"] or DEFAULT_CONNECTIONS),
+        retries=int(config["retries"] if config["retries"] is not None else DEFAULT_RETRIES),
         force=force,
-    )
-
-    print(f"[clip_multimodal] Extracting into: {raw_dir}")
-    extract_tar_gz(
-        archive_path=archive_path,
-        dst_dir=raw_dir,
-        sentinel_relpath=str(config["sentinel_relpath"]),
+        memo=memo,
+        limits=limits,
+        recorder=recorder,
     )
 
     # Basic sanity checks (expected files)
     base = raw_dir / str(config["extracted_root_dirname"])
     expected = [base / rel for rel in list(config["expected_files"])]
-    missing = [str(p) for p in expected if not p.exists()]
-    if missing:
-        raise RuntimeError(
-            f"CIFAR-10 extraction sanity check failed; missing files: {missing}")
+    with recorder.stage("sanity_check"):
+        missing = [str(p) for p in expected if not p.exists()]
+        if missing:
+            raise RuntimeError(
+                f"CIFAR-10 extraction sanity check failed; missing files: {missing}")
 
     # Cache a deterministic mapping from label id -> text prompt.
     labels_path = pipeline_cache / str(config["label_texts_filename"])
     write_json(labels_path, {"labels": list(config["label_texts"])})
 
-    provenance_path = pipeline_cache / str(config["provenance_filename"])
-    files: list[CachedFile] = [
-        CachedFile(
-            src=url,
-            dst=str(archive_path),
-            method="download",
-            bytes=archive_path.stat().st_size,
-            sha256=sha256_file(archive_path),
-        ),
-        CachedFile(
-            src=str(archive_path),
-            dst=str(base / "batches.meta"),
-            method="extract",
-            bytes=(base / "batches.meta").stat().st_size,
-            sha256=sha256_file(base / "batches.meta"),
-        ),
-        CachedFile(
-            src="(generated) label_texts.json",
-            dst=str(labels_path),
-            method="generated",
-            bytes=labels_path.stat().st_size,
-            sha256=sha256_file(labels_path),
-        ),
-    ]
+    # Contiguous NHWC uint8 / int64 arrays that notebooks memory-map instead of unpickling.
+    packed_dir = pipeline_cache / str(config["packed_dirname"])
+    print(f"[clip_multimodal] Packing arrays into: {packed_dir}")
+    with limits.cpu(), recorder.stage("pack") as meter:
+        packed = pack_cifar10(raw_dir=base, out_dir=packed_dir, force=force)
+        meter.add_bytes(sum(p.images_path.stat().st_size + p.labels_path.stat().st_size for p in packed))
+
+    with recorder.stage("hashing") as meter:
+        files: list[CachedFile] = [
+            archive_record,
+            directory_record(
+                src=archive_path, dst=base, method="extract",
+                workers=int(config["hash_workers"] or DEFAULT_TREE_WORKERS), memo=memo),
+            CachedFile(
+                src="(generated) label_texts.json",
+                dst=str(labels_path),
+                method="generated",
+                bytes=labels_path.stat().st_size,
+                sha256=sha256_file(labels_path, memo=memo),
+            ),
+        ]
+        for p in packed:
+            files.append(cached_file_record(
+                src=f"(packed) {p.split}", dst=p.images_path, method="generated", memo=memo))
+            files.append(cached_file_record(
+                src=f"(packed) {p.split}", dst=p.labels_path, method="generated", memo=memo))
+        meter.add_bytes(sum(f.bytes for f in files[1:]))
     write_provenance(pipeline=pipeline, cache_root=cache_root,
-                     files=files, out_path=provenance_path)
+                     files=files, out_path=provenance_path, timings=recorder.timings)
     return provenance_path
 
 
@@ -5,14 +5,31 @@ import json
 import os
 import shutil
 import tarfile
+import threading
 import zipfile
-from urllib.request import Request, urlopen
+from collections.abc import Iterator
+import contextlib
+from contextlib import contextmanager
 from dataclasses import asdict, dataclass
 from datetime import datetime, timezone
 from pathlib import Path
 from shutil import copy2
 from typing import Any
 
+from data_ingestion.download import (
+    DEFAULT_CONNECTIONS,
+    DEFAULT_RETRIES,
+    DEFAULT_STREAM_BUFFER_CHUNKS,
+    discard_tmp,
+    fetch_to_tmp,
+    stream_url,
+)
+from data_ingestion.extraction import ExecutorKind, extract_zip_parallel
+from data_ingestion.hashing import DigestBundle, HashMemo, digest_file
+from data_ingestion.manifest import ExtractionManifest, manifest_path_for
+from data_ingestion.merkle import DEFAULT_TREE_WORKERS, digest_tree
+from data_ingestion.timing import StageRecorder, StageTiming, maybe_stage
+
 
 @dataclass(frozen=True)
 class CachedFile:
@@ -21,13 +38,53 @@ class CachedFile:
     method: str
     bytes: int
     sha256: str
+    file_count: int | None = None  # set for directory records (sha256 is then a Merkle root)
+
+
+class StageLimits:
+    """Caps how many pipelines may be in a network- or CPU-bound stage at once.
+
+    A limit of None means unbounded. Shared by all pipelines of one
+    `python -m data_ingestion` run; a standalone run.py uses no limits.
+    """
+
+    def __init__(self, *, network: int | None = None, cpu: int | None = None) -> None:
+        self._network = threading.BoundedSemaphore(network) if network else None
+        self._cpu = threading.BoundedSemaphore(cpu) if cpu else None
+
+    @staticmethod
+    @contextmanager
+    def _hold(*sems: threading.BoundedSemaphore | None) -> Iterator[None]:
+        # Always acquired in (network, cpu) order, so mixed stages cannot deadlock.
+        held = [s for s in sems if s is not None]
+        for sem in held:
+            sem.acquire()
+        try:
+            yield
+        finally:
+            for sem in reversed(held):
+                sem.release()
+
+    def network(self) -> contextlib.AbstractContextManager[None]:
+        return self._hold(self._network)
+
+    def cpu(self) -> contextlib.AbstractContextManager[None]:
+        return self._hold(self._cpu)
+
+    def network_and_cpu(self) -> contextlib.AbstractContextManager[None]:
+        return self._hold(self._network, self._cpu)
+
+
+NO_LIMITS = StageLimits()
 
 
 def utc_now_iso() -> str:
     return datetime.now(timezone.utc).isoformat()
 
 
-def sha256_file(path: Path, chunk_size: int = 1024 * 1024) -> str:
+def sha256_file(path: Path, chunk_size: int = 1024 * 1024, *, memo: HashMemo | None = None) -> str:
+    if memo is not None:
+        return digest_file(path, chunk_size, memo=memo).sha256
     digest = hashlib.sha256()
     with path.open("rb") as f:
         while True:
@@ -38,7 +95,9 @@ def sha256_file(path: Path, chunk_size: int = 1024 * 1024) -> str:
     return digest.hexdigest()
 
 
-def md5_file(path: Path, chunk_size: int = 1024 * 1024) -> str:
+def md5_file(path: Path, chunk_size: int = 1024 * 1024, *, memo: HashMemo | None = None) -> str:
+    if memo is not None:
+        return digest_file(path, chunk_size, memo=memo).md5
     digest = hashlib.md5()  # noqa: S324 - used for dataset integrity checks only
     with path.open("rb") as f:
         while True:
@@ -66,18 +125,16 @@ def ensure_dir(path: Path) -> None:
     path.mkdir(parents=True, exist_ok=True)
 
 
-def verify_file(
+def verify_digests(
     *,
     path: Path,
+    digests: DigestBundle,
     expected_bytes_min: int | None = None,
     expected_bytes_max: int | None = None,
     expected_sha256: str | None = None,
     expected_md5: str | None = None,
 ) -> None:
-    if not path.exists():
-        raise FileNotFoundError(str(path))
-
-    size = path.stat().st_size
+    size = digests.bytes
     if expected_bytes_min is not None and size < expected_bytes_min:
         raise ValueError(
             f"File too small: {path} ({size} bytes < {expected_bytes_min})")
@@ -86,18 +143,52 @@ def verify_file(
             f"File too large: {path} ({size} bytes > {expected_bytes_max})")
 
     if expected_sha256 is not None:
-        actual = sha256_file(path)
+        actual = digests.sha256
         if actual.lower() != expected_sha256.lower():
             raise ValueError(
                 f"SHA256 mismatch for {path}: {actual} != {expected_sha256}")
 
     if expected_md5 is not None:
-        actual = md5_file(path)
+        actual = digests.md5
         if actual.lower() != expected_md5.lower():
             raise ValueError(
                 f"MD5 mismatch for {path}: {actual} != {expected_md5}")
 
 
+def verify_file(
+    *,
+    path: Path,
+    expected_bytes_min: int | None = None,
+    expected_bytes_max: int | None = None,
+    expected_sha256: str | None = None,
+    expected_md5: str | None = None,
+    memo: HashMemo | None = None,
+) -> DigestBundle:
+    """Verify path in a single read and return its digests for reuse in provenance.
+
+    With a memo, an unchanged file is verified from its cached digests (stat only).
+    """
+    if not path.exists():
+        raise FileNotFoundError(str(path))
+
+    size = path.stat().st_size
+    if expected_bytes_min is not None and size < expected_bytes_min:
+        raise ValueError(
+            f"File too small: {path} ({size} bytes < {expected_bytes_min})")
+    if expected_bytes_max is not None and size > expected_bytes_max:
+        raise ValueError(
+            f"File too large: {path} ({size} bytes > {expected_bytes_max})")
+
+    digests = digest_file(path, memo=memo)
+    verify_digests(
+        path=path,
+        digests=digests,
+        expected_sha256=expected_sha256,
+        expected_md5=expected_md5,
+    )
+    return digests
+
+
 def download_url(
     *,
     url: str,
@@ -108,97 +199,434 @@ def download_url(
     expected_md5: str | None = None,
     user_agent: str = "pjatk_zum-ingestion/1.0",
     timeout_seconds: int = 60,
+    connections: int = DEFAULT_CONNECTIONS,
+    retries: int = DEFAULT_RETRIES,
     force: bool = False,
-) -> Path:
-    """Download a URL to dst atomically and verify basic integrity.
+    memo: HashMemo | None = None,
+    recorder: StageRecorder | None = None,
+) -> DigestBundle:
+    """Download a URL to dst atomically, verify basic integrity and return its digests.
 
     Idempotent behavior:
     - If dst exists and passes verification, it is reused.
     - If dst exists but fails verification (or force=True), it is re-downloaded.
+    - An interrupted download leaves `<dst>.tmp` behind and is resumed on the next
+      call (using `connections` parallel Range requests when the server allows it).
+
+    The archive is read at most once: single-stream downloads are hashed while
+    the bytes come off the socket, everything else is hashed in one pass.
     """
     ensure_dir(dst.parent)
 
     if dst.exists() and not force:
         try:
-            verify_file(
-                path=dst,
-                expected_bytes_min=expected_bytes_min,
-                expected_bytes_max=expected_bytes_max,
-                expected_sha256=expected_sha256,
-                expected_md5=expected_md5,
-            )
-            return dst
+            # The failure propagates through the stage first, so it is recorded with ok=false.
+            with maybe_stage(recorder, "verify") as meter:
+                digests = verify_file(
+                    path=dst,
+                    expected_bytes_min=expected_bytes_min,
+                    expected_bytes_max=expected_bytes_max,
+                    expected_sha256=expected_sha256,
+                    expected_md5=expected_md5,
+                    memo=memo,
+                )
+                meter.add_bytes(digests.bytes)
+            return digests
         except Exception:
             dst.unlink()
 
     tmp = dst.with_suffix(dst.suffix + ".tmp")
-    if tmp.exists():
-        tmp.unlink()
-
-    req = Request(url, headers={"User-Agent": user_agent})
-    with urlopen(req, timeout=timeout_seconds) as resp, tmp.open("wb") as out:
-        shutil.copyfileobj(resp, out)
+    if force:
+        discard_tmp(tmp)
+
+    with maybe_stage(recorder, "download") as meter:
+        digests = fetch_to_tmp(
+            url=url,
+            tmp=tmp,
+            user_agent=user_agent,
+            timeout_seconds=timeout_seconds,
+            connections=connections,
+            retries=retries,
+        )
+        meter.add_bytes(tmp.stat().st_size)
 
     tmp.replace(dst)
-    verify_file(
-        path=dst,
+    with maybe_stage(recorder, "verify") as meter:
+        if digests is None:
+            digests = digest_file(dst, memo=memo)
+        elif memo is not None:
+            memo.remember(dst, digests)
+        meter.add_bytes(digests.bytes)
+        verify_digests(
+            path=dst,
+            digests=digests,
+            expected_bytes_min=expected_bytes_min,
+            expected_bytes_max=expected_bytes_max,
+            expected_sha256=expected_sha256,
+            expected_md5=expected_md5,
+        )
+    return digests
+
+
+def _extract_tar_stream(tf: tarfile.TarFile, dst_dir: Path, manifest: ExtractionManifest, wanted: set[str] | None) -> None:
+    """Extract members from a (stream-mode) tar; record them all when wanted is None."""
+
+    def members() -> Iterator[tarfile.TarInfo]:
+        for member in tf:
+            if wanted is None:
+                if member.isfile():
+                    manifest.add(member.name, size=member.size, check=int(member.mtime))
+                yield member
+            elif member.name in wanted:
+                yield member
+
+    tf.extractall(dst_dir, members=members())
+
+
+def extract_tar_gz(*, archive_path: Path, dst_dir: Path, source: str | None = None) -> Path:
+    """Extract a .tar.gz into dst_dir, guided by a per-member manifest.
+
+    The first extraction records every member (path, size, mtime) in
+    `.<archive>.manifest.json` inside dst_dir. Later calls stat the tree against
+    it and re-extract only missing or modified members. `source` (the archive's
+    sha256) invalidates the manifest when the archive itself changes.
+    """
+    ensure_dir(dst_dir)
+    manifest_path = manifest_path_for(dst_dir, archive_path.name)
+    manifest = ExtractionManifest.load(manifest_path)
+    if manifest is not None and (source is None or manifest.source == source):
+        todo = manifest.damaged(dst_dir)
+        if not todo:
+            return dst_dir
+        with tarfile.open(archive_path, mode="r|gz") as tf:
+            _extract_tar_stream(tf, dst_dir, manifest, set(todo))
+        manifest.stamp(dst_dir, todo)
+        manifest.save(manifest_path)
+        return dst_dir
+
+    manifest = ExtractionManifest(kind="tar", source=source)
+    with tarfile.open(archive_path, mode="r|gz") as tf:
+        _extract_tar_stream(tf, dst_dir, manifest, None)
+    manifest.stamp(dst_dir)
+    manifest.save(manifest_path)
+    return dst_dir
+
+
+def _publish_tree(staging: Path, dst_dir: Path, *, merge: bool = False) -> None:
+    """Move staged files into dst_dir and remove staging.
+
+    merge=False swaps whole top-level entries (fast, for full extractions);
+    merge=True moves file by file so the rest of dst_dir is left alone.
+    """
+    ensure_dir(dst_dir)
+    if merge:
+        for dirpath, _, filenames in os.walk(staging):
+            rel = Path(dirpath).relative_to(staging)
+            for filename in filenames:
+                target = dst_dir / rel / filename
+                ensure_dir(target.parent)
+                os.replace(Path(dirpath) / filename, target)
+        shutil.rmtree(staging)
+        return
+
+    for child in staging.iterdir():
+        target = dst_dir / child.name
+        if target.is_dir() and not target.is_symlink():
+            shutil.rmtree(target)
+        elif target.exists() or target.is_symlink():
+            target.unlink()
+        child.replace(target)
+    staging.rmdir()
+
+
+def stream_extract_tar_gz(
+    *,
+    url: str,
+    dst_dir: Path,
+    manifest_path: Path,
+    keep_archive: Path | None = None,
+    members: set[str] | None = None,
+    expected_bytes_min: int | None = None,
+    expected_bytes_max: int | None = None,
+    expected_sha256: str | None = None,
+    expected_md5: str | None = None,
+    user_agent: str = "pjatk_zum-ingestion/1.0",
+    timeout_seconds: int = 60,
+    buffer_chunks: int = DEFAULT_STREAM_BUFFER_CHUNKS,
+    memo: HashMemo | None = None,
+) -> DigestBundle:
+    """Download a .tar.gz and extract it in the same pass.
+
+    Decompression runs on the calling thread while a download thread fills a
+    bounded buffer, so time-to-ready approaches max(download, extract) rather
+    than their sum. Members land in a staging directory that is only moved into
+    dst_dir once the digests verify; keep_archive additionally tees the raw
+    bytes to disk. With `members`, only those members are extracted (repair of
+    an existing tree described by the manifest at manifest_path).
+    """
+    repair = members is not None
+    manifest = ExtractionManifest.load(manifest_path) if repair else None
+    if manifest is None:
+        repair, members = False, None
+        manifest = ExtractionManifest(kind="tar")
+
+    staging = dst_dir.with_name(dst_dir.name + ".partial")
+    if staging.exists():
+        shutil.rmtree(staging)
+    ensure_dir(staging)
+    # Not download_url's "<archive>.tmp": that one may hold a resumable ranged download and its part state.
+    tee = keep_archive.with_suffix(keep_archive.suffix + ".stream.tmp") if keep_archive is not None else None
+    if tee is not None:
+        ensure_dir(tee.parent)
+
+    def consume(reader: Any) -> None:
+        with tarfile.open(fileobj=reader, mode="r|gz") as tf:
+            _extract_tar_stream(tf, staging, manifest, members)
+
+    try:
+        digests = stream_url(
+            url=url,
+            consume=consume,
+            user_agent=user_agent,
+            timeout_seconds=timeout_seconds,
+            tee_path=tee,
+            buffer_chunks=buffer_chunks,
+        )
+        verify_digests(
+            path=keep_archive if keep_archive is not None else Path(url),
+            digests=digests,
+            expected_bytes_min=expected_bytes_min,
+            expected_bytes_max=expected_bytes_max,
+            expected_sha256=expected_sha256,
+            expected_md5=expected_md5,
+        )
+        if repair and manifest.source not in (None, digests.sha256):
+            raise ValueError(
+                f"Archive at {url} changed since {dst_dir} was extracted; re-run with --force")
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        if tee is not None:
+            tee.unlink(missing_ok=True)
+        raise
+
+    _publish_tree(staging, dst_dir, merge=repair)
+    manifest.source = digests.sha256
+    manifest.stamp(dst_dir, sorted(members) if members is not None else None)
+    manifest.save(manifest_path)
+    if keep_archive is not None and tee is not None:
+        tee.replace(keep_archive)
+        if memo is not None:
+            memo.remember(keep_archive, digests)
+    return digests
+
+
+def fetch_tar_gz(
+    *,
+    url: str,
+    archive_path: Path,
+    dst_dir: Path,
+    stream: bool,
+    keep_archive: bool,
+    previous: CachedFile | None = None,
+    expected_bytes_min: int | None = None,
+    expected_bytes_max: int | None = None,
+    expected_sha256: str | None = None,
+    expected_md5: str | None = None,
+    user_agent: str = "pjatk_zum-ingestion/1.0",
+    timeout_seconds: int = 60,
+    connections: int = DEFAULT_CONNECTIONS,
+    retries: int = DEFAULT_RETRIES,
+    force: bool = False,
+    memo: HashMemo | None = None,
+    limits: StageLimits = NO_LIMITS,
+    recorder: StageRecorder | None = None,
+) -> CachedFile:
+    """Make sure dst_dir holds the extracted archive; return the archive's provenance record.
+
+    - stream=False: download to archive_path (resumable), then extract.
+    - stream=True: download and extract concurrently over a single connection,
+      without retries or resume (connections/retries do not apply); a cached
+      archive on disk is still reused. With keep_archive=False and an intact extraction, the
+      download record from the previous provenance (`previous`) is carried over;
+      a damaged extraction is repaired by re-streaming only the broken members.
+    """
+    manifest_path = manifest_path_for(dst_dir, archive_path.name)
+    manifest = ExtractionManifest.load(manifest_path)
+    damaged = manifest.damaged(dst_dir) if manifest is not None else None
+    if archive_path.exists() and not force:
+        stream = False  # cached archive: verify (memoized) and extract from disk
+    expected = dict(
         expected_bytes_min=expected_bytes_min,
         expected_bytes_max=expected_bytes_max,
         expected_sha256=expected_sha256,
         expected_md5=expected_md5,
     )
-    return dst
-
 
-def extract_tar_gz(*, archive_path: Path, dst_dir: Path, sentinel_relpath: str | None = None) -> Path:
-    """Extract a .tar.gz into dst_dir; reuse existing extraction if sentinel exists."""
-    ensure_dir(dst_dir)
-    if sentinel_relpath is not None:
-        sentinel = dst_dir / sentinel_relpath
-        if sentinel.exists():
-            return dst_dir
-
-    with tarfile.open(archive_path, mode="r:gz") as tf:
-        tf.extractall(dst_dir)
-    return dst_dir
+    if stream:
+        if damaged == [] and not force and not keep_archive and previous is not None:
+            return previous
+        with limits.network_and_cpu(), maybe_stage(recorder, "download_extract") as meter:
+            digests = stream_extract_tar_gz(
+                url=url,
+                dst_dir=dst_dir,
+                manifest_path=manifest_path,
+                keep_archive=archive_path if keep_archive else None,
+                members=set(damaged) if damaged is not None and not force else None,
+                user_agent=user_agent,
+                timeout_seconds=timeout_seconds,
+                memo=memo,
+                **expected,
+            )
+            meter.add_bytes(digests.bytes)
+        return cached_file_record(
+            src=url,
+            dst=archive_path if keep_archive else dst_dir,
+            method="download",
+            digests=digests,
+        )
+
+    with limits.network():
+        digests = download_url(
+            url=url,
+            dst=archive_path,
+            user_agent=user_agent,
+            timeout_seconds=timeout_seconds,
+            connections=connections,
+            retries=retries,
+            force=force,
+            memo=memo,
+            recorder=recorder,
+            **expected,
+        )
+    with limits.cpu(), maybe_stage(recorder, "extract") as meter:
+        extract_tar_gz(archive_path=archive_path, dst_dir=dst_dir, source=digests.sha256)
+        meter.add_bytes(digests.bytes)
+    return cached_file_record(src=url, dst=archive_path, method="download", digests=digests)
+
+
+def extract_zip(
+    *,
+    archive_path: Path,
+    dst_dir: Path,
+    workers: int = 1,
+    executor: ExecutorKind = "process",
+) -> Path:
+    """Extract a .zip into dst_dir, guided by a per-member manifest.
 
+    The manifest (path, size, CRC-32 from the central directory, plus each
+    file's on-disk mtime after extraction) lives in `.<archive>.manifest.json`
+    inside dst_dir; re-runs stat the tree against it and extract only missing
+    or modified members.
 
-def extract_zip(*, archive_path: Path, dst_dir: Path, sentinel_relpath: str | None = None) -> Path:
-    """Extract a .zip into dst_dir; reuse existing extraction if sentinel exists."""
+    With workers > 1 the members are extracted by a process (or thread) pool,
+    which pays off for archives made of thousands of small files. The pool is
+    capped at the CPU count; on a single core this is plain extractall.
+    """
     ensure_dir(dst_dir)
-    if sentinel_relpath is not None:
-        sentinel = dst_dir / sentinel_relpath
-        if sentinel.exists():
-            return dst_dir
-
-    with zipfile.ZipFile(archive_path) as zf:
-        zf.extractall(dst_dir)
+    manifest_path = manifest_path_for(dst_dir, archive_path.name)
+    # The central directory is cheap to read, so the manifest is always rebuilt
+    # from it; stamps carry over for members whose size/CRC did not change.
+    manifest = ExtractionManifest.from_zip(archive_path)
+    manifest.adopt_stamps(ExtractionManifest.load(manifest_path))
+    todo = manifest.damaged(dst_dir)
+
+    if todo:
+        workers = min(workers, os.cpu_count() or 1)
+        if workers > 1:
+            extract_zip_parallel(archive_path=archive_path, dst_dir=dst_dir,
+                                 workers=workers, executor=executor, members=todo)
+        else:
+            with zipfile.ZipFile(archive_path) as zf:
+                zf.extractall(dst_dir, members=todo)
+
+    unstamped = [name for name, m in manifest.members.items() if m.stamp_ns is None]
+    if todo or unstamped:
+        manifest.stamp(dst_dir, sorted(set(todo) | set(unstamped)))
+        manifest.save(manifest_path)
     return dst_dir
 
 
 def write_json(path: Path, data: Any) -> None:
     ensure_dir(path.parent)
-    path.write_text(json.dumps(
-        data, indent=2, sort_keys=True) + "\n", encoding="utf-8")
+    text = json.dumps(data, indent=2, sort_keys=True) + "\n"
+    # Leave identical files untouched so their mtime (and hash memo entry) survives.
+    if path.exists() and path.read_text(encoding="utf-8") == text:
+        return
+    path.write_text(text, encoding="utf-8")
+
+
+def cached_file_record(
+    *,
+    src: str | Path,
+    dst: Path,
+    method: str,
+    digests: DigestBundle | None = None,
+    memo: HashMemo | None = None,
+) -> CachedFile:
+    if digests is None:
+        return CachedFile(
+            src=str(src),
+            dst=str(dst),
+            method=method,
+            bytes=dst.stat().st_size,
+            sha256=sha256_file(dst, memo=memo),
+        )
+    return CachedFile(
+        src=str(src),
+        dst=str(dst),
+        method=method,
+        bytes=digests.bytes,
+        sha256=digests.sha256,
+    )
 
 
-def cached_file_record(*, src: Path, dst: Path, method: str) -> CachedFile:
+def directory_record(
+    *,
+    src: str | Path,
+    dst: Path,
+    method: str,
+    workers: int = DEFAULT_TREE_WORKERS,
+    memo: HashMemo | None = None,
+) -> CachedFile:
+    tree = digest_tree(dst, workers=workers, memo=memo)
     return CachedFile(
         src=str(src),
         dst=str(dst),
         method=method,
-        bytes=dst.stat().st_size,
-        sha256=sha256_file(dst),
+        bytes=tree.bytes,
+        sha256=tree.sha256,
+        file_count=tree.file_count,
     )
 
 
-def write_provenance(*, pipeline: str, cache_root: Path, files: list[CachedFile], out_path: Path) -> None:
+def write_provenance(
+    *,
+    pipeline: str,
+    cache_root: Path,
+    files: list[CachedFile],
+    out_path: Path,
+    timings: list[StageTiming] | None = None,
+) -> None:
     provenance: dict[str, Any] = {
         "pipeline": pipeline,
         "created_at": utc_now_iso(),
         "cache_root": str(cache_root),
         "files": [asdict(f) for f in files],
     }
+    if timings is not None:
+        provenance["timings"] = [asdict(t) for t in timings]
     out_path.parent.mkdir(parents=True, exist_ok=True)
     out_path.write_text(json.dumps(provenance, indent=2,
                         sort_keys=True) + "\n", encoding="utf-8")
+
+
+def read_provenance_record(path: Path, *, method: str) -> CachedFile | None:
+    """Return the first record with the given method from an existing provenance.json."""
+    try:
+        data = json.loads(path.read_text(encoding="utf-8"))
+        for entry in data.get("files", []):
+            if entry.get("method") == method:
+                return CachedFile(**entry)
+    except (OSError, ValueError, TypeError):
+        return None
+    return None
@@ -30,6 +30,15 @@ def require_table(cfg: dict[str, Any], key: str, *, path: Path) -> dict[str, Any
     return value
 
 
+def optional_table(cfg: dict[str, Any], key: str, *, path: Path) -> dict[str, Any]:
+    value = cfg.get(key)
+    if value is None:
+        return {}
+    if not isinstance(value, dict):
+        raise ConfigError(f"Invalid [{key}] table in config: {path}")
+    return value
+
+
 def require_str(table: dict[str, Any], key: str, *, path: Path, table_name: str) -> str:
     value = table.get(key)
     if not isinstance(value, str) or not value:
@@ -57,6 +66,15 @@ def optional_int(table: dict[str, Any], key: str) -> int | None:
     return value
 
 
+def optional_bool(table: dict[str, Any], key: str) -> bool | None:
+    value = table.get(key)
+    if value is None:
+        return None
+    if not isinstance(value, bool):
+        raise ConfigError(f"Invalid '{key}' (expected bool)")
+    return value
+
+
 def optional_list_of_str(table: dict[str, Any], key: str) -> list[str] | None:
     value = table.get(key)
     if value is None:
@@ -0,0 +1,402 @@
+from __future__ import annotations
+
+import io
+import json
+import math
+import os
+import queue
+import threading
+import time
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any, BinaryIO
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+from data_ingestion.hashing import DigestBundle, MultiHasher
+
+DEFAULT_CONNECTIONS = 1
+DEFAULT_RETRIES = 3
+DEFAULT_PART_SIZE = 8 * 1024 * 1024
+READ_CHUNK_SIZE = 1024 * 1024
+STATE_FLUSH_SECONDS = 1.0
+DEFAULT_STREAM_BUFFER_CHUNKS = 64
+
+
+@dataclass(frozen=True)
+class RemoteInfo:
+    size: int | None
+    accepts_ranges: bool
+    etag: str | None
+    last_modified: str | None
+
+
+@dataclass
+class RangePart:
+    start: int
+    end: int  # exclusive
+    done: int = 0
+
+    @property
+    def complete(self) -> bool:
+        return self.start + self.done >= self.end
+
+
+def state_path_for(tmp: Path) -> Path:
+    return tmp.with_name(tmp.name + ".parts.json")
+
+
+def _open(url: str, *, user_agent: str, timeout_seconds: int, byte_range: str | None = None):
+    headers = {"User-Agent": user_agent}
+    if byte_range is not None:
+        headers["Range"] = f"bytes={byte_range}"
+    return urlopen(Request(url, headers=headers), timeout=timeout_seconds)
+
+
+def _parse_content_range_total(value: str | None) -> int | None:
+    # e.g. "bytes 0-0/170498071"
+    if not value or "/" not in value:
+        return None
+    total = value.rsplit("/", 1)[1].strip()
+    return int(total) if total.isdigit() else None
+
+
+def probe_remote(*, url: str, user_agent: str, timeout_seconds: int) -> RemoteInfo:
+    """Ask for the first byte only; a 206 answer proves the server honours Range."""
+    with _open(url, user_agent=user_agent, timeout_seconds=timeout_seconds, byte_range="0-0") as resp:
+        headers = resp.headers
+        etag = headers.get("ETag")
+        last_modified = headers.get("Last-Modified")
+        if resp.status == 206:
+            return RemoteInfo(
+                size=_parse_content_range_total(headers.get("Content-Range")),
+                accepts_ranges=True,
+                etag=etag,
+                last_modified=last_modified,
+            )
+        length = headers.get("Content-Length")
+        return RemoteInfo(
+            size=int(length) if length and length.isdigit() else None,
+            accepts_ranges=False,
+            etag=etag,
+            last_modified=last_modified,
+        )
+
+
+def split_ranges(size: int, *, connections: int, part_size: int = DEFAULT_PART_SIZE) -> list[RangePart]:
+    """Split [0, size) into at least `connections` parts of at most ~part_size bytes."""
+    n_parts = max(connections, math.ceil(size / part_size), 1)
+    step = math.ceil(size / n_parts) if size else 0
+    parts: list[RangePart] = []
+    start = 0
+    while start < size:
+        end = min(start + step, size)
+        parts.append(RangePart(start=start, end=end))
+        start = end
+    return parts
+
+
+class _DownloadState:
+    """Progress of a partially downloaded .tmp file, persisted next to it as JSON.
+
+    Parts record how many bytes were written *before* the state was saved, so a
+    crash can only under-report progress, never claim bytes that are missing.
+    """
+
+    def __init__(self, *, path: Path, url: str, remote: RemoteInfo, mode: str, parts: list[RangePart]) -> None:
+        self.path = path
+        self.url = url
+        self.remote = remote
+        self.mode = mode
+        self.parts = parts
+        self._lock = threading.Lock()
+        self._last_flush = 0.0
+
+    @classmethod
+    def load(cls, *, path: Path, url: str, remote: RemoteInfo, mode: str) -> _DownloadState | None:
+        if not path.exists():
+            return None
+        try:
+            data = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+        if data.get("url") != url or data.get("mode") != mode or data.get("remote") != asdict(remote):
+            return None
+        parts = [RangePart(**p) for p in data.get("parts", [])]
+        return cls(path=path, url=url, remote=remote, mode=mode, parts=parts)
+
+    def advance(self, part: RangePart, n: int) -> None:
+        with self._lock:
+            part.done += n
+            if time.monotonic() - self._last_flush >= STATE_FLUSH_SECONDS:
+                self._flush_locked()
+
+    def flush(self) -> None:
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self) -> None:
+        data: dict[str, Any] = {
+            "url": self.url,
+            "mode": self.mode,
+            "remote": asdict(self.remote),
+            "parts": [asdict(p) for p in self.parts],
+        }
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        tmp.write_text(json.dumps(data, sort_keys=True), encoding="utf-8")
+        tmp.replace(self.path)
+        self._last_flush = time.monotonic()
+
+
+def _preallocate(path: Path, size: int) -> None:
+    with path.open("r+b" if path.exists() else "wb") as f:
+        if hasattr(os, "posix_fallocate") and size > 0:
+            try:
+                os.posix_fallocate(f.fileno(), 0, size)
+            except OSError:
+                pass
+        f.truncate(size)
+
+
+def _fetch_part(*, url: str, tmp: Path, part: RangePart, state: _DownloadState, user_agent: str, timeout_seconds: int) -> None:
+    if part.complete:
+        return
+    offset = part.start + part.done
+    with _open(url, user_agent=user_agent, timeout_seconds=timeout_seconds,
+               byte_range=f"{offset}-{part.end - 1}") as resp, tmp.open("r+b") as out:
+        if resp.status != 206:
+            raise OSError(
+                f"Server ignored Range request for {url} (status {resp.status})")
+        out.seek(offset)
+        remaining = part.end - offset
+        while remaining > 0:
+            chunk = resp.read(min(READ_CHUNK_SIZE, remaining))
+            if not chunk:
+                raise OSError(
+                    f"Connection closed early for {url} at byte {part.start + part.done}")
+            out.write(chunk)
+            out.flush()
+            remaining -= len(chunk)
+            state.advance(part, len(chunk))
+
+
+def _fetch_ranged(*, url: str, tmp: Path, remote: RemoteInfo, connections: int,
+                  user_agent: str, timeout_seconds: int) -> None:
+    assert remote.size is not None
+    state_path = state_path_for(tmp)
+    state = _DownloadState.load(
+        path=state_path, url=url, remote=remote, mode="ranged")
+    if state is None or not tmp.exists() or tmp.stat().st_size != remote.size:
+        state = _DownloadState(
+            path=state_path, url=url, remote=remote, mode="ranged",
+            parts=split_ranges(remote.size, connections=connections),
+        )
+        _preallocate(tmp, remote.size)
+        state.flush()
+
+    pending = [p for p in state.parts if not p.complete]
+    try:
+        with ThreadPoolExecutor(max_workers=connections) as pool:
+            futures = [
+                pool.submit(_fetch_part, url=url, tmp=tmp, part=p, state=state,
+                            user_agent=user_agent, timeout_seconds=timeout_seconds)
+                for p in pending
+            ]
+            for fut in futures:
+                fut.result()
+    finally:
+        state.flush()
+
+
+def _fetch_stream(*, url: str, tmp: Path, remote: RemoteInfo, user_agent: str, timeout_seconds: int) -> DigestBundle:
+    state_path = state_path_for(tmp)
+    offset = 0
+    if remote.accepts_ranges and tmp.exists():
+        if _DownloadState.load(path=state_path, url=url, remote=remote, mode="stream") is not None:
+            offset = tmp.stat().st_size
+    if remote.size is not None and offset >= remote.size:
+        offset = 0  # bogus state; start over
+
+    # Single growing file: the bytes on disk are the progress record, the state
+    # file only pins the remote identity the prefix belongs to.
+    _DownloadState(path=state_path, url=url, remote=remote,
+                   mode="stream", parts=[]).flush()
+
+    hasher = MultiHasher()
+    byte_range = f"{offset}-" if offset else None
+    with _open(url, user_agent=user_agent, timeout_seconds=timeout_seconds, byte_range=byte_range) as resp:
+        if offset and resp.status != 206:
+            offset = 0
+        with tmp.open("r+b" if offset else "wb") as out:
+            if offset:
+                # Only the resumed prefix is read back; new bytes are hashed off the socket.
+                hasher.update_from(out, limit=offset)
+            out.seek(offset)
+            out.truncate()
+            while True:
+                chunk = resp.read(READ_CHUNK_SIZE)
+                if not chunk:
+                    break
+                hasher.update(chunk)
+                out.write(chunk)
+
+    if remote.size is not None and hasher.bytes != remote.size:
+        raise OSError(
+            f"Incomplete download for {url}: {hasher.bytes} of {remote.size} bytes")
+    return hasher.bundle()
+
+
+def fetch_to_tmp(
+    *,
+    url: str,
+    tmp: Path,
+    user_agent: str,
+    timeout_seconds: int,
+    connections: int = DEFAULT_CONNECTIONS,
+    retries: int = DEFAULT_RETRIES,
+) -> DigestBundle | None:
+    """Fetch url into tmp, resuming whatever a previous attempt left behind.
+
+    Uses `connections` parallel Range requests when the server supports them and
+    the size is known; otherwise falls back to a single stream. Transient errors
+    are retried up to `retries` times, each retry continuing from saved progress.
+
+    Single-stream transfers are hashed on the fly and return their digests;
+    ranged transfers arrive out of order and return None.
+    """
+    digests: DigestBundle | None = None
+    attempt = 0
+    while True:
+        try:
+            remote = probe_remote(
+                url=url, user_agent=user_agent, timeout_seconds=timeout_seconds)
+            if remote.accepts_ranges and remote.size is not None and connections > 1:
+                _fetch_ranged(url=url, tmp=tmp, remote=remote, connections=connections,
+                              user_agent=user_agent, timeout_seconds=timeout_seconds)
+            else:
+                digests = _fetch_stream(url=url, tmp=tmp, remote=remote,
+                                        user_agent=user_agent, timeout_seconds=timeout_seconds)
+            break
+        except HTTPError as exc:
+            if exc.code < 500 or attempt >= retries:
+                raise
+        except OSError:
+            if attempt >= retries:
+                raise
+        attempt += 1
+        time.sleep(min(2 ** attempt, 30))
+
+    state_path_for(tmp).unlink(missing_ok=True)
+    return digests
+
+
+def discard_tmp(tmp: Path) -> None:
+    tmp.unlink(missing_ok=True)
+    state_path_for(tmp).unlink(missing_ok=True)
+
+
+class _EndOfStream:
+    pass
+
+
+_EOF = _EndOfStream()
+
+
+class _QueueReader(io.RawIOBase):
+    """File-like view over chunks handed over by the download thread."""
+
+    def __init__(self, chunks: queue.Queue[bytes | _EndOfStream | BaseException]) -> None:
+        self._chunks = chunks
+        self._buf = memoryview(b"")
+        self._eof = False
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b: Any) -> int:
+        while not self._buf:
+            if self._eof:
+                return 0
+            item = self._chunks.get()
+            if isinstance(item, _EndOfStream):
+                self._eof = True
+                return 0
+            if isinstance(item, BaseException):
+                self._eof = True
+                raise item
+            self._buf = memoryview(item)
+        n = min(len(b), len(self._buf))
+        b[:n] = self._buf[:n]
+        self._buf = self._buf[n:]
+        return n
+
+    def drain(self) -> None:
+        while self.read(READ_CHUNK_SIZE):
+            pass
+
+
+def stream_url(
+    *,
+    url: str,
+    consume: Callable[[BinaryIO], None],
+    user_agent: str,
+    timeout_seconds: int,
+    tee_path: Path | None = None,
+    buffer_chunks: int = DEFAULT_STREAM_BUFFER_CHUNKS,
+) -> DigestBundle:
+    """Run consume() on the response body while it is still downloading.
+
+    A background thread reads the socket, hashes every chunk, optionally tees it
+    to tee_path and hands it over through a queue of at most `buffer_chunks`
+    chunks, so network transfer and the consumer (e.g. decompression) overlap
+    while memory stays bounded. Whatever consume() leaves unread is drained so
+    the digests always cover the full body.
+    """
+    chunks: queue.Queue[bytes | _EndOfStream | BaseException] = queue.Queue(
+        maxsize=max(1, buffer_chunks))
+    stop = threading.Event()
+    hasher = MultiHasher()
+
+    def put(item: bytes | _EndOfStream | BaseException) -> bool:
+        while not stop.is_set():
+            try:
+                chunks.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce() -> None:
+        try:
+            with _open(url, user_agent=user_agent, timeout_seconds=timeout_seconds) as resp:
+                out = tee_path.open("wb") if tee_path is not None else None
+                try:
+                    while not stop.is_set():
+                        chunk = resp.read(READ_CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        hasher.update(chunk)
+                        if out is not None:
+                            out.write(chunk)
+                        if not put(chunk):
+                            return
+                finally:
+                    if out is not None:
+                        out.close()
+            put(_EOF)
+        except BaseException as exc:  # handed to the consumer thread
+            put(exc)
+
+    producer = threading.Thread(
+        target=produce, name=f"stream:{url}", daemon=True)
+    producer.start()
+    reader = _QueueReader(chunks)
+    try:
+        consume(reader)  # type: ignore[arg-type]
+        reader.drain()
+    finally:
+        stop.set()
+        producer.join()
+    return hasher.bundle()
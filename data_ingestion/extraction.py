@@ -0,0 +1,78 @@
+from __future__ import annotations
+
+import heapq
+import os
+import zipfile
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+from typing import Literal
+
+from data_ingestion.manifest import zip_member_relpath
+
+ExecutorKind = Literal["process", "thread"]
+
+
+def balance_by_size(sizes: dict[str, int], n_chunks: int) -> list[list[str]]:
+    """Greedy longest-first partition of names into n_chunks with similar byte totals."""
+    n_chunks = max(1, min(n_chunks, len(sizes)))
+    heap: list[tuple[int, int]] = [(0, i) for i in range(n_chunks)]
+    chunks: list[list[str]] = [[] for _ in range(n_chunks)]
+    for name, size in sorted(sizes.items(), key=lambda kv: (-kv[1], kv[0])):
+        load, i = heapq.heappop(heap)
+        chunks[i].append(name)
+        # Count a fixed per-member overhead so thousands of tiny files spread evenly too.
+        heapq.heappush(heap, (load + size + 4096, i))
+    return [c for c in chunks if c]
+
+
+def _parent_relpath(name: str) -> str:
+    return os.path.dirname(zip_member_relpath(name))
+
+
+def _extract_zip_chunk(archive_path: str, dst_dir: str, names: list[str]) -> int:
+    with zipfile.ZipFile(archive_path) as zf:
+        for name in names:
+            zf.extract(name, dst_dir)
+    return len(names)
+
+
+def make_executor(kind: ExecutorKind, workers: int) -> Executor:
+    if kind == "process":
+        return ProcessPoolExecutor(max_workers=workers)
+    if kind == "thread":
+        return ThreadPoolExecutor(max_workers=workers)
+    raise ValueError(f"Unknown executor kind: {kind!r} (expected 'process' or 'thread')")
+
+
+def extract_zip_parallel(
+    *,
+    archive_path: Path,
+    dst_dir: Path,
+    workers: int,
+    executor: ExecutorKind = "process",
+    members: list[str] | None = None,
+) -> int:
+    """Extract zip members with a pool; every worker opens its own ZipFile handle.
+
+    The central directory is split into `workers` chunks balanced by compressed
+    size. Parent directories are created up front so workers never race on them.
+    Returns the number of members extracted.
+    """
+    with zipfile.ZipFile(archive_path) as zf:
+        infos = zf.infolist()
+    if members is not None:
+        wanted = set(members)
+        infos = [i for i in infos if i.filename in wanted]
+
+    files = {i.filename: i.compress_size for i in infos if not i.is_dir()}
+    dirs = {_parent_relpath(name) for name in files}
+    dirs.update(zip_member_relpath(i.filename) for i in infos if i.is_dir())
+    for rel in sorted(dirs):
+        (dst_dir / rel).mkdir(parents=True, exist_ok=True)
+
+    if not files:
+        return 0
+    chunks = balance_by_size(files, workers)
+    with make_executor(executor, len(chunks)) as pool:
+        futures = [pool.submit(_extract_zip_chunk, str(archive_path), str(dst_dir), chunk) for chunk in chunks]
+        return sum(f.result() for f in futures)
@@ -0,0 +1,173 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any, BinaryIO
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - non-POSIX
+    fcntl = None  # type: ignore[assignment]
+
+HASH_CHUNK_SIZE = 1024 * 1024
+HASH_MEMO_FILENAME = "hash_memo.json"
+
+
+@dataclass(frozen=True)
+class DigestBundle:
+    bytes: int
+    sha256: str
+    md5: str
+
+
+class MultiHasher:
+    """Feeds every chunk to SHA-256 and MD5 at once and counts bytes."""
+
+    def __init__(self) -> None:
+        self._sha256 = hashlib.sha256()
+        self._md5 = hashlib.md5()  # noqa: S324 - used for dataset integrity checks only
+        self.bytes = 0
+
+    def update(self, chunk: bytes | memoryview) -> None:
+        self._sha256.update(chunk)
+        self._md5.update(chunk)
+        self.bytes += len(chunk)
+
+    def update_from(self, f: BinaryIO, *, limit: int | None = None, chunk_size: int = HASH_CHUNK_SIZE) -> None:
+        remaining = limit
+        while remaining is None or remaining > 0:
+            n = chunk_size if remaining is None else min(chunk_size, remaining)
+            chunk = f.read(n)
+            if not chunk:
+                break
+            self.update(chunk)
+            if remaining is not None:
+                remaining -= len(chunk)
+
+    def bundle(self) -> DigestBundle:
+        return DigestBundle(
+            bytes=self.bytes,
+            sha256=self._sha256.hexdigest(),
+            md5=self._md5.hexdigest(),
+        )
+
+
+class HashMemo:
+    """Digest index stored as JSON inside the cache root.
+
+    Entries are keyed by file identity (st_dev, st_ino) and only trusted while
+    the path, st_size, st_mtime_ns and st_ctime_ns still match. The ctime
+    matters: tar extraction sets mtimes back to whole archive seconds, so a
+    reused inode can hold a different file of the same size and mtime, but
+    no one can set ctime back. Updates are merged into the on-disk index under an exclusive
+    lock file and published with an atomic rename, which keeps the index
+    consistent when several ingestion processes share one cache root. Each
+    flush also drops entries whose path no longer resolves to their inode
+    (deleted files, trees replaced by a re-extract), so the index only
+    describes files that exist.
+    """
+
+    def __init__(self, index_path: Path) -> None:
+        self.index_path = index_path
+        self._entries: dict[str, dict[str, Any]] | None = None
+        self._pending: dict[str, dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_cache_root(cls, cache_root: Path) -> HashMemo:
+        return cls(cache_root / HASH_MEMO_FILENAME)
+
+    @staticmethod
+    def _key(st: os.stat_result) -> str:
+        return f"{st.st_dev}:{st.st_ino}"
+
+    def for_tree(self, root: Path) -> HashMemo:
+        """Memo for the files under root, in its own file next to this index.
+
+        An extracted tree can hold ~100k files; keeping their entries out of
+        the shared index keeps its per-flush rewrite small.
+        """
+        tag = hashlib.sha256(os.path.abspath(root).encode("utf-8")).hexdigest()[:16]
+        return HashMemo(self.index_path.with_name(f"{self.index_path.stem}.tree-{tag}{self.index_path.suffix}"))
+
+    def _read_index(self) -> dict[str, dict[str, Any]]:
+        try:
+            data = json.loads(self.index_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return {}
+        return data if isinstance(data, dict) else {}
+
+    @classmethod
+    def _is_live(cls, key: str, entry: dict[str, Any]) -> bool:
+        try:
+            return cls._key(os.stat(entry["path"])) == key
+        except (OSError, KeyError, TypeError):
+            return False
+
+    def lookup(self, path: Path, st: os.stat_result | None = None) -> DigestBundle | None:
+        st = st if st is not None else path.stat()
+        key = self._key(st)
+        with self._lock:
+            if self._entries is None:
+                self._entries = self._read_index()
+            entry = self._pending.get(key) or self._entries.get(key)
+        if (entry is None or entry.get("path") != os.path.abspath(path) or entry.get("size") != st.st_size
+                or entry.get("mtime_ns") != st.st_mtime_ns or entry.get("ctime_ns") != st.st_ctime_ns):
+            return None
+        return DigestBundle(bytes=entry["bytes"], sha256=entry["sha256"], md5=entry["md5"])
+
+    def store(self, path: Path, st: os.stat_result, digests: DigestBundle) -> None:
+        entry = {"path": os.path.abspath(path), "size": st.st_size,
+                 "mtime_ns": st.st_mtime_ns, "ctime_ns": st.st_ctime_ns, **asdict(digests)}
+        with self._lock:
+            self._pending[self._key(st)] = entry
+
+    def flush(self) -> None:
+        with self._lock:
+            if not self._pending:
+                return
+            self.index_path.parent.mkdir(parents=True, exist_ok=True)
+            lock_path = self.index_path.with_name(self.index_path.name + ".lock")
+            with lock_path.open("a") as lock_f:
+                if fcntl is not None:
+                    fcntl.flock(lock_f.fileno(), fcntl.LOCK_EX)
+                try:
+                    merged = self._read_index()
+                    merged.update(self._pending)
+                    merged = {key: entry for key, entry in merged.items() if self._is_live(key, entry)}
+                    tmp = self.index_path.with_name(
+                        f"{self.index_path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+                    tmp.write_text(json.dumps(merged, sort_keys=True), encoding="utf-8")
+                    tmp.replace(self.index_path)
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(lock_f.fileno(), fcntl.LOCK_UN)
+            self._entries = merged
+            self._pending.clear()
+
+    def remember(self, path: Path, digests: DigestBundle) -> None:
+        """Record digests computed elsewhere (e.g. while downloading) for path."""
+        self.store(path, path.stat(), digests)
+        self.flush()
+
+
+def digest_file(path: Path, chunk_size: int = HASH_CHUNK_SIZE, *, memo: HashMemo | None = None) -> DigestBundle:
+    if memo is not None:
+        st = path.stat()
+        cached = memo.lookup(path, st)
+        if cached is not None:
+            return cached
+
+    hasher = MultiHasher()
+    with path.open("rb") as f:
+        hasher.update_from(f, chunk_size=chunk_size)
+    digests = hasher.bundle()
+
+    if memo is not None:
+        memo.store(path, st, digests)
+        memo.flush()
+    return digests
@@ -0,0 +1,119 @@
+from __future__ import annotations
+
+import json
+import os
+import zipfile
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Literal
+
+ArchiveKind = Literal["zip", "tar"]
+
+
+def manifest_path_for(dst_dir: Path, archive_name: str) -> Path:
+    return dst_dir / f".{archive_name}.manifest.json"
+
+
+def zip_member_relpath(name: str) -> str:
+    # Mirrors the path cleanup zipfile.ZipFile._extract_member applies to arcnames.
+    arcname = name.replace("/", os.path.sep)
+    if os.path.altsep:
+        arcname = arcname.replace(os.path.altsep, os.path.sep)
+    arcname = os.path.splitdrive(arcname)[1]
+    parts = [p for p in arcname.split(os.path.sep) if p not in ("", os.path.curdir, os.path.pardir)]
+    return os.path.sep.join(parts)
+
+
+@dataclass
+class MemberRecord:
+    size: int
+    check: int  # CRC-32 for zip members, mtime (seconds) for tar members
+    stamp_ns: int | None = None  # st_mtime_ns observed right after extraction
+
+
+class ExtractionManifest:
+    """Every regular-file member of an archive, as extracted into one directory.
+
+    Built from the archive index (zip central directory or tar headers), then
+    stamped with each file's on-disk mtime once it is extracted. A re-run only
+    needs one stat() per member to find what is missing or was modified, and
+    can re-extract just those members.
+    """
+
+    def __init__(
+        self, *, kind: ArchiveKind, source: str | None = None, members: dict[str, MemberRecord] | None = None
+    ) -> None:
+        self.kind = kind
+        self.source = source  # sha256 of the archive the members came from, when known
+        self.members: dict[str, MemberRecord] = members if members is not None else {}
+
+    @classmethod
+    def from_zip(cls, archive_path: Path) -> ExtractionManifest:
+        with zipfile.ZipFile(archive_path) as zf:
+            infos = zf.infolist()
+        return cls(kind="zip", members={
+            i.filename: MemberRecord(size=i.file_size, check=i.CRC) for i in infos if not i.is_dir()
+        })
+
+    @classmethod
+    def load(cls, path: Path) -> ExtractionManifest | None:
+        try:
+            data = json.loads(path.read_text(encoding="utf-8"))
+            return cls(kind=data["kind"], source=data.get("source"), members={
+                name: MemberRecord(size=size, check=check, stamp_ns=stamp_ns)
+                for name, (size, check, stamp_ns) in data["members"].items()
+            })
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def save(self, path: Path) -> None:
+        data = {
+            "kind": self.kind,
+            "source": self.source,
+            "fields": ["size", "crc" if self.kind == "zip" else "mtime", "stamp_ns"],
+            "members": {name: [m.size, m.check, m.stamp_ns] for name, m in sorted(self.members.items())},
+        }
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(path.name + ".tmp")
+        tmp.write_text(json.dumps(data, separators=(",", ":")), encoding="utf-8")
+        tmp.replace(path)
+
+    def adopt_stamps(self, other: ExtractionManifest | None) -> None:
+        """Keep on-disk stamps from an older manifest for members that did not change."""
+        if other is None or other.kind != self.kind:
+            return
+        for name, m in self.members.items():
+            old = other.members.get(name)
+            if old is not None and (old.size, old.check) == (m.size, m.check):
+                m.stamp_ns = old.stamp_ns
+
+    def add(self, name: str, *, size: int, check: int) -> None:
+        self.members[name] = MemberRecord(size=size, check=check)
+
+    def disk_path(self, dst_dir: Path, name: str) -> Path:
+        return dst_dir / (zip_member_relpath(name) if self.kind == "zip" else name)
+
+    def damaged(self, dst_dir: Path) -> list[str]:
+        """Members that are missing, have the wrong size or were touched since extraction."""
+        bad: list[str] = []
+        for name, m in self.members.items():
+            try:
+                st = os.stat(self.disk_path(dst_dir, name))
+            except OSError:
+                bad.append(name)
+                continue
+            if st.st_size != m.size:
+                bad.append(name)
+            elif m.stamp_ns is not None and st.st_mtime_ns != m.stamp_ns:
+                bad.append(name)
+            elif m.stamp_ns is None and self.kind == "tar" and int(st.st_mtime) != m.check:
+                bad.append(name)
+        return bad
+
+    def stamp(self, dst_dir: Path, names: list[str] | None = None) -> None:
+        for name in self.members if names is None else names:
+            m = self.members[name]
+            try:
+                m.stamp_ns = os.stat(self.disk_path(dst_dir, name)).st_mtime_ns
+            except OSError:
+                m.stamp_ns = None
@@ -0,0 +1,112 @@
+from __future__ import annotations
+
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+
+from data_ingestion.hashing import DigestBundle, HashMemo, MultiHasher
+
+DEFAULT_TREE_WORKERS = min(32, (os.cpu_count() or 1) * 2)
+
+
+@dataclass(frozen=True)
+class TreeDigest:
+    sha256: str  # Merkle root of the directory
+    bytes: int
+    file_count: int
+
+
+@dataclass(frozen=True)
+class _TreeFile:
+    rel: str  # POSIX path relative to the tree root
+    path: Path
+    st: os.stat_result
+
+
+def _scan(root: Path) -> tuple[list[_TreeFile], list[str]]:
+    """Regular files and directories below root (symlinks and other entries are skipped)."""
+    files: list[_TreeFile] = []
+    dirs: list[str] = [""]
+    stack = [""]
+    while stack:
+        rel_dir = stack.pop()
+        with os.scandir(root / rel_dir if rel_dir else root) as it:
+            for entry in it:
+                rel = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+                if entry.is_dir(follow_symlinks=False):
+                    dirs.append(rel)
+                    stack.append(rel)
+                elif entry.is_file(follow_symlinks=False):
+                    files.append(_TreeFile(rel=rel, path=Path(entry.path),
+                                 st=entry.stat(follow_symlinks=False)))
+    return files, dirs
+
+
+def _hash_file(path: Path) -> DigestBundle:
+    hasher = MultiHasher()
+    with path.open("rb") as f:
+        hasher.update_from(f)
+    return hasher.bundle()
+
+
+def merkle_node(children: list[tuple[str, str, str]]) -> str:
+    """Hash of one directory from its (name, kind, sha256) children; kind is "f" or "d".
+
+    Children are combined in sorted name order, so the root only depends on
+    the tree's names and file contents, not on scan or hashing order.
+    """
+    h = hashlib.sha256()
+    for name, kind, digest in sorted(children):
+        h.update(kind.encode("ascii") + name.encode("utf-8") + b"\0" + bytes.fromhex(digest))
+    return h.hexdigest()
+
+
+def digest_tree(root: Path, *, workers: int = DEFAULT_TREE_WORKERS, memo: HashMemo | None = None) -> TreeDigest:
+    """Merkle digest of every regular file under root.
+
+    Files are hashed by a thread pool (hashlib releases the GIL on large
+    buffers). With a memo, files whose stat is unchanged are not
+    read again and a warm re-run costs one stat per file; new digests are
+    written back with a single flush of the tree's own memo (memo.for_tree).
+    """
+    if not root.is_dir():
+        raise NotADirectoryError(root)
+    if memo is not None:
+        memo = memo.for_tree(root)
+    files, dirs = _scan(root)
+
+    leaf: dict[str, str] = {}
+    todo: list[_TreeFile] = []
+    for f in files:
+        cached = memo.lookup(f.path, f.st) if memo is not None else None
+        if cached is not None and cached.bytes == f.st.st_size:
+            leaf[f.rel] = cached.sha256
+        else:
+            todo.append(f)
+
+    if todo:
+        n_workers = max(1, min(workers, len(todo)))
+        with ThreadPoolExecutor(max_workers=n_workers, thread_name_prefix="tree-hash") as pool:
+            for f, digests in zip(todo, pool.map(lambda f: _hash_file(f.path), todo)):
+                leaf[f.rel] = digests.sha256
+                if memo is not None:
+                    memo.store(f.path, f.st, digests)
+        if memo is not None:
+            memo.flush()
+
+    children: dict[str, list[tuple[str, str, str]]] = {d: [] for d in dirs}
+    for rel, digest in leaf.items():
+        parent, _, name = rel.rpartition("/")
+        children[parent].append((name, "f", digest))
+    # Deepest directories first, so every child node exists before its parent is hashed.
+    for rel in sorted((d for d in dirs if d), key=lambda d: -d.count("/")):
+        parent, _, name = rel.rpartition("/")
+        children[parent].append((name, "d", merkle_node(children[rel])))
+
+    return TreeDigest(
+        sha256=merkle_node(children[""]),
+        bytes=sum(f.st.st_size for f in files),
+        file_count=len(files),
+    )
@@ -0,0 +1,341 @@
+from __future__ import annotations
+
+import json
+import mmap
+import os
+import re
+import tarfile
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, BinaryIO
+
+import numpy as np
+
+from data_ingestion.common import (
+    NO_LIMITS,
+    CachedFile,
+    StageLimits,
+    cached_file_record,
+    download_url,
+    ensure_dir,
+    verify_digests,
+)
+from data_ingestion.download import DEFAULT_CONNECTIONS, DEFAULT_RETRIES, stream_url
+from data_ingestion.hashing import HashMemo
+from data_ingestion.timing import StageRecorder, maybe_stage
+
+PACK_LAYOUT_VERSION = 1
+PACK_MANIFEST_FILENAME = "manifest.json"
+IMDB_SPLITS = ("train", "test", "unsup")
+LABELS = {"neg": 0, "pos": 1, "unsup": -1}
+
+# aclImdb/<train|test>/<pos|neg|unsup>/<id>_<rating>.txt; unsup reviews live under train/.
+_REVIEW_RE = re.compile(r"(?:^|/)(train|test)/(pos|neg|unsup)/(\d+)_(\d+)\.txt$")
+
+
+@dataclass(frozen=True)
+class PackedTextSplit:
+    split: str
+    blob_path: Path
+    offsets_path: Path
+    labels_path: Path
+    parquet_path: Path | None
+    count: int
+
+    def paths(self) -> list[Path]:
+        paths = [self.blob_path, self.offsets_path, self.labels_path]
+        return paths + [self.parquet_path] if self.parquet_path is not None else paths
+
+
+def packed_paths(out_dir: Path, split: str) -> tuple[Path, Path, Path, Path]:
+    return (
+        out_dir / f"{split}_text.bin",
+        out_dir / f"{split}_offsets.npy",
+        out_dir / f"{split}_labels.npy",
+        out_dir / f"{split}.parquet",
+    )
+
+
+def packed_source(out_dir: Path) -> str | None:
+    """sha256 of the archive the packed store was built from, if it is complete and current."""
+    try:
+        manifest = json.loads((out_dir / PACK_MANIFEST_FILENAME).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+    if manifest.get("layout") != PACK_LAYOUT_VERSION:
+        return None
+    for split in IMDB_SPLITS:
+        blob, offsets, labels, parquet = packed_paths(out_dir, split)
+        if not (blob.exists() and offsets.exists() and labels.exists()):
+            return None
+        if manifest.get("parquet") and not parquet.exists():
+            return None
+    return manifest.get("source")
+
+
+def load_packed_splits(out_dir: Path) -> list[PackedTextSplit]:
+    manifest = json.loads((out_dir / PACK_MANIFEST_FILENAME).read_text(encoding="utf-8"))
+    splits: list[PackedTextSplit] = []
+    for split in IMDB_SPLITS:
+        blob, offsets, labels, parquet = packed_paths(out_dir, split)
+        splits.append(PackedTextSplit(
+            split=split, blob_path=blob, offsets_path=offsets, labels_path=labels,
+            parquet_path=parquet if manifest.get("parquet") else None, count=int(manifest["counts"][split]),
+        ))
+    return splits
+
+
+class _SplitWriter:
+    def __init__(self, partial: Path) -> None:
+        self.partial = partial
+        self.f = partial.open("wb")
+        self.size = 0
+        # (sort key, offset in partial blob, length, label)
+        self.entries: list[tuple[tuple[str, int, int], int, int, int]] = []
+
+    def add(self, key: tuple[str, int, int], data: bytes, label: int) -> None:
+        self.f.write(data)
+        self.entries.append((key, self.size, len(data), label))
+        self.size += len(data)
+
+
+class ImdbPacker:
+    """Appends reviews to one blob per split as they arrive, in any order.
+
+    finish() writes the canonical layout: reviews ordered by (label dir, id),
+    <split>_text.bin with the concatenated UTF-8 texts, <split>_offsets.npy
+    (uint64, N + 1 entries: review i is blob[offsets[i]:offsets[i + 1]]) and
+    <split>_labels.npy (int64; 1 pos, 0 neg, -1 unsup).
+    """
+
+    def __init__(self, out_dir: Path) -> None:
+        self.out_dir = out_dir
+        ensure_dir(out_dir)
+        self._writers = {split: _SplitWriter(out_dir / f".{split}_text.bin.partial") for split in IMDB_SPLITS}
+
+    def add(self, name: str, data: bytes) -> bool:
+        m = _REVIEW_RE.search(name)
+        if m is None:
+            return False
+        split, label_dir, review_id, rating = m.groups()
+        split = "unsup" if label_dir == "unsup" else split
+        self._writers[split].add((label_dir, int(review_id), int(rating)), data, LABELS[label_dir])
+        return True
+
+    def add_tar_stream(self, fileobj: BinaryIO) -> int:
+        added = 0
+        with tarfile.open(fileobj=fileobj, mode="r|gz") as tf:
+            for member in tf:
+                if not member.isfile() or _REVIEW_RE.search(member.name) is None:
+                    continue
+                f = tf.extractfile(member)
+                if f is not None and self.add(member.name, f.read()):
+                    added += 1
+        return added
+
+    def add_tree(self, root: Path) -> int:
+        added = 0
+        for split in ("train", "test"):
+            for label_dir in LABELS:
+                d = root / split / label_dir
+                if not d.is_dir():
+                    continue
+                with os.scandir(d) as it:
+                    for entry in it:
+                        if not entry.is_file():
+                            continue
+                        if self.add(f"{split}/{label_dir}/{entry.name}", Path(entry.path).read_bytes()):
+                            added += 1
+        return added
+
+    def abort(self) -> None:
+        for w in self._writers.values():
+            w.f.close()
+            w.partial.unlink(missing_ok=True)
+
+    def _finish_split(self, split: str, w: _SplitWriter, parquet: bool) -> PackedTextSplit:
+        w.f.close()
+        blob_path, offsets_path, labels_path, parquet_path = packed_paths(self.out_dir, split)
+        entries = sorted(w.entries)
+        lengths = np.fromiter((n for _, _, n, _ in entries), dtype=np.uint64, count=len(entries))
+        offsets = np.zeros(len(entries) + 1, dtype=np.uint64)
+        np.cumsum(lengths, out=offsets[1:])
+        labels = np.fromiter((label for _, _, _, label in entries), dtype=np.int64, count=len(entries))
+
+        if entries == w.entries:
+            os.replace(w.partial, blob_path)
+        else:
+            tmp = blob_path.with_name(blob_path.name + ".tmp")
+            with w.partial.open("rb") as src, tmp.open("wb") as dst:
+                if w.size:
+                    with mmap.mmap(src.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                        for _, start, n, _ in entries:
+                            dst.write(buf[start:start + n])
+            os.replace(tmp, blob_path)
+            w.partial.unlink()
+
+        for path, arr in ((offsets_path, offsets), (labels_path, labels)):
+            tmp = path.with_name(path.name + ".tmp")
+            with tmp.open("wb") as f:
+                np.save(f, arr)
+            os.replace(tmp, path)
+
+        if parquet:
+            write_parquet(blob_path=blob_path, offsets=offsets, labels=labels, out_path=parquet_path)
+        return PackedTextSplit(
+            split=split, blob_path=blob_path, offsets_path=offsets_path, labels_path=labels_path,
+            parquet_path=parquet_path if parquet else None, count=len(entries),
+        )
+
+    def finish(self, *, source: str, parquet: bool = False) -> list[PackedTextSplit]:
+        try:
+            packed = [self._finish_split(split, w, parquet) for split, w in self._writers.items()]
+        except BaseException:
+            self.abort()
+            raise
+        manifest = {
+            "layout": PACK_LAYOUT_VERSION,
+            "source": source,
+            "parquet": parquet,
+            "counts": {p.split: p.count for p in packed},
+        }
+        tmp = self.out_dir / (PACK_MANIFEST_FILENAME + ".tmp")
+        tmp.write_text(json.dumps(manifest, indent=2, sort_keys=True) + "\n", encoding="utf-8")
+        tmp.replace(self.out_dir / PACK_MANIFEST_FILENAME)
+        return packed
+
+
+def write_parquet(*, blob_path: Path, offsets: np.ndarray, labels: np.ndarray, out_path: Path) -> None:
+    """Export one split as a (text, label) Parquet file; requires pyarrow."""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as exc:
+        raise RuntimeError("[pack].parquet = true requires pyarrow (pip install pyarrow)") from exc
+
+    blob = np.memmap(blob_path, dtype=np.uint8, mode="r") if blob_path.stat().st_size else np.zeros(0, np.uint8)
+    text = pa.LargeStringArray.from_buffers(
+        len(labels), pa.py_buffer(offsets.view(np.int64)), pa.py_buffer(blob))
+    table = pa.table({"text": text, "label": pa.array(labels)})
+    tmp = out_path.with_name(out_path.name + ".tmp")
+    pq.write_table(table, tmp)
+    os.replace(tmp, out_path)
+
+
+def pack_imdb_tree(*, root: Path, out_dir: Path, source: str, parquet: bool = False) -> list[PackedTextSplit]:
+    """Pack an already extracted aclImdb/ directory."""
+    packer = ImdbPacker(out_dir)
+    try:
+        packer.add_tree(root)
+    except BaseException:
+        packer.abort()
+        raise
+    return packer.finish(source=source, parquet=parquet)
+
+
+def pack_imdb_archive(*, archive_path: Path, out_dir: Path, source: str, parquet: bool = False) -> list[PackedTextSplit]:
+    """Pack straight from aclImdb_v1.tar.gz without extracting any file."""
+    packer = ImdbPacker(out_dir)
+    try:
+        with archive_path.open("rb") as f:
+            packer.add_tar_stream(f)
+    except BaseException:
+        packer.abort()
+        raise
+    return packer.finish(source=source, parquet=parquet)
+
+
+def fetch_packed_imdb(
+    *,
+    url: str,
+    archive_path: Path,
+    out_dir: Path,
+    keep_archive: bool,
+    parquet: bool = False,
+    previous: CachedFile | None = None,
+    expected_bytes_min: int | None = None,
+    expected_bytes_max: int | None = None,
+    expected_sha256: str | None = None,
+    expected_md5: str | None = None,
+    user_agent: str = "pjatk_zum-ingestion/1.0",
+    timeout_seconds: int = 60,
+    connections: int = DEFAULT_CONNECTIONS,
+    retries: int = DEFAULT_RETRIES,
+    force: bool = False,
+    memo: HashMemo | None = None,
+    limits: StageLimits = NO_LIMITS,
+    recorder: StageRecorder | None = None,
+) -> CachedFile:
+    """Make sure out_dir holds the packed store; return the archive's provenance record.
+
+    Counterpart of fetch_tar_gz for `[pack].extract_files = false`: no review is
+    ever written as its own file. A cached archive is verified and packed from
+    disk; otherwise the download is streamed through gzip/tar into the packer
+    (and tee'd to archive_path with keep_archive). A current store built from
+    the previous provenance's archive is reused as is.
+    """
+    expected = dict(
+        expected_bytes_min=expected_bytes_min,
+        expected_bytes_max=expected_bytes_max,
+        expected_sha256=expected_sha256,
+        expected_md5=expected_md5,
+    )
+    current = None if force else packed_source(out_dir)
+
+    if archive_path.exists() and not force:
+        with limits.network():
+            digests = download_url(
+                url=url,
+                dst=archive_path,
+                user_agent=user_agent,
+                timeout_seconds=timeout_seconds,
+                connections=connections,
+                retries=retries,
+                memo=memo,
+                recorder=recorder,
+                **expected,
+            )
+        if current != digests.sha256:
+            with limits.cpu(), maybe_stage(recorder, "pack") as meter:
+                pack_imdb_archive(archive_path=archive_path, out_dir=out_dir, source=digests.sha256, parquet=parquet)
+                meter.add_bytes(digests.bytes)
+        return cached_file_record(src=url, dst=archive_path, method="download", digests=digests)
+
+    if not keep_archive and previous is not None and current == previous.sha256:
+        return previous
+
+    # Not download_url's "<archive>.tmp", which may hold a resumable ranged download.
+    tee = archive_path.with_suffix(archive_path.suffix + ".stream.tmp") if keep_archive else None
+    packer = ImdbPacker(out_dir)
+
+    def consume(reader: Any) -> None:
+        packer.add_tar_stream(reader)
+
+    with limits.network_and_cpu(), maybe_stage(recorder, "download_pack") as meter:
+        try:
+            digests = stream_url(
+                url=url,
+                consume=consume,
+                user_agent=user_agent,
+                timeout_seconds=timeout_seconds,
+                tee_path=tee,
+            )
+            verify_digests(path=archive_path, digests=digests, **expected)
+        except BaseException:
+            packer.abort()
+            if tee is not None:
+                tee.unlink(missing_ok=True)
+            raise
+        packer.finish(source=digests.sha256, parquet=parquet)
+        meter.add_bytes(digests.bytes)
+
+    if tee is not None:
+        tee.replace(archive_path)
+        if memo is not None:
+            memo.remember(archive_path, digests)
+    return cached_file_record(
+        src=url,
+        dst=archive_path if keep_archive else out_dir,
+        method="download",
+        digests=digests,
+    )
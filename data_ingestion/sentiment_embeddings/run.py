@@ -11,18 +11,35 @@ if str(_REPO_ROOT) not in sys.path:
     sys.path.insert(0, str(_REPO_ROOT))
 
 from data_ingestion.common import (  # noqa: E402
+    NO_LIMITS,
     CachedFile,
-    download_url,
-    extract_tar_gz,
-    sha256_file,
+    StageLimits,
+    cached_file_record,
+    directory_record,
+    fetch_tar_gz,
+    read_provenance_record,
     write_provenance,
 )
+from data_ingestion.download import DEFAULT_CONNECTIONS, DEFAULT_RETRIES  # noqa: E402
+from data_ingestion.hashing import HashMemo  # noqa: E402
+from data_ingestion.merkle import DEFAULT_TREE_WORKERS  # noqa: E402
+from data_ingestion.sentiment_embeddings.pack import (  # noqa: E402
+    PackedTextSplit,
+    fetch_packed_imdb,
+    load_packed_splits,
+    pack_imdb_archive,
+    pack_imdb_tree,
+    packed_source,
+)
+from data_ingestion.timing import StageRecorder  # noqa: E402
 from data_ingestion.config_utils import (  # noqa: E402
     as_path,
     load_toml,
+    optional_bool,
     optional_int,
     optional_list_of_str,
     optional_str,
+    optional_table,
     require_str,
     require_table,
  )
@@ -37,6 +54,7 @@ def load_config(config_path: Path) -> dict[str, Any]:
     paths_tbl = require_table(cfg, "paths", path=config_path)
     download_tbl = require_table(cfg, "download", path=config_path)
     extract_tbl = require_table(cfg, "extract", path=config_path)
+    pack_tbl = optional_table(cfg, "pack", path=config_path)
 
     pipeline_name = require_str(
         pipeline_tbl, "name", path=config_path, table_name="pipeline")
@@ -54,6 +72,7 @@ def load_config(config_path: Path) -> dict[str, Any]:
     provenance_filename = require_str(
         paths_tbl, "provenance_filename", path=config_path, table_name="paths"
     )
+    events_filename = optional_str(paths_tbl, "events_filename")
 
     url = require_str(download_tbl, "url", path=config_path,
                       table_name="download")
@@ -64,6 +83,10 @@ def load_config(config_path: Path) -> dict[str, Any]:
     user_agent = require_str(download_tbl, "user_agent",
                              path=config_path, table_name="download")
     timeout_seconds = optional_int(download_tbl, "timeout_seconds")
+    connections = optional_int(download_tbl, "connections")
+    retries = optional_int(download_tbl, "retries")
+    stream_extract = optional_bool(download_tbl, "stream_extract")
+    keep_archive = optional_bool(download_tbl, "keep_archive")
 
     sentinel_relpath = require_str(
         extract_tbl, "sentinel_relpath", path=config_path, table_name="extract")
@@ -72,12 +95,22 @@ def load_config(config_path: Path) -> dict[str, Any]:
         raise ValueError(
             "Config must include [extract].expected_dirs as a non-empty list")
 
+    hash_workers = optional_int(extract_tbl, "hash_workers")
+
+    pack_enabled = optional_bool(pack_tbl, "enabled")
+    packed_dirname = optional_str(pack_tbl, "dirname")
+    extract_files = optional_bool(pack_tbl, "extract_files")
+    pack_parquet = optional_bool(pack_tbl, "parquet")
+    if extract_files is False and not pack_enabled:
+        raise ValueError("[pack].extract_files = false requires [pack].enabled = true")
+
     return {
         "pipeline": pipeline_name,
         "cache_root": as_path(cache_root_str),
         "archive_filename": archive_filename,
         "raw_dirname": raw_dirname,
         "provenance_filename": provenance_filename,
+        "events_filename": events_filename,
         "url": url,
         "expected_md5": expected_md5,
         "expected_sha256": expected_sha256,
@@ -85,15 +118,30 @@ def load_config(config_path: Path) -> dict[str, Any]:
         "expected_bytes_max": expected_bytes_max,
         "user_agent": user_agent,
         "timeout_seconds": timeout_seconds,
+        "connections": connections,
+        "retries": retries,
+        "stream_extract": bool(stream_extract),
+        "keep_archive": True if keep_archive is None else keep_archive,
         "sentinel_relpath": sentinel_relpath,
         "expected_dirs": expected_dirs,
+        "hash_workers": hash_workers,
+        "pack_enabled": bool(pack_enabled),
+        "packed_dirname": packed_dirname or "packed",
+        "extract_files": True if extract_files is None else extract_files,
+        "pack_parquet": bool(pack_parquet),
     }
 
 
-def ingest(*, config: dict[str, Any], cache_root: Path, force: bool = False) -> Path:
+def ingest(
+    *, config: dict[str, Any], cache_root: Path, force: bool = False, limits: StageLimits = NO_LIMITS
+) -> Path:
     pipeline: PipelineName = "sentiment_embeddings"
     pipeline_cache = cache_root / pipeline
     pipeline_cache.mkdir(parents=True, exist_ok=True)
+    memo = HashMemo.for_cache_root(cache_root)
+    events_filename = config.get("events_filename")
+    recorder = StageRecorder(
+        pipeline=pipeline, event_log=pipeline_cache / str(events_filename) if events_filename else None)
 
     archive_path = pipeline_cache / str(config["archive_filename"])
     raw_dir = pipeline_cache / str(config["raw_dirname"])
@@ -103,54 +151,84 @@ def ingest(*, config: dict[str, Any], cache_root: Path, force: bool = False) ->
     print(f"[sentiment_embeddings] Downloading: {url}")
     print(f"[sentiment_embeddings] Cache file: {archive_path}")
 
-    download_url(
+    provenance_path = pipeline_cache / str(config["provenance_filename"])
+    packed_dir = pipeline_cache / str(config["packed_dirname"])
+    previous = read_provenance_record(provenance_path, method="download")
+    download_kwargs: dict[str, Any] = dict(
         url=url,
-        dst=archive_path,
+        archive_path=archive_path,
+        keep_archive=bool(config["keep_archive"]),
+        previous=previous,
         expected_md5=config.get("expected_md5"),
         expected_sha256=config.get("expected_sha256"),
         expected_bytes_min=config.get("expected_bytes_min"),
         expected_bytes_max=config.get("expected_bytes_max"),
         user_agent=str(config["user_agent"]),
         timeout_seconds=int(config["timeout_seconds"] or 60),
+        connections=int(config["connections"] or DEFAULT_CONNECTIONS),
+        retries=int(config["retries"] if config["retries"] is not None else DEFAULT_RETRIES),
         force=force,
+        memo=memo,
+        limits=limits,
+        recorder=recorder,
     )
 
-    print(f"[sentiment_embeddings] Extracting into: {raw_dir}")
-    # Archive contains 'aclImdb/' folder.
-    extract_tar_gz(
-        archive_path=archive_path,
-        dst_dir=raw_dir,
-        sentinel_relpath=str(config["sentinel_relpath"]),
-    )
-
-    # Basic sanity checks (expected files)
     sentinel = raw_dir / str(config["sentinel_relpath"])
-    expected_dirs = [raw_dir / rel for rel in list(config["expected_dirs"])]
-    if not sentinel.exists() or any(not d.exists() for d in expected_dirs):
-        raise RuntimeError(
-            "IMDB extraction sanity check failed; expected aclImdb/README, aclImdb/train, aclImdb/test under "
-            f"{raw_dir}"
-        )
+    if config["extract_files"]:
+        if config["stream_extract"]:
+            print(f"[sentiment_embeddings] Streaming extraction into: {raw_dir}")
+        else:
+            print(f"[sentiment_embeddings] Extracting into: {raw_dir}")
+        # Archive contains 'aclImdb/' folder.
+        archive_record = fetch_tar_gz(dst_dir=raw_dir, stream=bool(config["stream_extract"]), **download_kwargs)
 
-    provenance_path = pipeline_cache / str(config["provenance_filename"])
-    files: list[CachedFile] = [
-        CachedFile(
-            src=url,
-            dst=str(archive_path),
-            method="download",
-            bytes=archive_path.stat().st_size,
-            sha256=sha256_file(archive_path),
-        ),
-        CachedFile(
-            src=str(archive_path),
-            dst=str(sentinel),
-            method="extract",
-            bytes=sentinel.stat().st_size,
-            sha256=sha256_file(sentinel),
-        ),
-    ]
+        # Basic sanity checks (expected files)
+        expected_dirs = [raw_dir / rel for rel in list(config["expected_dirs"])]
+        with recorder.stage("sanity_check"):
+            if not sentinel.exists() or any(not d.exists() for d in expected_dirs):
+                raise RuntimeError(
+                    "IMDB extraction sanity check failed; expected aclImdb/README, aclImdb/train, aclImdb/test under "
+                    f"{raw_dir}"
+                )
+    else:
+        print(f"[sentiment_embeddings] Packing reviews without extracting files into: {packed_dir}")
+        archive_record = fetch_packed_imdb(
+            out_dir=packed_dir, parquet=bool(config["pack_parquet"]), **download_kwargs)
+
+    packed: list[PackedTextSplit] = []
+    if config["pack_enabled"]:
+        if config["extract_files"] and (force or packed_source(packed_dir) != archive_record.sha256):
+            print(f"[sentiment_embeddings] Packing reviews into: {packed_dir}")
+            with limits.cpu(), recorder.stage("pack") as meter:
+                if archive_path.exists():
+                    # One sequential read of the archive beats ~100k small-file opens.
+                    pack_imdb_archive(archive_path=archive_path, out_dir=packed_dir,
+                                      source=archive_record.sha256, parquet=bool(config["pack_parquet"]))
+                else:
+                    pack_imdb_tree(root=sentinel.parent, out_dir=packed_dir,
+                                   source=archive_record.sha256, parquet=bool(config["pack_parquet"]))
+                meter.add_bytes(archive_record.bytes)
+        packed = load_packed_splits(packed_dir)
+        with recorder.stage("sanity_check"):
+            empty = [p.split for p in packed if p.split in ("train", "test") and p.count == 0]
+            if empty:
+                raise RuntimeError(f"IMDB packing sanity check failed; no reviews packed for: {empty}")
+
+    with recorder.stage("hashing") as meter:
+        files: list[CachedFile] = [archive_record]
+        if config["extract_files"]:
+            # The sentinel (aclImdb/README) sits at the root of the extracted tree.
+            files.append(directory_record(
+                src=archive_path, dst=sentinel.parent, method="extract",
+                workers=int(config["hash_workers"] or DEFAULT_TREE_WORKERS), memo=memo))
+        for p in packed:
+            files.extend(
+                cached_file_record(src=f"(packed) {p.split}", dst=path, method="generated", memo=memo)
+                for path in p.paths()
+            )
+        meter.add_bytes(sum(f.bytes for f in files[1:]))
     write_provenance(pipeline=pipeline, cache_root=cache_root,
-                     files=files, out_path=provenance_path)
+                     files=files, out_path=provenance_path, timings=recorder.timings)
     return provenance_path
 
 
@@ -0,0 +1,133 @@
+from __future__ import annotations
+
+import json
+import os
+import sys
+import threading
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:  # pragma: no cover - non-POSIX
+    resource = None  # type: ignore[assignment]
+
+
+@dataclass(frozen=True)
+class StageTiming:
+    stage: str
+    wall_seconds: float
+    cpu_seconds: float
+    bytes: int
+    mb_per_s: float | None
+    peak_rss_bytes: int | None
+
+
+class StageMeter:
+    """Handed to the body of a stage so it can report how many bytes it processed."""
+
+    def __init__(self) -> None:
+        self.bytes = 0
+
+    def add_bytes(self, n: int) -> None:
+        self.bytes += n
+
+
+def _cpu_seconds() -> float:
+    # Includes reaped child processes (e.g. the zip extraction pool).
+    t = os.times()
+    return t.user + t.system + t.children_user + t.children_system
+
+
+_PROC_STATUS = Path("/proc/self/status")
+_PROC_CLEAR_REFS = Path("/proc/self/clear_refs")
+
+
+def peak_rss_bytes() -> int | None:
+    """Peak resident set size of this process, since the last reset_peak_rss() where supported."""
+    try:
+        for line in _PROC_STATUS.read_text(encoding="ascii").splitlines():
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is KiB on Linux but bytes on macOS.
+    return int(peak) if sys.platform == "darwin" else int(peak) * 1024
+
+
+def reset_peak_rss() -> bool:
+    """Reset the peak RSS to the current RSS (Linux only), so peak_rss_bytes() covers what runs next.
+
+    Returns False where the high-water mark cannot be reset; peak_rss_bytes()
+    is then the process-wide peak.
+    """
+    try:
+        _PROC_CLEAR_REFS.write_text("5", encoding="ascii")
+    except OSError:
+        return False
+    return True
+
+
+class StageRecorder:
+    """Collects per-stage wall/CPU time, bytes, throughput and peak RSS for one ingest.
+
+    CPU time and peak RSS are process-wide, so with several pipelines running
+    concurrently in one process they are upper bounds for the stage. When
+    event_log is set, every stage start/end is also appended to it as a JSON line.
+    """
+
+    def __init__(self, *, pipeline: str, event_log: Path | None = None) -> None:
+        self.pipeline = pipeline
+        self.event_log = event_log
+        self.timings: list[StageTiming] = []
+        self._lock = threading.Lock()
+
+    def _emit(self, event: dict[str, object]) -> None:
+        if self.event_log is None:
+            return
+        record = {"ts": datetime.now(timezone.utc).isoformat(),
+                  "pipeline": self.pipeline, **event}
+        line = json.dumps(record, sort_keys=True) + "\n"
+        with self._lock:
+            self.event_log.parent.mkdir(parents=True, exist_ok=True)
+            with self.event_log.open("a", encoding="utf-8") as f:
+                f.write(line)
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[StageMeter]:
+        meter = StageMeter()
+        self._emit({"event": "stage_start", "stage": name})
+        wall0, cpu0 = time.perf_counter(), _cpu_seconds()
+        ok = False
+        try:
+            yield meter
+            ok = True
+        finally:
+            wall = time.perf_counter() - wall0
+            timing = StageTiming(
+                stage=name,
+                wall_seconds=round(wall, 6),
+                cpu_seconds=round(_cpu_seconds() - cpu0, 6),
+                bytes=meter.bytes,
+                mb_per_s=round(meter.bytes / 1e6 / wall, 3) if wall > 0 and meter.bytes else None,
+                peak_rss_bytes=peak_rss_bytes(),
+            )
+            with self._lock:
+                self.timings.append(timing)
+            self._emit({"event": "stage_end", "ok": ok, **asdict(timing)})
+
+
+@contextmanager
+def maybe_stage(recorder: StageRecorder | None, name: str) -> Iterator[StageMeter]:
+    if recorder is None:
+        yield StageMeter()
+        return
+    with recorder.stage(name) as meter:
+        yield meter
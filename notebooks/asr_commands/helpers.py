@@ -2,38 +2,131 @@ import numpy as np
 import torch
 from datasets import Audio, Dataset
 from transformers import AutoModelForAudioClassification, AutoFeatureExtractor
-from sklearn.metrics import accuracy_score, f1_score, confusion_matrix, classification_report
+import contextlib
+import functools
+import io
 import json
 from pathlib import Path
 
 
-def run_inference(model, feature_extractor, device, test_ds):
-    all_preds, all_labels = [], []
-    n = len(test_ds)
-    print(f"Running inference on {n} samples...")
-    for i, ex in enumerate(test_ds):
-        if i % 100 == 0 or i == n - 1:
-            print(f"Sample {i+1}/{n}", flush=True)
-        inp = torch.tensor(ex['input_values']).unsqueeze(0).to(device)
-        logits = model(inp).logits.cpu().numpy()[0]
-        pred = np.argmax(logits)
-        all_preds.append(pred)
-        all_labels.append(ex['label'])
-    return np.array(all_preds), np.array(all_labels)
+def run_inference(model, feature_extractor, device, test_ds, batch_size=32, max_samples_per_batch=None, log_every=10,
+                  metrics=None, cpu_mode=None):
+    # Length-bucketed batches; predictions come back in test_ds order and match batch_size=1 (see batching_parity).
+    # The attention mask is only passed when the feature extractor returns one (return_attention_mask). Models
+    # without it, and group-norm conv encoders (feat_extract_norm="group", e.g. superb/hubert-base-superb-ks)
+    # whose outputs change with any padding, are batched by exact clip length instead; most speech-commands
+    # clips are exactly 16000 samples, so batches stay full.
+    # metrics: optional utils.metrics.ConfusionMatrix, updated per batch and shown in the progress lines.
+    # cpu_mode: "int8", "bf16", "compile", ... or a CPUInferenceConfig (utils/cpu_inference.py); None = fp32 eager.
+    # test_ds: a datasets split with input_values/label columns, or a FeatureStore from cached_features.
+    from utils.batching import length_buckets
+    if isinstance(test_ds, FeatureStore):
+        values, all_labels = test_ds, np.asarray(test_ds.labels)
+        lengths = np.asarray(test_ds.lengths, dtype=np.int64)
+    else:
+        values = [np.asarray(v, dtype=np.float32) for v in test_ds['input_values']]
+        all_labels = np.asarray(test_ds['label'])
+        lengths = np.array([len(v) for v in values], dtype=np.int64)
+    n = len(values)
+    use_mask = bool(getattr(feature_extractor, "return_attention_mask", False))
+    exact = not use_mask or getattr(model.config, "feat_extract_norm", None) == "group"
+    batches = length_buckets(lengths, batch_size, max_padded=max_samples_per_batch, exact=exact)
+    padding_value = getattr(feature_extractor, "padding_value", 0.0)
+    all_preds = np.empty(n, dtype=np.int64)
+    autocast = contextlib.nullcontext
+    threads = contextlib.nullcontext()
+    if cpu_mode is not None:
+        from utils.cpu_inference import autocast as cpu_autocast, cpu_threads, prepare_model
+        model = prepare_model(model, cpu_mode)
+        autocast = lambda: cpu_autocast(cpu_mode)  # noqa: E731
+        threads = cpu_threads(cpu_mode)  # the mode's thread count for this call only
+    print(f"Running inference on {n} samples in {len(batches)} batches...")
+    model.eval()
+    with threads, torch.inference_mode(), autocast():
+        for b, idx in enumerate(batches, start=1):
+            longest = int(lengths[idx].max())
+            x = np.full((len(idx), longest), padding_value, dtype=np.float32)
+            mask = np.zeros((len(idx), longest), dtype=np.int64)
+            for row, i in enumerate(idx):
+                x[row, :lengths[i]] = values[i]
+                mask[row, :lengths[i]] = 1
+            kwargs = {"attention_mask": torch.from_numpy(mask).to(device)} if use_mask else {}
+            logits = model(torch.from_numpy(x).to(device), **kwargs).logits
+            all_preds[idx] = logits.argmax(dim=-1).cpu().numpy()
+            if metrics is not None:
+                metrics.update(all_labels[idx], all_preds[idx])
+            if b % log_every == 0 or b == len(batches):
+                live = f" | {metrics}" if metrics is not None else ""
+                print(f"Batch {b}/{len(batches)} ({sum(map(len, batches[:b]))}/{n} samples){live}", flush=True)
+    return all_preds, all_labels
+
+
+def _num_rows(test_ds):
+    return len(test_ds['label']) if isinstance(test_ds, dict) else len(test_ds)
+
+
+def _take(test_ds, idx):
+    # Rows idx of a run_inference input, without decoding or copying the rest of the split.
+    if isinstance(test_ds, FeatureStore):
+        return {'input_values': [test_ds[i] for i in idx], 'label': np.asarray(test_ds.labels)[idx]}
+    if isinstance(test_ds, Dataset):
+        return test_ds.select(idx)
+    return {k: [test_ds[k][i] for i in idx] for k in ('input_values', 'label')}
+
+
+def _infer_shard(shared_model, feature_extractor, test_ds, kwargs, idx):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return run_inference(shared_model.model, feature_extractor, "cpu", _take(test_ds, idx), **kwargs)
+
+
+def run_inference_sharded(model, feature_extractor, test_ds, processes=None, threads=None, batch_size=32,
+                          max_samples_per_batch=None, metrics=None, cpu_mode=None, baseline_s=None,
+                          start_method=None):
+    # run_inference over `processes` CPU worker processes with `threads` torch threads each (utils/sharded.py;
+    # default: 4 threads per process, as many processes as there are cores for). Shards are balanced on clip
+    # length; (preds, labels) come back in test_ds order, plus a ScalingReport (pass the wall time of a
+    # single-process run as baseline_s to get speedup/efficiency). The model's weights are moved to shared
+    # memory and a FeatureStore is reopened from disk in each worker, so neither is copied per process.
+    from utils.cpu_inference import with_threads
+    from utils.sharded import SharedModel, default_layout, run_sharded
+    if isinstance(test_ds, FeatureStore):
+        costs = np.asarray(test_ds.lengths)
+    elif isinstance(test_ds, dict):
+        costs = [len(v) for v in test_ds['input_values']]
+    else:
+        costs = None  # lengths of a datasets split are only known after decoding it
+    n = _num_rows(test_ds)
+    processes, threads = default_layout(processes, threads)
+    shared_model = SharedModel(model.eval())
+    # Each worker prepares cpu_mode itself (compiled modules cannot be sent to another process).
+    kwargs = dict(batch_size=batch_size, max_samples_per_batch=max_samples_per_batch, log_every=10**9,
+                  cpu_mode=with_threads(cpu_mode, threads))
+    on_shard = None
+    if metrics is not None:
+        on_shard = lambda idx, out: metrics.update(out[1], out[0])  # noqa: E731
+    fn = functools.partial(_infer_shard, shared_model, feature_extractor, test_ds, kwargs)
+    (preds, labels), report = run_sharded(fn, n, processes=processes, threads=threads, costs=costs,
+                                          baseline_s=baseline_s, start_method=start_method, on_shard=on_shard)
+    print(report)
+    return preds, labels, report
+
+
+def batching_parity(model, feature_extractor, test_ds, batch_size=32, limit=256):
+    # Predictions of run_inference with batch_size vs. one clip per batch on the first `limit` clips.
+    # Returns (agreement, indices that differ); agreement should be 1.0.
+    if limit is not None and limit < _num_rows(test_ds):
+        test_ds = _take(test_ds, np.arange(limit))
+    with contextlib.redirect_stdout(io.StringIO()):
+        batched, _ = run_inference(model, feature_extractor, "cpu", test_ds, batch_size=batch_size)
+        single, _ = run_inference(model, feature_extractor, "cpu", test_ds, batch_size=1)
+    differ = np.flatnonzero(batched != single)
+    return 1.0 - len(differ) / max(1, len(single)), differ
 
 
 def compute_metrics(y_true, y_pred, labels):
-    acc = accuracy_score(y_true, y_pred)
-    f1 = f1_score(y_true, y_pred, average="macro")
-    cm = confusion_matrix(y_true, y_pred, labels=range(len(labels)))
-    report = classification_report(y_true, y_pred, labels=range(
-        len(labels)), target_names=labels, output_dict=True, zero_division=0)
-    return {
-        "accuracy": float(acc),
-        "f1_macro": float(f1),
-        "confusion_matrix": cm.tolist(),
-        "classification_report": report
-    }
+    # Same values as sklearn's accuracy/f1/confusion_matrix/classification_report, derived from one confusion matrix.
+    from utils.metrics import ConfusionMatrix
+    return ConfusionMatrix.from_predictions(y_true, y_pred, len(labels)).metrics(labels)
 
 
 def load_test_dataset():
@@ -50,3 +143,171 @@ def load_test_dataset():
     test_ds = Dataset.from_list(test_df).cast_column(
         'audio', Audio(sampling_rate=16000))
     return test_ds, labels
+
+
+class WaveformStore:
+    # Decoded clips written by data_ingestion/asr_commands/run.py ([waveforms] enabled): one memory-mapped
+    # array at 16 kHz plus offsets/lengths/labels. Indexing returns zero-copy views, no audio decoding.
+    def __init__(self, store_dir=None):
+        if store_dir is None:
+            from utils.paths import CACHE_PATH
+            store_dir = CACHE_PATH / "asr_commands" / "waveforms"
+        store_dir = Path(store_dir)
+        manifest = json.loads((store_dir / "manifest.json").read_text(encoding="utf-8"))
+        index = json.loads((store_dir / "paths.json").read_text(encoding="utf-8"))
+        self.sampling_rate = int(manifest["sample_rate"])
+        self.source = manifest["source"]  # signature of the decoded clips (names, sizes, mtimes)
+        self.waveforms = np.load(store_dir / "waveforms.npy", mmap_mode="r")
+        self.offsets = np.load(store_dir / "offsets.npy", mmap_mode="r")
+        self.lengths = np.load(store_dir / "lengths.npy", mmap_mode="r")
+        self.labels = np.load(store_dir / "labels.npy", mmap_mode="r")
+        self.label_names = index["labels"]
+        self.paths = index["paths"]  # "<label>/<file>.wav", same order as the notebook's file index
+        self._index = {p: i for i, p in enumerate(self.paths)}
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __getitem__(self, i):
+        return self.waveforms[self.offsets[i]:self.offsets[i + 1]]
+
+    def float32(self, i):
+        # Same scaling as datasets' Audio decoding (int16 / 32768).
+        x = self[i]
+        return x if x.dtype == np.float32 else x.astype(np.float32) / 32768.0
+
+    def index_of(self, path):
+        # Accepts absolute paths from splits.json; clips are matched on "<label>/<file>".
+        p = Path(path)
+        return self._index[f"{p.parent.name}/{p.name}"]
+
+
+def _load_splits():
+    outputs_dir = Path(__file__).parents[2] / \
+        'outputs' / 'asr_commands' / 'preprocessing'
+    with open(outputs_dir / 'splits.json', 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def load_test_waveforms(store=None):
+    # Test split from splits.json resolved against the waveform store: (store, indices, label ids, labels).
+    store = store if store is not None else WaveformStore()
+    splits = _load_splits()
+    labels = splits['labels']
+    test_records = splits['splits']['test']
+    indices = np.array([store.index_of(r['path']) for r in test_records], dtype=np.int64)
+    y = np.array([labels.index(r['label']) for r in test_records], dtype=np.int64)
+    return store, indices, y, labels
+
+
+class FeatureStore:
+    # Feature-extractor outputs for one split (see cached_features): clip i's input_values are
+    # input_values[offsets[i]:offsets[i + 1]], float32, unpadded, in splits.json order.
+    def __init__(self, store_dir):
+        store_dir = Path(store_dir)
+        self.store_dir = store_dir
+        self.input_values = np.load(store_dir / "input_values.npy", mmap_mode="r")
+        self.offsets = np.load(store_dir / "offsets.npy", mmap_mode="r")
+        self.lengths = np.load(store_dir / "lengths.npy", mmap_mode="r")
+        self.labels = np.load(store_dir / "labels.npy", mmap_mode="r")
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def __getitem__(self, i):
+        return self.input_values[self.offsets[i]:self.offsets[i + 1]]
+
+    def __reduce__(self):
+        # Pickled (e.g. for worker processes) as its directory, so the arrays are reopened, not copied.
+        return FeatureStore, (self.store_dir,)
+
+    def to_dataset(self):
+        # datasets.Dataset with input_values/label columns built zero-copy on the arrays, for the Trainer
+        # (pad with DataCollatorWithPadding(feature_extractor)).
+        import pyarrow as pa
+        values = pa.LargeListArray.from_arrays(pa.array(np.asarray(self.offsets, dtype=np.int64)),
+                                               pa.array(np.asarray(self.input_values)))
+        return Dataset(pa.table({"input_values": values, "label": pa.array(np.asarray(self.labels))}))
+
+
+def feature_extractor_hash(feature_extractor):
+    import hashlib
+    return hashlib.sha256(feature_extractor.to_json_string().encode("utf-8")).hexdigest()
+
+
+def _split_digest(records, labels, source):
+    import hashlib
+    h = hashlib.sha256(json.dumps({"labels": labels, "source": source}, sort_keys=True).encode("utf-8"))
+    for r in records:
+        p = Path(r["path"])
+        h.update(f"{p.parent.name}/{p.name}\0{r['label']}\n".encode("utf-8"))
+    return h.hexdigest()
+
+
+def _decode_split(records, store):
+    # float32 waveforms at 16 kHz: zero-copy from the waveform store when it exists, else decoded by datasets.
+    if store is not None:
+        return [store.float32(store.index_of(r["path"])) for r in records]
+    ds = Dataset.from_list([{"audio": r["path"]} for r in records]).cast_column("audio", Audio(sampling_rate=16000))
+    return [np.asarray(ex["audio"]["array"], dtype=np.float32) for ex in ds]
+
+
+def cached_features(feature_extractor, split="test", store=None, cache_dir=None, workers=None):
+    # input_values for a splits.json split, extracted once (threads over clips) and memory-mapped afterwards.
+    # Keyed by the feature extractor's config and the split's clips/labels (plus the waveform store's source
+    # signature), so re-running evaluation skips decoding and feature extraction entirely.
+    import os
+    import shutil
+    from concurrent.futures import ThreadPoolExecutor
+    if store is None:
+        try:
+            store = WaveformStore()
+        except OSError:
+            store = None
+    if cache_dir is None:
+        from utils.paths import CACHE_PATH
+        cache_dir = CACHE_PATH / "asr_commands" / "features"
+    splits = _load_splits()
+    labels = splits["labels"]
+    records = splits["splits"][split]
+    if store is not None:
+        source = store.source
+    else:
+        source = [[st.st_size, st.st_mtime_ns] for st in (os.stat(r["path"]) for r in records)]
+    key = feature_extractor_hash(feature_extractor)[:16] + "-" + _split_digest(records, labels, source)[:16]
+    entry = Path(cache_dir) / split / key
+    if (entry / "labels.npy").exists():
+        return FeatureStore(entry)
+
+    waves = _decode_split(records, store)
+    lengths = np.array([len(w) for w in waves], dtype=np.int64)
+    offsets = np.zeros(len(waves) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    sr = store.sampling_rate if store is not None else 16000
+    tmp = entry.with_name(f".{key}.{os.getpid()}.tmp")
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+    try:
+        out = np.lib.format.open_memmap(tmp / "input_values.npy", mode="w+", dtype=np.float32,
+                                        shape=(int(offsets[-1]),))
+
+        def extract(i):
+            values = np.asarray(feature_extractor(waves[i], sampling_rate=sr)["input_values"][0], dtype=np.float32)
+            if len(values) != lengths[i]:
+                raise ValueError(f"Feature extractor changed the length of {records[i]['path']} "
+                                 f"({lengths[i]} -> {len(values)}); only per-sample extractors can be cached")
+            out[offsets[i]:offsets[i + 1]] = values
+
+        with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+            list(pool.map(extract, range(len(waves))))
+        out.flush()
+        del out
+        np.save(tmp / "offsets.npy", offsets)
+        np.save(tmp / "lengths.npy", lengths)
+        np.save(tmp / "labels.npy", np.array([labels.index(r["label"]) for r in records], dtype=np.int64))
+        shutil.rmtree(entry, ignore_errors=True)
+        os.replace(tmp, entry)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    return FeatureStore(entry)
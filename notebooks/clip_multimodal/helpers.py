@@ -2,46 +2,407 @@ import numpy as np
 import torch
 from PIL import Image
 from transformers import CLIPModel, CLIPProcessor
-from sklearn.metrics import accuracy_score
+import collections
+import contextlib
+import functools
+import io
 import pickle
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 
-def run_inference(model, processor, device, images, text_features, batch_size=64, log_every=5):
+CLIP_MEAN = (0.48145466, 0.4578275, 0.40821073)
+CLIP_STD = (0.26862954, 0.26130258, 0.27577711)
+# Bump when preprocess_images changes output (used to key cached embeddings).
+PREPROCESS_VERSION = "tensor-bicubic-v2"
+
+
+_PRECISION_BITS = 22  # Pillow's fixed-point precision for 8-bit resampling
+
+
+def _fixed_point_pass(acc):
+    # Pillow's clip8: round the fixed-point sum to the nearest uint8 level (half up) and clamp.
+    return torch.floor_((acc + (1 << (_PRECISION_BITS - 1))) / (1 << _PRECISION_BITS)).clamp_(0, 255)
+
+
+def _bicubic(x, a=-0.5):
+    x = abs(x)
+    if x < 1.0:
+        return ((a + 2.0) * x - (a + 3.0)) * x * x + 1.0
+    if x < 2.0:
+        return (((x - 5.0) * x + 8.0) * x - 4.0) * a
+    return 0.0
+
+
+@functools.lru_cache(maxsize=None)
+def _resize_weights(in_size, out_size):
+    # (out_size, in_size) matrix reproducing PIL's BICUBIC resampling along one axis (CLIPProcessor's PIL backend),
+    # as integer coefficients scaled by 2**_PRECISION_BITS.
+    scale = in_size / out_size
+    filterscale = max(scale, 1.0)
+    support = 2.0 * filterscale
+    weights = np.zeros((out_size, in_size), dtype=np.float64)
+    for xx in range(out_size):
+        center = (xx + 0.5) * scale
+        xmin = max(int(center - support + 0.5), 0)
+        xmax = min(int(center + support + 0.5), in_size)
+        w = np.array([_bicubic((x - center + 0.5) / filterscale) for x in range(xmin, xmax)])
+        if w.sum() != 0:
+            w /= w.sum()
+        weights[xx, xmin:xmax] = w
+    # Pillow resamples 8-bit images in fixed point: coefficients rounded (half away from zero) to 2**22.
+    return np.trunc(weights * (1 << _PRECISION_BITS) + np.where(weights < 0, -0.5, 0.5))
+
+
+def _size_field(size, key):
+    # size/crop_size are plain dicts in older transformers and SizeDict objects in newer ones.
+    if isinstance(size, dict):
+        return size.get(key)
+    return getattr(size, key, None)
+
+
+def _processor_settings(processor):
+    ip = getattr(processor, "image_processor", processor)
+    size = getattr(ip, "size", None)
+    crop = getattr(ip, "crop_size", None)
+    if isinstance(size, int):
+        shortest = size
+    else:
+        shortest = (_size_field(size, "shortest_edge") or _size_field(size, "height") or 224) if size else 224
+    if isinstance(crop, int):
+        crop_hw = (crop, crop)
+    else:
+        crop_hw = (_size_field(crop, "height") or 224, _size_field(crop, "width") or 224) if crop else (224, 224)
+    mean = getattr(ip, "image_mean", None) or CLIP_MEAN
+    std = getattr(ip, "image_std", None) or CLIP_STD
+    return int(shortest), (int(crop_hw[0]), int(crop_hw[1])), tuple(mean), tuple(std)
+
+
+def preprocess_images(images, processor=None, device="cpu", out=None):
+    # Batched CLIP preprocessing on a uint8 (N, H, W, 3) array: bicubic shortest-edge resize, center crop,
+    # rescale and mean/std normalization as one tensor op chain. Returns float32 (N, 3, crop_h, crop_w).
+    size, (crop_h, crop_w), mean, std = _processor_settings(processor) if processor is not None else (
+        224, (224, 224), CLIP_MEAN, CLIP_STD)
+    x = torch.from_numpy(np.ascontiguousarray(images)).to(device)
+    n, h, w, _ = x.shape
+    if h <= w:
+        new_h, new_w = size, int(size * w / h)
+    else:
+        new_h, new_w = int(size * h / w), size
+    wh = torch.from_numpy(_resize_weights(h, new_h)).to(device=device, dtype=torch.float64)
+    ww = torch.from_numpy(_resize_weights(w, new_w)).to(device=device, dtype=torch.float64)
+    top, left = (new_h - crop_h) // 2, (new_w - crop_w) // 2
+    wh, ww = wh[top:top + crop_h], ww[left:left + crop_w]
+    # Separable resize of the cropped window. Like PIL: horizontal pass first, rounded to uint8 after each pass.
+    # float64 keeps the integer fixed-point sums exact, so the output matches Pillow bit for bit.
+    x = _fixed_point_pass(torch.einsum("nhwc,pw->nchp", x.double(), ww))
+    x = _fixed_point_pass(torch.einsum("oh,nchp->ncop", wh, x)).float()
+    m = torch.tensor(mean, dtype=torch.float32, device=device).view(1, 3, 1, 1)
+    s = torch.tensor(std, dtype=torch.float32, device=device).view(1, 3, 1, 1)
+    x = (x / 255.0 - m) / s
+    if out is not None:
+        out[:n].copy_(x)
+        return out[:n]
+    return x
+
+
+def preprocess_parity(processor, images, atol=0.05):
+    # Compare preprocess_images against CLIPProcessor on the same images (max abs diff in normalized units;
+    # one uint8 level is ~0.015). preprocess_images reproduces the PIL backend (use_fast=False) exactly;
+    # transformers>=5 defaults to the torchvision backend (use_fast=True), which rounds differently and is up
+    # to two levels off on upscaled CIFAR images. "backend" says which one `processor` uses.
+    reference = processor(images=[Image.fromarray(np.asarray(im)) for im in images],
+                          return_tensors="pt")["pixel_values"]
+    ours = preprocess_images(images, processor)
+    diff = (reference - ours).abs()
+    return {
+        "backend": getattr(getattr(processor, "image_processor", processor), "backend", "pil"),
+        "max_abs_diff": float(diff.max()),
+        "mean_abs_diff": float(diff.mean()),
+        "atol": atol,
+        "ok": bool(diff.max() <= atol),
+    }
+
+
+class PipelineStats:
+    # Seconds per stage of the prefetch pipeline. *_stall is time a stage spent waiting on the other one:
+    # forward_stall = model idle waiting for a preprocessed batch, preprocess_stall = workers idle because the
+    # queue was full (i.e. the model is the bottleneck).
+    def __init__(self, workers):
+        self.workers = workers
+        self.preprocess = 0.0
+        self.forward = 0.0
+        self.forward_stall = 0.0
+        self.wall = 0.0
+        self.batches = 0
+        self._lock = threading.Lock()
+
+    def add_preprocess(self, seconds):
+        with self._lock:
+            self.preprocess += seconds
+
+    @property
+    def preprocess_stall(self):
+        return max(0.0, self.workers * self.wall - self.preprocess)
+
+    def as_dict(self):
+        return {
+            "batches": self.batches,
+            "workers": self.workers,
+            "wall_s": round(self.wall, 3),
+            "preprocess_s": round(self.preprocess, 3),
+            "forward_s": round(self.forward, 3),
+            "forward_stall_s": round(self.forward_stall, 3),
+            "preprocess_stall_s": round(self.preprocess_stall, 3),
+        }
+
+    def __str__(self):
+        d = self.as_dict()
+        return (f"preprocess {d['preprocess_s']:.2f}s on {self.workers} worker(s), stalled {d['preprocess_stall_s']:.2f}s | "
+                f"forward {d['forward_s']:.2f}s, stalled {d['forward_stall_s']:.2f}s | wall {d['wall_s']:.2f}s")
+
+
+def prefetch_batches(images, processor, batch_size=64, workers=2, depth=4, pin_memory=False, stats=None):
+    # Yields (start, end, pixel_values) in order while up to `depth` later batches are preprocessed by `workers`
+    # threads (the tensor ops release the GIL). Output buffers are allocated once (pinned when pin_memory) and
+    # reused round-robin, so the yielded tensor is only valid until the next batch is requested.
+    n = len(images)
+    if n == 0:
+        return
+    depth = max(1, depth)
+    stats = stats if stats is not None else PipelineStats(max(1, workers))
+    _, (crop_h, crop_w), _, _ = _processor_settings(processor) if processor is not None else (None, (224, 224), None, None)
+    buffers = [torch.empty((batch_size, 3, crop_h, crop_w), dtype=torch.float32, pin_memory=pin_memory)
+               for _ in range(depth + 1)]
+    starts = list(range(0, n, batch_size))
+
+    def prepare(i):
+        t = time.perf_counter()
+        start = starts[i]
+        end = min(start + batch_size, n)
+        # Grad mode is thread-local, so the worker enters inference mode itself.
+        with torch.inference_mode():
+            out = preprocess_images(images[start:end], processor, out=buffers[i % len(buffers)])
+        stats.add_preprocess(time.perf_counter() - t)
+        return start, end, out
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="clip-prefetch") as pool:
+        pending = collections.deque(pool.submit(prepare, i) for i in range(min(depth, len(starts))))
+        next_i = len(pending)
+        try:
+            while pending:
+                t = time.perf_counter()
+                batch = pending.popleft().result()
+                stats.forward_stall += time.perf_counter() - t
+                # depth + 1 buffers: the refill reuses the buffer of the batch the consumer has just finished.
+                if next_i < len(starts):
+                    pending.append(pool.submit(prepare, next_i))
+                    next_i += 1
+                t = time.perf_counter()
+                yield batch
+                stats.forward += time.perf_counter() - t
+                stats.batches += 1
+        finally:
+            for f in pending:
+                f.cancel()
+            stats.wall = time.perf_counter() - t0
+
+
+def run_inference(model, processor, device, images, text_features, batch_size=64, log_every=5,
+                  workers=2, prefetch_depth=4, stats=None, y_true=None, metrics=None, cpu_mode=None):
+    # Preprocessing of the next batches overlaps with model.vision_model on the current one (see prefetch_batches).
+    # Pass a PipelineStats as `stats` to keep the per-stage timings; they are printed at the end either way.
+    # With y_true and a utils.metrics.ConfusionMatrix as `metrics`, accuracy is tracked live per batch.
+    # cpu_mode: "int8", "bf16", "compile", ... or a CPUInferenceConfig (utils/cpu_inference.py); None = fp32 eager.
     n = len(images)
     preds = []
-    import time
+    stats = stats if stats is not None else PipelineStats(max(1, workers))
+    pin_memory = torch.device(device).type == "cuda"
+    autocast = contextlib.nullcontext
+    threads = contextlib.nullcontext()
+    if cpu_mode is not None:
+        from utils.cpu_inference import autocast as cpu_autocast, cpu_threads, prepare_model
+        model = prepare_model(model, cpu_mode, compile_modules=("vision_model",))
+        autocast = lambda: cpu_autocast(cpu_mode)  # noqa: E731
+        threads = cpu_threads(cpu_mode)  # the mode's thread count for this call only
     t0 = time.perf_counter()
     n_batches = (n + batch_size - 1) // batch_size
-    for batch_i, start in enumerate(range(0, n, batch_size), start=1):
-        end = min(start + batch_size, n)
-        batch_imgs = [Image.fromarray(images[i]) for i in range(start, end)]
-        img_inputs = processor(images=batch_imgs, return_tensors="pt")
-        pixel_values = img_inputs["pixel_values"].to(device)
-        with torch.no_grad():
-            vision_out = model.vision_model(pixel_values=pixel_values)
-            img_features = model.visual_projection(vision_out.pooler_output)
-        img_features = img_features / img_features.norm(dim=-1, keepdim=True)
-        logits = img_features @ text_features.T
-        preds.extend(torch.argmax(logits, dim=-1).detach().cpu().tolist())
-        if batch_i % log_every == 0 or end == n:
-            now = time.perf_counter()
-            elapsed = now - t0
-            done = end
-            rate = done / elapsed if elapsed > 0 else float("inf")
-            remaining = (n - done) / rate if rate > 0 else float("inf")
-            print(
-                f"[{batch_i}/{n_batches}] {done}/{n} images | {rate:.1f} img/s | ETA {remaining/60:.1f} min")
+    batches = prefetch_batches(images, processor, batch_size=batch_size, workers=workers, depth=prefetch_depth,
+                               pin_memory=pin_memory, stats=stats)
+    with threads:
+        for batch_i, (start, end, pixel_values) in enumerate(batches, start=1):
+            pixel_values = pixel_values.to(device, non_blocking=pin_memory)
+            with torch.inference_mode(), autocast():
+                vision_out = model.vision_model(pixel_values=pixel_values)
+                img_features = model.visual_projection(vision_out.pooler_output).float()
+            img_features = img_features / img_features.norm(dim=-1, keepdim=True)
+            logits = img_features @ text_features.T
+            # .cpu() synchronizes, so the pinned buffer is free for reuse once the next batch is requested.
+            batch_preds = torch.argmax(logits, dim=-1).detach().cpu().numpy()
+            preds.extend(batch_preds.tolist())
+            if metrics is not None and y_true is not None:
+                metrics.update(np.asarray(y_true[start:end]), batch_preds)
+            if batch_i % log_every == 0 or end == n:
+                now = time.perf_counter()
+                elapsed = now - t0
+                done = end
+                rate = done / elapsed if elapsed > 0 else float("inf")
+                remaining = (n - done) / rate if rate > 0 else float("inf")
+                live = f" | {metrics}" if metrics is not None and y_true is not None else ""
+                print(
+                    f"[{batch_i}/{n_batches}] {done}/{n} images | {rate:.1f} img/s | ETA {remaining/60:.1f} min{live}")
+    print(f"pipeline: {stats}")
     return np.array(preds)
 
 
+def _infer_shard(shared_model, processor, images, text_features, kwargs, idx):
+    # images is a shared-memory uint8 tensor; contiguous shards are sliced, others gathered.
+    images = images.numpy()
+    contiguous = len(idx) and idx[-1] - idx[0] == len(idx) - 1
+    shard = images[idx[0]:idx[-1] + 1] if contiguous else images[idx]
+    with contextlib.redirect_stdout(io.StringIO()):
+        return run_inference(shared_model.model, processor, "cpu", shard, text_features, **kwargs)
+
+
+def run_inference_sharded(model, processor, images, text_features, processes=None, threads=None, batch_size=64,
+                          workers=1, prefetch_depth=2, y_true=None, metrics=None, cpu_mode=None, baseline_s=None,
+                          start_method=None):
+    # run_inference over `processes` CPU worker processes with `threads` torch threads each (utils/sharded.py;
+    # default: 4 threads per process, as many processes as there are cores for); each process also runs
+    # `workers` preprocessing threads. Returns the predictions in image order and a ScalingReport (pass the
+    # wall time of a single-process run as baseline_s to get speedup/efficiency). The model's weights and one
+    # copy of the images are placed in shared memory, which every worker maps instead of receiving a copy.
+    from utils.cpu_inference import with_threads
+    from utils.sharded import SharedModel, default_layout, run_sharded
+    processes, threads = default_layout(processes, threads)
+    shared_model = SharedModel(model.eval())
+    shared_images = torch.empty(np.shape(images), dtype=torch.uint8).share_memory_()
+    shared_images.numpy()[...] = images
+    text_features = text_features.detach().cpu().share_memory_()
+    # Each worker prepares cpu_mode itself (compiled modules cannot be sent to another process).
+    kwargs = dict(batch_size=batch_size, log_every=10**9, workers=workers, prefetch_depth=prefetch_depth,
+                  cpu_mode=with_threads(cpu_mode, threads))
+    on_shard = None
+    if metrics is not None and y_true is not None:
+        on_shard = lambda idx, out: metrics.update(np.asarray(y_true)[idx], out[0])  # noqa: E731
+    fn = functools.partial(_infer_shard, shared_model, processor, shared_images, text_features, kwargs)
+    (preds,), report = run_sharded(fn, len(images), processes=processes, threads=threads, baseline_s=baseline_s,
+                                   start_method=start_method, on_shard=on_shard)
+    print(report)
+    return preds, report
+
+
+def model_fingerprint(model, model_id=None):
+    # Cache key for the weights: the hub id / checkpoint path when given (cheap), otherwise a hash of the
+    # state_dict. Pass model_id=None after fine-tuning in memory, or the cache would serve the base model's features.
+    from utils.embedding_cache import checkpoint_hash
+    return f"id:{model_id}" if model_id else f"sha256:{checkpoint_hash(model)}"
+
+
+def encode_texts(model, processor, device, texts, batch_size=256):
+    # L2-normalized CLIP text features, float32 (len(texts), D) on CPU.
+    feats = []
+    for start in range(0, len(texts), batch_size):
+        inputs = processor(text=list(texts[start:start + batch_size]), return_tensors="pt", padding=True, truncation=True)
+        inputs = {k: v.to(device) for k, v in inputs.items()}
+        with torch.inference_mode():
+            text_out = model.text_model(input_ids=inputs["input_ids"], attention_mask=inputs.get("attention_mask"))
+            f = model.text_projection(text_out.pooler_output)
+        feats.append((f / f.norm(dim=-1, keepdim=True)).float().cpu())
+    return torch.cat(feats)
+
+
+def cached_text_features(model, processor, device, texts, model_key, cache=None):
+    # float16 (len(texts), D) memmap of encode_texts, cached per model and exact prompt list.
+    from utils.embedding_cache import EmbeddingCache, cache_key
+    cache = cache or EmbeddingCache()
+    texts = list(texts)
+    key = cache_key(model=model_key, texts=texts)
+    dim = model.config.projection_dim
+
+    def fill(out):
+        out[:] = encode_texts(model, processor, device, texts).numpy()
+
+    return cache.get_or_build("clip_text", key, (len(texts), dim), fill, meta={"model": model_key, "texts": texts})
+
+
+def cached_image_features(model, processor, device, images, model_key, cache=None, dataset_key=None,
+                          batch_size=64, workers=2, prefetch_depth=4):
+    # float16 (N, D) memmap of L2-normalized image features, keyed by model, PREPROCESS_VERSION, the processor's
+    # resize/crop/normalization settings and the image bytes. dataset_key skips hashing the images when the caller
+    # already has a content hash (e.g. the packed store's manifest).
+    from utils.embedding_cache import EmbeddingCache, array_digest, cache_key
+    cache = cache or EmbeddingCache()
+    n = len(images)
+    dataset_key = dataset_key or array_digest(np.asarray(images))
+    key = cache_key(model=model_key, preprocess=PREPROCESS_VERSION, settings=_processor_settings(processor),
+                    dataset=dataset_key)
+    dim = model.config.projection_dim
+    pin_memory = torch.device(device).type == "cuda"
+
+    def fill(out):
+        t0 = time.perf_counter()
+        for start, end, pixel_values in prefetch_batches(images, processor, batch_size=batch_size, workers=workers,
+                                                         depth=prefetch_depth, pin_memory=pin_memory):
+            with torch.inference_mode():
+                vision_out = model.vision_model(pixel_values=pixel_values.to(device, non_blocking=pin_memory))
+                f = model.visual_projection(vision_out.pooler_output)
+            out[start:end] = (f / f.norm(dim=-1, keepdim=True)).float().cpu().numpy()
+        print(f"Encoded {n} images in {time.perf_counter() - t0:.1f}s (cached under {key[:12]})")
+
+    return cache.get_or_build("clip_image", key, (n, dim), fill,
+                              meta={"model": model_key, "preprocess": PREPROCESS_VERSION, "dataset": dataset_key})
+
+
+def zero_shot_predict(image_features, text_features):
+    # One matmul over cached (normalized) features; returns argmax class ids.
+    img = torch.from_numpy(np.asarray(image_features, dtype=np.float32))
+    txt = torch.as_tensor(np.asarray(text_features, dtype=np.float32))
+    return torch.argmax(img @ txt.T, dim=-1).numpy()
+
+
+def prompt_sweep(model, processor, device, image_features, y_true, labels, templates, model_key, cache=None):
+    # Accuracy per prompt template ("a photo of a {label}") against cached image features; no vision forward.
+    y_true = np.asarray(y_true)
+    if len(y_true) != len(image_features):
+        raise ValueError(f"y_true has {len(y_true)} labels but image_features has {len(image_features)} rows; "
+                         "the features were likely cached for a different image set")
+    results = {}
+    for template in templates:
+        text_features = cached_text_features(model, processor, device, [template.format(label=lbl) for lbl in labels],
+                                             model_key, cache=cache)
+        y_pred = zero_shot_predict(image_features, text_features)
+        results[template] = float((y_pred == y_true).mean())
+    return results
+
+
 def compute_metrics(y_true, y_pred, labels):
-    acc = accuracy_score(y_true, y_pred)
-    return {"top1_accuracy": float(acc)}
+    from utils.metrics import ConfusionMatrix
+    return {"top1_accuracy": ConfusionMatrix.from_predictions(y_true, y_pred, len(labels)).accuracy()}
+
+
+def load_cifar10_packed(split):
+    # Written by data_ingestion/clip_multimodal/run.py: contiguous NHWC uint8 images + int64 labels.
+    # mmap_mode="r" makes loading instant and lets several processes share the page cache.
+    from utils.paths import CACHE_PATH
+    packed_dir = CACHE_PATH / "clip_multimodal" / "packed"
+    images = np.load(packed_dir / f"{split}_images.npy", mmap_mode="r")
+    y_true = np.load(packed_dir / f"{split}_labels.npy", mmap_mode="r")
+    return images, y_true
+
+
+def load_cifar10_train():
+    return load_cifar10_packed("train")
 
 
 def load_cifar10_test():
     from utils.paths import CACHE_PATH
+    if (CACHE_PATH / "clip_multimodal" / "packed" / "test_images.npy").exists():
+        return load_cifar10_packed("test")
+    # Fallback for caches ingested before the packed store existed.
     raw_dir = CACHE_PATH / "clip_multimodal" / "raw" / "cifar-10-batches-py"
     test_batch_path = raw_dir / "test_batch"
     with open(test_batch_path, "rb") as f:
@@ -2,40 +2,349 @@ import numpy as np
 import torch
 import pandas as pd
 from transformers import AutoModelForSequenceClassification, AutoTokenizer
-from sklearn.metrics import accuracy_score, f1_score, confusion_matrix, classification_report
-
-
-def run_inference(model, tokenizer, device, test_df):
-    all_preds, all_labels = [], []
-    n = len(test_df)
-    print(f"Running inference on {n} samples...")
-    with torch.no_grad():
-        for i, (_, row) in enumerate(test_df.iterrows()):
-            if i % 100 == 0 or i == n - 1:
-                print(f"Sample {i+1}/{n}", flush=True)
-            inputs = tokenizer(
-                row['text'], return_tensors='pt', truncation=True, padding=True).to(device)
-            logits = model(**inputs).logits.cpu().numpy()[0]
-            pred = np.argmax(logits)
-            all_preds.append(pred)
-            all_labels.append(row['sentiment_value'])
-    return np.array(all_preds), np.array(all_labels)
+import contextlib
+import functools
+import io
 
 
-def compute_metrics(y_true, y_pred, labels):
-    acc = accuracy_score(y_true, y_pred)
-    f1 = f1_score(y_true, y_pred, average="macro")
-    cm = confusion_matrix(y_true, y_pred, labels=range(len(labels)))
-    report = classification_report(y_true, y_pred, labels=range(
-        len(labels)), target_names=labels, output_dict=True, zero_division=0)
+def tokenize_texts(tokenizer, texts, max_length=None, chunk_size=2048, workers=1):
+    # Fast tokenizers encode a whole list in parallel (Rust); no padding here, batches are padded later.
+    # workers > 1 also spreads chunks over threads (the Rust encoder releases the GIL).
+    chunks = [list(texts[start:start + chunk_size]) for start in range(0, len(texts), chunk_size)]
+
+    def encode(chunk):
+        return tokenizer(chunk, truncation=True, max_length=max_length, padding=False,
+                         return_attention_mask=False)["input_ids"]
+
+    if workers > 1 and len(chunks) > 1:
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            encoded = list(pool.map(encode, chunks))
+    else:
+        encoded = [encode(chunk) for chunk in chunks]
+    return [ids for chunk in encoded for ids in chunk]
+
+
+def _token_lengths(input_ids):
+    lengths = getattr(input_ids, "lengths", None)
+    if lengths is not None:
+        return np.asarray(lengths, dtype=np.int64)
+    return np.array([len(ids) for ids in input_ids], dtype=np.int64)
+
+
+def _check_tokenized(tokenized, n):
+    # A TokenizedTexts built for another frame would silently misalign predictions and labels.
+    if len(tokenized) != n:
+        raise ValueError(f"tokenized has {len(tokenized)} rows but there are {n} texts; "
+                         "it was likely cached for a different dataset")
+
+
+def pad_batch(input_ids, lengths, idx, pad_id, left=False):
+    # (len(idx), longest) input_ids / attention_mask tensors for one bucket, padded on the tokenizer's side.
+    longest = int(lengths[idx].max())
+    ids = np.full((len(idx), longest), pad_id, dtype=np.int64)
+    mask = np.zeros((len(idx), longest), dtype=np.int64)
+    for row, i in enumerate(idx):
+        cols = slice(longest - lengths[i], longest) if left else slice(0, lengths[i])
+        ids[row, cols] = input_ids[i]
+        mask[row, cols] = 1
+    return torch.from_numpy(ids), torch.from_numpy(mask)
+
+
+def run_inference(model, tokenizer, device, test_df, batch_size=64, max_tokens=16384, max_length=None,
+                  return_logits=False, log_every=20, tokenized=None, metrics=None, cpu_mode=None):
+    # Tokenize everything up front, sort by token length and run padded batches under a max_tokens budget.
+    # Outputs are in test_df row order; with return_logits=True also returns an (n, num_labels) float32 array.
+    # tokenized: a TokenizedTexts for test_df's rows (see cached_tokenize) to skip tokenization.
+    # metrics: optional utils.metrics.ConfusionMatrix, updated per batch and shown in the progress lines.
+    # cpu_mode: "int8", "bf16", "compile", ... or a CPUInferenceConfig (utils/cpu_inference.py); None = fp32 eager.
+    from utils.batching import length_buckets
+    texts = test_df['text'].tolist()
+    all_labels = test_df['sentiment_value'].to_numpy()
+    n = len(texts)
+    if tokenized is None:
+        print(f"Tokenizing {n} samples...")
+        input_ids = tokenize_texts(tokenizer, texts, max_length=max_length)
+    else:
+        _check_tokenized(tokenized, n)
+        input_ids = tokenized
+    lengths = _token_lengths(input_ids)
+    batches = length_buckets(lengths, batch_size, max_padded=max_tokens)
+    pad_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else 0
+    left = getattr(tokenizer, "padding_side", "right") == "left"
+    all_preds = np.empty(n, dtype=np.int64)
+    all_logits = None
+    autocast = contextlib.nullcontext
+    threads = contextlib.nullcontext()
+    if cpu_mode is not None:
+        from utils.cpu_inference import autocast as cpu_autocast, cpu_threads, prepare_model
+        model = prepare_model(model, cpu_mode)
+        autocast = lambda: cpu_autocast(cpu_mode)  # noqa: E731
+        threads = cpu_threads(cpu_mode)  # the mode's thread count for this call only
+    print(f"Running inference on {n} samples in {len(batches)} batches...")
+    model.eval()
+    with threads, torch.inference_mode(), autocast():
+        for b, idx in enumerate(batches, start=1):
+            ids, mask = pad_batch(input_ids, lengths, idx, pad_id, left)
+            logits = model(input_ids=ids.to(device), attention_mask=mask.to(device)).logits
+            all_preds[idx] = logits.argmax(dim=-1).cpu().numpy()
+            if metrics is not None:
+                metrics.update(all_labels[idx], all_preds[idx])
+            if return_logits:
+                if all_logits is None:
+                    all_logits = np.empty((n, logits.shape[-1]), dtype=np.float32)
+                all_logits[idx] = logits.float().cpu().numpy()
+            if b % log_every == 0 or b == len(batches):
+                live = f" | {metrics}" if metrics is not None else ""
+                print(f"Batch {b}/{len(batches)} ({sum(map(len, batches[:b]))}/{n} samples){live}", flush=True)
+    if return_logits:
+        return all_preds, all_labels, all_logits
+    return all_preds, all_labels
+
+
+def _infer_shard(shared_model, tokenizer, test_df, tokenized, kwargs, idx):
+    shard_tokens = [tokenized[i] for i in idx] if tokenized is not None else None
+    with contextlib.redirect_stdout(io.StringIO()):
+        return run_inference(shared_model.model, tokenizer, "cpu", test_df.iloc[idx], tokenized=shard_tokens, **kwargs)
+
+
+def run_inference_sharded(model, tokenizer, test_df, processes=None, threads=None, batch_size=64, max_tokens=16384,
+                          max_length=None, return_logits=False, tokenized=None, metrics=None, cpu_mode=None,
+                          baseline_s=None, start_method=None):
+    # run_inference over `processes` CPU worker processes with `threads` torch threads each (utils/sharded.py;
+    # default: 4 threads per process, as many processes as there are cores for). Shards are balanced on token
+    # length (character length without `tokenized`); outputs come back in test_df row order as from
+    # run_inference, plus a ScalingReport (pass the wall time of a single-process run as baseline_s to get
+    # speedup/efficiency). The model's weights are moved to shared memory and a cached TokenizedTexts is
+    # reopened from disk in each worker, so neither is copied per process.
+    from utils.cpu_inference import with_threads
+    from utils.sharded import SharedModel, default_layout, run_sharded
+    if tokenized is not None:
+        _check_tokenized(tokenized, len(test_df))
+        costs = _token_lengths(tokenized)
+    else:
+        costs = test_df['text'].str.len().to_numpy()
+    processes, threads = default_layout(processes, threads)
+    shared_model = SharedModel(model.eval())
+    # Each worker prepares cpu_mode itself (compiled modules cannot be sent to another process).
+    kwargs = dict(batch_size=batch_size, max_tokens=max_tokens, max_length=max_length, return_logits=return_logits,
+                  log_every=10**9, cpu_mode=with_threads(cpu_mode, threads))
+    on_shard = None
+    if metrics is not None:
+        on_shard = lambda idx, out: metrics.update(out[1], out[0])  # noqa: E731
+    outputs, report = run_sharded(functools.partial(_infer_shard, shared_model, tokenizer, test_df, tokenized, kwargs),
+                                  len(test_df), processes=processes, threads=threads, costs=costs,
+                                  baseline_s=baseline_s, start_method=start_method, on_shard=on_shard)
+    print(report)
+    return (*outputs, report)
+
+
+def embed_texts(model, tokenizer, device, texts, pooling="mean", batch_size=64, max_tokens=16384, max_length=None,
+                out=None, log_every=50, tokenized=None):
+    # Pooled encoder outputs (no classification head), float32 (n, hidden) in input order or written into `out`.
+    # Works with a *ForSequenceClassification model (uses model.base_model) or a bare AutoModel.
+    # pooling: "cls" = first token's hidden state, "mean" = attention-masked mean over tokens.
+    from utils.batching import length_buckets
+    if pooling not in ("cls", "mean"):
+        raise ValueError(f"Unknown pooling: {pooling!r} (expected 'cls' or 'mean')")
+    encoder = getattr(model, "base_model", model)
+    n = len(texts)
+    if tokenized is not None:
+        _check_tokenized(tokenized, n)
+    input_ids = tokenized if tokenized is not None else tokenize_texts(tokenizer, texts, max_length=max_length)
+    lengths = _token_lengths(input_ids)
+    batches = length_buckets(lengths, batch_size, max_padded=max_tokens)
+    pad_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else 0
+    left = getattr(tokenizer, "padding_side", "right") == "left"
+    if out is None:
+        out = np.empty((n, encoder.config.hidden_size), dtype=np.float32)
+    encoder.eval()
+    with torch.inference_mode():
+        for b, idx in enumerate(batches, start=1):
+            ids, mask = pad_batch(input_ids, lengths, idx, pad_id, left)
+            ids, mask = ids.to(device), mask.to(device)
+            hidden = encoder(input_ids=ids, attention_mask=mask).last_hidden_state
+            if pooling == "cls":
+                # With left padding each row's first real token ([CLS]) sits after its own padding. (Models with
+                # absolute position embeddings still see shifted positions there; BERT-family tokenizers pad right.)
+                first = torch.from_numpy(hidden.shape[1] - lengths[idx]).to(device) if left else 0
+                pooled = hidden[torch.arange(len(idx), device=device), first]
+            else:
+                m = mask.unsqueeze(-1).to(hidden.dtype)
+                pooled = (hidden * m).sum(dim=1) / m.sum(dim=1).clamp(min=1)
+            out[idx] = pooled.float().cpu().numpy()
+            if b % log_every == 0 or b == len(batches):
+                print(f"Embedded batch {b}/{len(batches)} ({sum(map(len, batches[:b]))}/{n} texts)", flush=True)
+    return out
+
+
+def texts_digest(texts):
+    # Content hash of a list of reviews; PackedTexts hashes its blob + offsets directly.
+    import hashlib
+    from utils.embedding_cache import array_digest
+    if isinstance(texts, PackedTexts):
+        return array_digest(np.asarray(texts.offsets)) + array_digest(np.asarray(texts.blob))
+    h = hashlib.sha256()
+    for t in texts:
+        b = t.encode("utf-8")
+        h.update(len(b).to_bytes(8, "little") + b)
+    return h.hexdigest()
+
+
+def cached_embeddings(model, tokenizer, device, texts, model_key=None, dataset_key=None, pooling="mean",
+                      max_length=512, cache=None, **kwargs):
+    # float16 (n, hidden) memmap of embed_texts, stored in the shared embedding cache (.cache/embeddings/).
+    # model_key: hub id / checkpoint path; None hashes the weights (needed after fine-tuning in memory).
+    from utils.embedding_cache import EmbeddingCache, cache_key, checkpoint_hash
+    cache = cache or EmbeddingCache()
+    model_key = f"id:{model_key}" if model_key else f"sha256:{checkpoint_hash(model)}"
+    dataset_key = dataset_key or texts_digest(texts)
+    key = cache_key(model=model_key, tokenizer=getattr(tokenizer, "name_or_path", ""), vocab=len(tokenizer),
+                    pooling=pooling, max_length=max_length, dataset=dataset_key)
+    encoder = getattr(model, "base_model", model)
+
+    def fill(out):
+        embed_texts(model, tokenizer, device, texts, pooling=pooling, max_length=max_length, out=out, **kwargs)
+
+    return cache.get_or_build("sentiment_embeddings", key, (len(texts), encoder.config.hidden_size), fill,
+                              meta={"model": model_key, "pooling": pooling, "max_length": max_length,
+                                    "dataset": dataset_key})
+
+
+def train_linear_probe(x_train, y_train, C=1.0, max_iter=1000):
+    # Standardize + logistic regression on frozen embeddings; rows labelled -1 (IMDB unsup) are ignored.
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.pipeline import make_pipeline
+    from sklearn.preprocessing import StandardScaler
+    y_train = np.asarray(y_train)
+    keep = y_train >= 0
+    x = np.asarray(x_train, dtype=np.float32)[keep]
+    probe = make_pipeline(StandardScaler(), LogisticRegression(C=C, max_iter=max_iter))
+    probe.fit(x, y_train[keep])
+    return probe
+
+
+def probe_predict(probe, x):
+    return probe.predict(np.asarray(x, dtype=np.float32))
+
+
+def _npy_path(arr):
+    # The .npy file arr is the whole memory-mapped array of, or None (in-memory arrays and slices of a memmap).
+    path = getattr(arr, "filename", None)
+    if path is None:
+        return None
+    try:
+        whole = np.load(path, mmap_mode="r")
+    except (OSError, ValueError):
+        return None
+    return path if whole.shape == arr.shape and whole.dtype == arr.dtype else None
+
+
+def _open_tokenized(input_ids_path, offsets_path, lengths_path):
+    return TokenizedTexts(*(np.load(p, mmap_mode="r") for p in (input_ids_path, offsets_path, lengths_path)))
+
+
+class TokenizedTexts:
+    # input_ids of every text concatenated in one int32 array; text i is input_ids[offsets[i]:offsets[i + 1]].
+    def __init__(self, input_ids, offsets, lengths):
+        self.input_ids = input_ids
+        self.offsets = offsets
+        self.lengths = lengths
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def __getitem__(self, i):
+        return self.input_ids[self.offsets[i]:self.offsets[i + 1]]
+
+    def __reduce__(self):
+        # Memory-mapped arrays (cached_tokenize) are pickled as their .npy paths and reopened, not copied.
+        arrays = (self.input_ids, self.offsets, self.lengths)
+        paths = [_npy_path(a) for a in arrays]
+        if all(paths):
+            return _open_tokenized, tuple(paths)
+        return TokenizedTexts, arrays
+
+    def to_dataset(self, labels=None):
+        # datasets.Dataset with an input_ids column (plus "labels") built zero-copy on the arrays; pad it with
+        # DataCollatorWithPadding, which also adds the attention_mask.
+        import pyarrow as pa
+        from datasets import Dataset
+        ids = pa.LargeListArray.from_arrays(pa.array(np.asarray(self.offsets), type=pa.int64()),
+                                            pa.array(np.asarray(self.input_ids)))
+        columns = {"input_ids": ids}
+        if labels is not None:
+            columns["labels"] = pa.array(np.asarray(labels, dtype=np.int64))
+        return Dataset(pa.table(columns))
+
+
+def tokenizer_fingerprint(tokenizer):
+    # What decides the token ids: tokenizer name/class, a hash of the vocabulary and the special tokens.
+    import hashlib
+    vocab = sorted(tokenizer.get_vocab().items())
+    vocab_hash = hashlib.sha256("\n".join(f"{tok}\t{i}" for tok, i in vocab).encode("utf-8")).hexdigest()
     return {
-        "accuracy": float(acc),
-        "f1_macro": float(f1),
-        "confusion_matrix": cm.tolist(),
-        "classification_report": report
+        "name": getattr(tokenizer, "name_or_path", ""),
+        "class": type(tokenizer).__name__,
+        "vocab_sha256": vocab_hash,
+        "special_tokens": {k: str(v) for k, v in sorted(tokenizer.special_tokens_map.items())},
+        "truncation_side": getattr(tokenizer, "truncation_side", "right"),
     }
 
 
+def cached_tokenize(tokenizer, texts, max_length=256, dataset_key=None, workers=None, cache_dir=None):
+    # TokenizedTexts for texts, memory-mapped from .cache/sentiment_embeddings/tokenized/<key>/ after the first run.
+    # The key covers tokenizer_fingerprint, truncation (max_length) and a content hash of the texts.
+    import json
+    import os
+    import shutil
+    from utils.embedding_cache import cache_key
+    if cache_dir is None:
+        from utils.paths import CACHE_PATH
+        cache_dir = CACHE_PATH / "sentiment_embeddings" / "tokenized"
+    dataset_key = dataset_key or texts_digest(texts)
+    key = cache_key(tokenizer=tokenizer_fingerprint(tokenizer), truncation=True, max_length=max_length,
+                    dataset=dataset_key)
+    entry = cache_dir / key
+    try:
+        return TokenizedTexts(np.load(entry / "input_ids.npy", mmap_mode="r"),
+                              np.load(entry / "offsets.npy", mmap_mode="r"),
+                              np.load(entry / "lengths.npy", mmap_mode="r"))
+    except (OSError, ValueError):
+        pass
+
+    input_ids = tokenize_texts(tokenizer, texts, max_length=max_length, workers=workers or os.cpu_count() or 1)
+    lengths = np.fromiter((len(ids) for ids in input_ids), dtype=np.int32, count=len(input_ids))
+    offsets = np.zeros(len(input_ids) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    tmp = cache_dir / f".{key}.{os.getpid()}.tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+    try:
+        flat = np.lib.format.open_memmap(tmp / "input_ids.npy", mode="w+", dtype=np.int32, shape=(int(offsets[-1]),))
+        for i, ids in enumerate(input_ids):
+            flat[offsets[i]:offsets[i + 1]] = ids
+        flat.flush()
+        del flat
+        np.save(tmp / "offsets.npy", offsets)
+        np.save(tmp / "lengths.npy", lengths)
+        (tmp / "meta.json").write_text(json.dumps({"max_length": max_length, "dataset": dataset_key,
+                                                   "tokenizer": tokenizer_fingerprint(tokenizer)}, indent=2) + "\n",
+                                       encoding="utf-8")
+        shutil.rmtree(entry, ignore_errors=True)
+        os.replace(tmp, entry)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    return cached_tokenize(tokenizer, texts, max_length=max_length, dataset_key=dataset_key, cache_dir=cache_dir)
+
+
+def compute_metrics(y_true, y_pred, labels):
+    # Same values as sklearn's accuracy/f1/confusion_matrix/classification_report, derived from one confusion matrix.
+    from utils.metrics import ConfusionMatrix
+    return ConfusionMatrix.from_predictions(y_true, y_pred, len(labels)).metrics(labels)
+
+
 def find_hf_model_dir(root_dir):
     import os
     import json
@@ -47,3 +356,62 @@ def find_hf_model_dir(root_dir):
             if 'model_type' in config:
                 return dirpath
     raise FileNotFoundError('No valid Hugging Face model directory found.')
+
+
+class PackedTexts:
+    # Lazy view over <split>_text.bin written by data_ingestion/sentiment_embeddings/run.py ([pack] enabled).
+    # Review i is blob[offsets[i]:offsets[i + 1]]; only the reviews you index are decoded.
+    def __init__(self, blob, offsets):
+        self.blob = blob
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return bytes(self.blob[self.offsets[i]:self.offsets[i + 1]]).decode("utf-8")
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+def _packed_imdb_dir():
+    from utils.paths import CACHE_PATH
+    return CACHE_PATH / "sentiment_embeddings" / "packed"
+
+
+def _open_packed_imdb(split):
+    packed_dir = _packed_imdb_dir()
+    blob_path = packed_dir / f"{split}_text.bin"
+    blob = np.memmap(blob_path, dtype=np.uint8, mode="r") if blob_path.stat().st_size else np.zeros(0, np.uint8)
+    offsets = np.load(packed_dir / f"{split}_offsets.npy", mmap_mode="r")
+    labels = np.load(packed_dir / f"{split}_labels.npy", mmap_mode="r")
+    return blob, offsets, labels
+
+
+def load_imdb_packed(split):
+    # split: "train", "test" or "unsup"; labels are 1 pos, 0 neg, -1 unsup.
+    blob, offsets, labels = _open_packed_imdb(split)
+    return PackedTexts(blob, offsets), labels
+
+
+def load_imdb_arrow(split):
+    # Zero-copy pyarrow LargeStringArray over the memory-mapped blob (int64 offsets share the uint64 buffer).
+    import pyarrow as pa
+    blob, offsets, labels = _open_packed_imdb(split)
+    texts = pa.LargeStringArray.from_buffers(
+        len(labels), pa.py_buffer(np.asarray(offsets).view(np.int64)), pa.py_buffer(blob))
+    return texts, labels
+
+
+def load_imdb_dataframe(split):
+    # Same columns as the notebook's load_dataset(): text, sentiment_value.
+    texts, labels = load_imdb_packed(split)
+    return pd.DataFrame({"text": list(texts), "sentiment_value": np.asarray(labels)})
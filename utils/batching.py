@@ -0,0 +1,36 @@
+from __future__ import annotations
+
+from collections.abc import Sequence
+
+import numpy as np
+
+
+def length_buckets(
+    lengths: Sequence[int] | np.ndarray,
+    batch_size: int,
+    max_padded: int | None = None,
+    *,
+    exact: bool = False,
+) -> list[list[int]]:
+    """Item indices sorted by length and cut into batches of at most batch_size.
+
+    max_padded caps batch rows * longest item, i.e. the padded size of a batch
+    (samples for audio, tokens for text). exact=True only batches items of
+    identical length, for models whose outputs change with any padding.
+    """
+    lengths = np.asarray(lengths)
+    batches: list[list[int]] = []
+    cur: list[int] = []
+    cur_max = 0
+    for i in np.argsort(lengths, kind="stable"):
+        n = int(lengths[i])
+        longest = max(cur_max, n)
+        if cur and (len(cur) >= batch_size or (exact and n != cur_max)
+                    or (max_padded is not None and longest * (len(cur) + 1) > max_padded)):
+            batches.append(cur)
+            cur, longest = [], n
+        cur.append(int(i))
+        cur_max = longest
+    if cur:
+        batches.append(cur)
+    return batches
@@ -0,0 +1,259 @@
+from __future__ import annotations
+
+import contextlib
+import os
+import time
+import warnings
+import weakref
+from collections.abc import Callable, Iterator, Sequence
+from dataclasses import dataclass, replace
+from pathlib import Path
+from typing import Final
+
+from utils.paths import CACHE_PATH
+
+COMPILE_CACHE_PATH: Final[Path] = CACHE_PATH / "torch_compile"
+
+
+@dataclass(frozen=True)
+class CPUInferenceConfig:
+    """How run_inference executes a model on CPU; the default is plain fp32 eager.
+
+    quantize: dynamic int8 quantization of nn.Linear weights (activations are
+    quantized per batch at run time). bf16: autocast to bfloat16; "auto" enables
+    it only when the CPU has native bf16 support. compile: torch.compile with
+    the inductor FX graph cache under .cache/torch_compile, so later sessions
+    skip most of the compile time. threads / interop_threads: torch intra-op and
+    inter-op pool sizes, applied by cpu_threads for the duration of one
+    inference run. threads=None means default_threads() for every mode except
+    plain fp32, which leaves torch's setting alone.
+    """
+
+    quantize: bool = False
+    bf16: bool | str = False
+    compile: bool = False
+    compile_mode: str | None = None
+    threads: int | None = None
+    interop_threads: int | None = None
+
+    def __post_init__(self) -> None:
+        if self.bf16 not in (True, False, "auto"):
+            raise ValueError(f"bf16 must be True, False or 'auto' (got {self.bf16!r})")
+        if self.quantize and self.bf16 is True:
+            raise ValueError("quantize and bf16 cannot be combined: dynamic int8 Linear layers expect fp32 inputs")
+
+
+MODES: Final[dict[str, CPUInferenceConfig]] = {
+    "fp32": CPUInferenceConfig(),
+    "int8": CPUInferenceConfig(quantize=True),
+    "bf16": CPUInferenceConfig(bf16=True),
+    "compile": CPUInferenceConfig(compile=True),
+    "int8+compile": CPUInferenceConfig(quantize=True, compile=True),
+    "bf16+compile": CPUInferenceConfig(bf16=True, compile=True),
+}
+
+
+def resolve_mode(mode: str | CPUInferenceConfig | None) -> CPUInferenceConfig:
+    if mode is None:
+        return MODES["fp32"]
+    if isinstance(mode, CPUInferenceConfig):
+        return mode
+    try:
+        return MODES[mode]
+    except KeyError:
+        raise ValueError(f"Unknown CPU inference mode: {mode!r} (expected one of {sorted(MODES)})") from None
+
+
+def with_threads(mode: str | CPUInferenceConfig | None, threads: int) -> CPUInferenceConfig | None:
+    """mode with an explicit thread count, for callers that size the thread pool themselves (sharded workers)."""
+    return None if mode is None else replace(resolve_mode(mode), threads=threads)
+
+
+def cpu_supports_bf16() -> bool:
+    """True when oneDNN reports native bf16 kernels (AVX512-BF16 / AMX); emulated bf16 is usually slower than fp32."""
+    import torch
+
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except (AttributeError, RuntimeError):
+        return False
+
+
+def configure_threads(threads: int | None = None, interop_threads: int | None = None) -> None:
+    import torch
+
+    if threads is not None:
+        torch.set_num_threads(max(1, threads))
+    if interop_threads is not None:
+        try:
+            torch.set_num_interop_threads(max(1, interop_threads))
+        except RuntimeError:
+            # Only settable before the first inter-op parallel work in the process.
+            pass
+
+
+def _resolved_threads(config: CPUInferenceConfig) -> int | None:
+    if config.threads is None and config != MODES["fp32"]:
+        return default_threads()
+    return config.threads
+
+
+@contextlib.contextmanager
+def cpu_threads(mode: str | CPUInferenceConfig | None = None) -> Iterator[None]:
+    """Apply the mode's thread settings inside the block, then restore torch's intra-op thread count.
+
+    The inter-op pool can only be sized once per process, so interop_threads is not undone.
+    """
+    import torch
+
+    config = resolve_mode(mode)
+    previous = torch.get_num_threads()
+    configure_threads(_resolved_threads(config), config.interop_threads)
+    try:
+        yield
+    finally:
+        torch.set_num_threads(previous)
+
+
+def default_threads() -> int:
+    """Physical-ish core count: hyper-threads rarely help GEMM-bound inference."""
+    try:
+        n = len(os.sched_getaffinity(0))
+    except AttributeError:  # pragma: no cover - non-Linux
+        n = os.cpu_count() or 1
+    return max(1, n // 2) if n >= 4 else n
+
+
+def _quantize_dynamic(model):
+    import torch
+
+    try:
+        from torch.ao.quantization import quantize_dynamic
+    except ImportError as exc:  # pragma: no cover - removed in future torch releases
+        raise RuntimeError("Dynamic int8 quantization needs torch.ao.quantization (or port this to torchao)") from exc
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", DeprecationWarning)
+        warnings.simplefilter("ignore", UserWarning)
+        return quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def _enable_compile_cache() -> None:
+    os.environ.setdefault("TORCHINDUCTOR_CACHE_DIR", str(COMPILE_CACHE_PATH))
+    try:
+        import torch._inductor.config as inductor_config
+
+        inductor_config.fx_graph_cache = True
+    except ImportError:  # pragma: no cover - builds without inductor
+        pass
+
+
+# Prepared (quantized / compiled) copies per source model, so repeated run_inference calls reuse them.
+_PREPARED: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+
+def prepare_model(model, mode: str | CPUInferenceConfig | None = None, *, compile_modules: Sequence[str] = ()):
+    """The model to run for mode: int8-quantized and/or compiled, cached per (model, mode).
+
+    Thread settings are not touched here; run the model under cpu_threads(mode).
+
+    compile_modules names submodules to compile in place of the whole model,
+    for callers that invoke a submodule directly (CLIP's vision_model).
+    The original model is never modified.
+    """
+    config = resolve_mode(mode)
+    if not config.quantize and not config.compile:
+        return model
+    key = (replace(config, threads=None, interop_threads=None), tuple(compile_modules))
+    cache = _PREPARED.setdefault(model, {})
+    if key in cache:
+        return cache[key]
+
+    prepared = model
+    if config.quantize:
+        prepared = _quantize_dynamic(prepared)  # returns a copy
+    if config.compile:
+        import copy
+
+        _enable_compile_cache()
+        if prepared is model:
+            prepared = copy.deepcopy(model)
+        targets = [prepared.get_submodule(name) for name in compile_modules] or [prepared]
+        for module in targets:
+            module.compile(mode=config.compile_mode, dynamic=True)
+    prepared.eval()
+    cache[key] = prepared
+    return prepared
+
+
+@contextlib.contextmanager
+def autocast(mode: str | CPUInferenceConfig | None = None) -> Iterator[None]:
+    """bf16 autocast on CPU when the mode asks for it (and, for "auto", the CPU supports it)."""
+    import torch
+
+    config = resolve_mode(mode)
+    use_bf16 = config.bf16 is True or (config.bf16 == "auto" and not config.quantize and cpu_supports_bf16())
+    if not use_bf16:
+        yield
+        return
+    with torch.autocast(device_type="cpu", dtype=torch.bfloat16):
+        yield
+
+
+def _default_metric(metrics: dict) -> str:
+    if "accuracy" in metrics:
+        return "accuracy"
+    for name, value in metrics.items():
+        if isinstance(value, float):
+            return name
+    raise ValueError(f"compute_metrics returned no float metric to compare (has {sorted(metrics)})")
+
+
+def parity_report(
+    evaluate: Callable[[str | CPUInferenceConfig], tuple],
+    compute_metrics: Callable,
+    labels: Sequence[str],
+    modes: Sequence[str | CPUInferenceConfig] = tuple(MODES),
+    *,
+    metric: str | None = None,
+    threads: int | None = None,
+) -> dict:
+    """Run evaluate(mode) -> (y_true, y_pred) per mode and compare compute_metrics against fp32.
+
+    Each row has the mode's metrics, wall time, speedup and the change of
+    `metric` against the fp32 run (which always goes first and is the reference).
+    metric=None picks "accuracy" when compute_metrics returns it, else its
+    first float-valued entry (CLIP's "top1_accuracy").
+    Every mode that does not set its own thread count, fp32 included, runs
+    with `threads` (default_threads() when None), so speedup compares modes
+    rather than thread counts; evaluate() receives the mode as a
+    CPUInferenceConfig with threads filled in.
+    Compiled modes include their compile time unless evaluate() warms up first
+    (or the graph cache is already populated).
+    """
+    threads = threads if threads is not None else default_threads()
+    rows = {}
+    reference = None
+    for mode in ["fp32", *[m for m in modes if m != "fp32"]]:
+        name = mode if isinstance(mode, str) else repr(mode)
+        config = resolve_mode(mode)
+        if config.threads is None:
+            config = replace(config, threads=threads)
+        t0 = time.perf_counter()
+        y_true, y_pred = evaluate(config)[:2]
+        seconds = time.perf_counter() - t0
+        metrics = compute_metrics(y_true, y_pred, labels)
+        if metric is None:
+            metric = _default_metric(metrics)
+        elif metric not in metrics:
+            raise ValueError(f"compute_metrics returned no {metric!r} (has {sorted(metrics)})")
+        value = float(metrics[metric])
+        if reference is None:
+            reference = (value, seconds)
+        rows[name] = {
+            metric: value,
+            f"{metric}_delta": round(value - reference[0], 6),
+            "seconds": round(seconds, 3),
+            "speedup": round(reference[1] / seconds, 3) if seconds > 0 else None,
+            "metrics": metrics,
+        }
+    return {"reference": "fp32", "metric": metric, "threads": threads, "modes": rows}
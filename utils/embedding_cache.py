@@ -0,0 +1,166 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import shutil
+import time
+from collections.abc import Callable
+from pathlib import Path
+from typing import Final
+
+import numpy as np
+
+from utils.paths import CACHE_PATH
+
+EMBEDDING_CACHE_PATH: Final[Path] = CACHE_PATH / "embeddings"
+DEFAULT_MAX_BYTES: Final[int] = 4 << 30
+_FEATURES: Final[str] = "features.npy"
+_META: Final[str] = "meta.json"
+
+
+def cache_key(**parts: object) -> str:
+    """Stable hex key for a set of JSON-serializable key components (order-independent)."""
+    blob = json.dumps(parts, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+def array_digest(arr: np.ndarray) -> str:
+    """sha256 of an array's dtype, shape and bytes (works on memmaps without a full copy)."""
+    arr = np.ascontiguousarray(arr)
+    h = hashlib.sha256(f"{arr.dtype.str}{arr.shape}".encode("ascii"))
+    flat = arr.reshape(-1).view(np.uint8)
+    step = 64 << 20
+    for start in range(0, len(flat), step):
+        h.update(flat[start:start + step])
+    return h.hexdigest()
+
+
+def checkpoint_hash(model) -> str:
+    """sha256 over a torch module's state_dict (names, dtypes, shapes and values).
+
+    Distinguishes a fine-tuned model from the checkpoint it was loaded from,
+    which the model id alone does not.
+    """
+    import torch
+
+    h = hashlib.sha256()
+    for name, tensor in sorted(model.state_dict().items()):
+        t = tensor.detach().cpu().contiguous()
+        h.update(f"{name}\0{t.dtype}\0{tuple(t.shape)}\0".encode("utf-8"))
+        if t.numel():
+            # Byte view, so dtypes numpy lacks (bfloat16) hash too.
+            h.update(t.reshape(-1).view(torch.uint8).numpy())
+    return h.hexdigest()
+
+
+class EmbeddingCache:
+    """Feature matrices on disk as float16 .npy files, one directory per key.
+
+    get() returns a read-only memmap. Entries are written to a temporary
+    directory and renamed into place, so readers never see a partial entry.
+    After each write, least-recently-used entries are removed until the cache
+    fits in max_bytes (the entry just written is always kept).
+    """
+
+    def __init__(self, root: Path = EMBEDDING_CACHE_PATH, *, max_bytes: int | None = DEFAULT_MAX_BYTES) -> None:
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+
+    def _entry(self, namespace: str, key: str) -> Path:
+        return self.root / namespace / key
+
+    def get(self, namespace: str, key: str) -> np.ndarray | None:
+        entry = self._entry(namespace, key)
+        try:
+            features = np.load(entry / _FEATURES, mmap_mode="r")
+            os.utime(entry / _META)  # last-used stamp for eviction
+        except (OSError, ValueError):
+            return None
+        return features
+
+    def meta(self, namespace: str, key: str) -> dict | None:
+        try:
+            return json.loads((self._entry(namespace, key) / _META).read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+
+    def build(
+        self,
+        namespace: str,
+        key: str,
+        shape: tuple[int, int],
+        fill: Callable[[np.ndarray], None],
+        *,
+        meta: dict | None = None,
+    ) -> np.ndarray:
+        """Create an entry by letting fill() write rows into a float16 memmap of the given shape."""
+        entry = self._entry(namespace, key)
+        tmp = entry.with_name(f".{key}.{os.getpid()}.tmp")
+        shutil.rmtree(tmp, ignore_errors=True)
+        tmp.mkdir(parents=True)
+        try:
+            out = np.lib.format.open_memmap(tmp / _FEATURES, mode="w+", dtype=np.float16, shape=shape)
+            fill(out)
+            out.flush()
+            del out
+            record = {"key": key, "namespace": namespace, "shape": list(shape), "created": time.time(),
+                      **(meta or {})}
+            (tmp / _META).write_text(json.dumps(record, indent=2, sort_keys=True, default=str) + "\n",
+                                     encoding="utf-8")
+            shutil.rmtree(entry, ignore_errors=True)
+            os.replace(tmp, entry)
+        except BaseException:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+        self.evict(keep=entry)
+        return np.load(entry / _FEATURES, mmap_mode="r")
+
+    def get_or_build(
+        self,
+        namespace: str,
+        key: str,
+        shape: tuple[int, int],
+        fill: Callable[[np.ndarray], None],
+        *,
+        meta: dict | None = None,
+    ) -> np.ndarray:
+        features = self.get(namespace, key)
+        if features is not None and features.shape == tuple(shape):
+            return features
+        return self.build(namespace, key, shape, fill, meta=meta)
+
+    def entries(self) -> list[tuple[Path, int, float]]:
+        """(entry dir, bytes, last used) for every complete entry."""
+        found = []
+        for meta_path in self.root.glob(f"*/*/{_META}"):
+            entry = meta_path.parent
+            if entry.name.startswith("."):
+                continue
+            try:
+                size = sum(p.stat().st_size for p in entry.iterdir())
+                found.append((entry, size, meta_path.stat().st_mtime))
+            except OSError:
+                continue
+        return found
+
+    def size_bytes(self) -> int:
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self, max_bytes: int | None = None, *, keep: Path | None = None) -> list[Path]:
+        """Delete least-recently-used entries until the cache is at most max_bytes."""
+        limit = self.max_bytes if max_bytes is None else max_bytes
+        if limit is None:
+            return []
+        entries = sorted(self.entries(), key=lambda e: e[2])
+        total = sum(size for _, size, _ in entries)
+        removed = []
+        for entry, size, _ in entries:
+            if total <= limit:
+                break
+            if keep is not None and entry == keep:
+                continue
+            shutil.rmtree(entry, ignore_errors=True)
+            removed.append(entry)
+            total -= size
+        return removed
@@ -0,0 +1,103 @@
+from __future__ import annotations
+
+from collections.abc import Sequence
+
+import numpy as np
+
+
+class ConfusionMatrix:
+    """Classification metrics from an incrementally updated confusion matrix.
+
+    update() folds in one batch with a single np.bincount, so predictions do
+    not have to be kept around. Everything else is derived from the matrix and
+    matches sklearn (accuracy_score, f1_score(average="macro"),
+    confusion_matrix(labels=range(k)) and classification_report(...,
+    output_dict=True, zero_division=0)). Labels must lie in [0, num_classes):
+    sklearn's confusion_matrix would silently drop other samples while
+    accuracy_score counts them, so update() raises instead.
+    """
+
+    def __init__(self, num_classes: int) -> None:
+        self.num_classes = num_classes
+        self.matrix = np.zeros((num_classes, num_classes), dtype=np.int64)
+
+    @classmethod
+    def from_predictions(cls, y_true, y_pred, num_classes: int) -> ConfusionMatrix:
+        cm = cls(num_classes)
+        cm.update(y_true, y_pred)
+        return cm
+
+    def update(self, y_true, y_pred) -> None:
+        t = np.asarray(y_true, dtype=np.int64).ravel()
+        p = np.asarray(y_pred, dtype=np.int64).ravel()
+        if t.shape != p.shape:
+            raise ValueError(f"y_true and y_pred differ in length: {t.shape[0]} != {p.shape[0]}")
+        k = self.num_classes
+        bad = (t < 0) | (t >= k) | (p < 0) | (p >= k)
+        if bad.any():
+            i = int(np.argmax(bad))
+            raise ValueError(f"{int(bad.sum())} label(s) outside [0, {k}), e.g. y_true={t[i]}, y_pred={p[i]} at {i}")
+        self.matrix += np.bincount(t * k + p, minlength=k * k).reshape(k, k)
+
+    @property
+    def count(self) -> int:
+        return int(self.matrix.sum())
+
+    def accuracy(self) -> float:
+        total = self.count
+        return float(np.trace(self.matrix) / total) if total else 0.0
+
+    def precision_recall_f1(self) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """Per-class precision, recall, F1 and support; 0 where a ratio is undefined (zero_division=0)."""
+        tp = np.diag(self.matrix).astype(np.float64)
+        predicted = self.matrix.sum(axis=0)
+        support = self.matrix.sum(axis=1)
+        precision = np.divide(tp, predicted, out=np.zeros_like(tp), where=predicted > 0)
+        recall = np.divide(tp, support, out=np.zeros_like(tp), where=support > 0)
+        denom = predicted + support
+        f1 = np.divide(2 * tp, denom, out=np.zeros_like(tp), where=denom > 0)
+        return precision, recall, f1, support
+
+    def f1_macro(self, present_only: bool = True) -> float:
+        """Unweighted mean F1; with present_only, over classes seen in y_true or y_pred (f1_score without labels=)."""
+        _, _, f1, _ = self.precision_recall_f1()
+        if present_only:
+            present = (self.matrix.sum(axis=0) + self.matrix.sum(axis=1)) > 0
+            f1 = f1[present]
+        return float(f1.mean()) if f1.size else 0.0
+
+    def classification_report(self, target_names: Sequence[str] | None = None) -> dict:
+        """Same structure and values as classification_report(..., output_dict=True, zero_division=0)."""
+        names = list(target_names) if target_names is not None else [str(i) for i in range(self.num_classes)]
+        precision, recall, f1, support = self.precision_recall_f1()
+        report: dict = {}
+        for i, name in enumerate(names):
+            report[name] = {
+                "precision": float(precision[i]),
+                "recall": float(recall[i]),
+                "f1-score": float(f1[i]),
+                "support": float(support[i]),
+            }
+        total = int(support.sum())
+        report["accuracy"] = self.accuracy()
+        # np.average with the raw supports as weights, exactly as sklearn does (normalizing first changes the rounding).
+        for avg, weights in (("macro avg", None), ("weighted avg", support if total else None)):
+            report[avg] = {
+                "precision": float(np.average(precision, weights=weights)),
+                "recall": float(np.average(recall, weights=weights)),
+                "f1-score": float(np.average(f1, weights=weights)),
+                "support": float(total),
+            }
+        return report
+
+    def metrics(self, labels: Sequence[str]) -> dict:
+        """accuracy, f1_macro, confusion_matrix and classification_report, as the notebooks' compute_metrics return."""
+        return {
+            "accuracy": self.accuracy(),
+            "f1_macro": self.f1_macro(),
+            "confusion_matrix": self.matrix.tolist(),
+            "classification_report": self.classification_report(labels),
+        }
+
+    def __str__(self) -> str:
+        return f"acc={self.accuracy():.4f} f1_macro={self.f1_macro():.4f} n={self.count}"
@@ -0,0 +1,278 @@
+from __future__ import annotations
+
+import heapq
+import multiprocessing
+import os
+import sys
+import time
+import warnings
+from collections.abc import Callable, Sequence
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, field
+
+import numpy as np
+
+from utils.cpu_inference import CPUInferenceConfig, configure_threads, cpu_threads
+
+DEFAULT_THREADS_PER_PROCESS = 4
+
+
+def available_cores() -> list[int]:
+    try:
+        return sorted(os.sched_getaffinity(0))
+    except AttributeError:  # pragma: no cover - non-Linux
+        return list(range(os.cpu_count() or 1))
+
+
+def default_layout(processes: int | None = None, threads: int | None = None) -> tuple[int, int]:
+    """(processes, threads per process) that together use the cores this process may run on.
+
+    Intra-op threading stops paying off after a few cores for small inference
+    batches, so the default is DEFAULT_THREADS_PER_PROCESS threads per process
+    and as many processes as fit.
+    """
+    cores = len(available_cores())
+    if processes is None and threads is None:
+        threads = min(DEFAULT_THREADS_PER_PROCESS, cores)
+    if processes is None:
+        processes = max(1, cores // threads)
+    if threads is None:
+        threads = max(1, cores // processes)
+    return processes, threads
+
+
+def shard_indices(n: int, shards: int, costs: Sequence[float] | np.ndarray | None = None) -> list[np.ndarray]:
+    """Split range(n) into at most `shards` index arrays, each in ascending order.
+
+    Without costs the shards are contiguous ranges of (nearly) equal size. With
+    per-item costs (clip or token lengths) items are assigned greedily,
+    most expensive first, to the shard with the least total cost, so shards
+    finish at about the same time and each sees the whole length distribution.
+    """
+    shards = max(1, min(shards, n))
+    if n == 0:
+        return []
+    if costs is None:
+        return [a for a in np.array_split(np.arange(n, dtype=np.int64), shards) if len(a)]
+    costs = np.asarray(costs, dtype=np.float64)
+    if costs.shape != (n,):
+        raise ValueError(f"costs must have one entry per item (expected {n}, got {costs.shape})")
+    heap = [(0.0, s) for s in range(shards)]
+    owner = np.empty(n, dtype=np.int64)
+    for i in np.argsort(-costs, kind="stable"):
+        load, s = heapq.heappop(heap)
+        owner[i] = s
+        heapq.heappush(heap, (load + float(costs[i]), s))
+    return [a for a in (np.flatnonzero(owner == s) for s in range(shards)) if len(a)]
+
+
+@dataclass(frozen=True)
+class ShardResult:
+    shard: int
+    pid: int
+    items: int
+    seconds: float
+
+
+@dataclass(frozen=True)
+class ScalingReport:
+    """Timing of one run_sharded call.
+
+    utilization: the share of processes x wall time spent inside fn (the rest is
+    startup, idle tail and result transfer). With a baseline_s (the wall time of
+    the same work in one process with the same thread count), speedup is
+    baseline_s / wall_s and efficiency is speedup / processes.
+    """
+
+    processes: int
+    threads: int
+    items: int
+    wall_s: float
+    items_per_s: float
+    utilization: float
+    baseline_s: float | None = None
+    speedup: float | None = None
+    efficiency: float | None = None
+    shards: list[ShardResult] = field(default_factory=list)
+
+    def __str__(self) -> str:
+        text = (f"{self.processes} proc x {self.threads} threads: {self.items} items in {self.wall_s:.2f} s "
+                f"({self.items_per_s:.1f}/s, utilization {self.utilization:.0%})")
+        if self.speedup is not None:
+            text += f", speedup {self.speedup:.2f}x, efficiency {self.efficiency:.0%}"
+        return text
+
+
+def _rebuild_model(cls: type, config, tensors: dict, training: bool) -> "SharedModel":
+    import torch
+
+    with torch.device("meta"):
+        model = cls(config)
+    for name, tensor in tensors.items():
+        owner, _, attr = name.rpartition(".")
+        module = model.get_submodule(owner)
+        slots = module._parameters if attr in module._parameters else module._buffers
+        slots[attr] = tensor
+    missing = [n for n, t in [*model.named_parameters(), *model.named_buffers()] if t.is_meta]
+    if missing:
+        raise RuntimeError(f"{cls.__name__} rebuilt without weights for {missing[:3]} (not in the shared tensors)")
+    return SharedModel(model.train(training))
+
+
+class SharedModel:
+    """Picklable handle on a transformers model, for fn's passed to run_sharded.
+
+    Pickling the model itself fails for parametrized modules (weight norm) and
+    modules with closure hooks, both common in transformers. The handle moves
+    the weights to shared memory and pickles the model's class, config and
+    tensors; a worker rebuilds the modules on the meta device and assigns the
+    shared tensors, so weights are neither copied nor re-initialized. Use
+    .model in fn (in the parent process it is the model passed in).
+    """
+
+    def __init__(self, model) -> None:
+        self.model = model.share_memory()
+
+    def __reduce__(self):
+        tensors = dict(self.model.named_parameters(remove_duplicate=False))
+        tensors.update(self.model.named_buffers(remove_duplicate=False))
+        return _rebuild_model, (type(self.model), self.model.config, tensors, self.model.training)
+
+
+# Per-worker state, set by _init_worker in each child.
+_WORKER_FN: Callable | None = None
+
+
+def _init_worker(fn: Callable, threads: int, cores: list[int] | None, counter) -> None:
+    global _WORKER_FN
+    _WORKER_FN = fn
+    if cores is not None:
+        with counter.get_lock():
+            slot = counter.value
+            counter.value += 1
+        os.sched_setaffinity(0, cores[slot * threads:(slot + 1) * threads])
+    configure_threads(threads, 1)
+
+
+def _run_shard(task: tuple[int, np.ndarray]) -> tuple[int, int, float, tuple]:
+    shard, indices = task
+    t0 = time.perf_counter()
+    outputs = _WORKER_FN(indices)
+    return shard, os.getpid(), time.perf_counter() - t0, outputs
+
+
+def _warn_if_threads_started() -> None:
+    torch = sys.modules.get("torch")
+    if torch is not None and torch.get_num_threads() > 1:
+        warnings.warn(
+            f"Forking after torch has used {torch.get_num_threads()} intra-op threads can deadlock the workers "
+            "(the OpenMP runtime is not fork-safe); use start_method='forkserver' or 'spawn', or call "
+            "torch.set_num_threads(1) before any torch work in this process.",
+            RuntimeWarning,
+            stacklevel=3,
+        )
+
+
+def _as_tuple(outputs) -> tuple:
+    return outputs if isinstance(outputs, tuple) else (outputs,)
+
+
+def run_sharded(
+    fn: Callable[[np.ndarray], np.ndarray | tuple[np.ndarray, ...]],
+    n: int,
+    *,
+    processes: int | None = None,
+    threads: int | None = None,
+    costs: Sequence[float] | np.ndarray | None = None,
+    shards_per_process: int = 1,
+    pin_cores: bool = True,
+    start_method: str | None = None,
+    baseline_s: float | None = None,
+    on_shard: Callable[[np.ndarray, tuple], None] | None = None,
+    log: bool = True,
+) -> tuple[tuple[np.ndarray, ...], ScalingReport]:
+    """Run fn over range(n) split across worker processes and merge the outputs in item order.
+
+    fn(indices) returns one array (or a tuple of arrays) with a row per index;
+    row j of the merged output is the row fn produced for item j, whichever
+    shard it ran in. Each process runs `threads` torch intra-op threads (and
+    one inter-op thread); with pin_cores, process k is bound to its own block
+    of `threads` cores when there are enough of them.
+
+    Workers start with "forkserver" where available (else "spawn"), so fn
+    must be picklable (a functools.partial of a module-level function). It is
+    sent to each worker once. Torch tensors in it travel as shared-memory
+    handles once share_memory_() was called on them; wrap models in
+    SharedModel so the weights exist once for all processes. The fork server
+    preloads torch and fn's module, so workers skip those imports.
+
+    start_method="fork" avoids pickling altogether. It is unsafe once the
+    parent has run torch ops on several threads, because forking a started
+    OpenMP runtime can deadlock the children; a warning is raised in that
+    case. on_shard(indices, outputs) runs in the parent as shards arrive,
+    e.g. to update a ConfusionMatrix.
+    """
+    processes, threads = default_layout(processes, threads)
+    shards = shard_indices(n, processes * max(1, shards_per_process), costs)
+    merged: list[np.ndarray] | None = None
+    results: list[ShardResult] = []
+
+    def merge(shard: int, pid: int, seconds: float, outputs) -> None:
+        nonlocal merged
+        outputs = _as_tuple(outputs)
+        indices = shards[shard]
+        if merged is None:
+            merged = [np.empty((n, *np.shape(o)[1:]), dtype=np.asarray(o).dtype) for o in outputs]
+        for out, o in zip(merged, outputs):
+            out[indices] = o
+        results.append(ShardResult(shard, pid, len(indices), round(seconds, 4)))
+        if on_shard is not None:
+            on_shard(indices, outputs)
+        if log:
+            done = sum(r.items for r in results)
+            print(f"shard {len(results)}/{len(shards)} ({done}/{n} items, pid {pid}, {seconds:.2f} s)", flush=True)
+
+    t0 = time.perf_counter()
+    processes = min(processes, len(shards)) or 1
+    if processes == 1:
+        with cpu_threads(CPUInferenceConfig(threads=threads)):
+            for s, indices in enumerate(shards):
+                t = time.perf_counter()
+                outputs = fn(indices)
+                merge(s, os.getpid(), time.perf_counter() - t, outputs)
+    else:
+        if start_method is None:
+            start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        ctx = multiprocessing.get_context(start_method)
+        if start_method == "fork":
+            _warn_if_threads_started()
+        elif start_method == "forkserver":
+            # Only takes effect when this process starts its fork server (the first forkserver pool).
+            ctx.set_forkserver_preload(["torch", getattr(fn, "func", fn).__module__])
+        cores = available_cores()
+        pinned = cores if pin_cores and sys.platform.startswith("linux") and processes * threads <= len(cores) else None
+        counter = ctx.Value("i", 0)
+        # A worker that dies (or fails to start) raises BrokenProcessPool here instead of hanging the run.
+        with ProcessPoolExecutor(processes, mp_context=ctx, initializer=_init_worker,
+                                 initargs=(fn, threads, pinned, counter)) as pool:
+            futures = [pool.submit(_run_shard, task) for task in enumerate(shards)]
+            for future in as_completed(futures):
+                merge(*future.result())
+    wall = time.perf_counter() - t0
+
+    busy = sum(r.seconds for r in results)
+    speedup = round(baseline_s / wall, 3) if baseline_s and wall > 0 else None
+    report = ScalingReport(
+        processes=processes,
+        threads=threads,
+        items=n,
+        wall_s=round(wall, 4),
+        items_per_s=round(n / wall, 2) if wall > 0 else float("inf"),
+        utilization=round(busy / (processes * wall), 3) if wall > 0 else 1.0,
+        baseline_s=baseline_s,
+        speedup=speedup,
+        efficiency=round(speedup / processes, 3) if speedup is not None else None,
+        shards=sorted(results, key=lambda r: r.shard),
+    )
+    return tuple(merged or ()), report
+